@@ -0,0 +1,166 @@
+"""
+Check the import time of each pyxll-jupyter entry point against a budget.
+
+Each entry point module is imported in a new Python process using
+``python -X importtime``, with the stand-in pyxll module in this folder.
+Entry points given as module:function also call that function, as PyXLL
+does for the 'modules' and 'ribbon' entry points when Excel starts.
+Only modules imported by the entry point itself are counted; modules that
+Python imports when it starts, and the pyxll module (which is already
+imported when running in Excel), are excluded.
+
+As well as a time budget, each entry point has a list of modules it must not
+import. For example, pyxll_jupyter.pyxll is imported when Excel starts and
+must not import the kernel or Qt, and the impl module imported on the first
+ribbon click must not import them until they're actually needed. Similarly
+the kernel module must not import the modules used to start and manage
+Jupyter servers, or the memory, namespace and profiling helpers, until
+they're used. The time spent importing pyxll-jupyter's own modules is
+reported separately as first_party_ms.
+
+The script exits with a non-zero exit code if any budget is exceeded or any
+disallowed module is imported, so it can be run as part of a CI job::
+
+    python benchmarks/bench_imports.py --repeat 5 -o imports.json
+
+Budgets can be overridden for slower machines using --budget module=ms.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+# Heavy modules that are only needed once the kernel is started
+_KERNEL_MODULES = ["pyxll_jupyter.kernel", "ipykernel", "IPython", "zmq", "tornado", "jupyter_client"]
+
+# Qt modules, only needed when opening Jupyter in a task pane
+_QT_MODULES = ["pyxll_jupyter.widgets", "PySide2", "PySide6", "PyQt5", "PyQt6"]
+
+# Modules the kernel only imports when starting or managing a Jupyter server, or when the feature is used
+_KERNEL_LAZY_MODULES = ["pyxll_jupyter.servers", "pyxll_jupyter.supervisor", "pyxll_jupyter.serverlog",
+                        "pyxll_jupyter.cmdcache", "pyxll_jupyter.processes", "pyxll_jupyter.profiler",
+                        "pyxll_jupyter.namespace", "pyxll_jupyter.memory", "secrets"]
+
+# Entry point -> (budget in ms, modules it must not import)
+ENTRY_POINTS = {
+    # Imported by PyXLL when Excel starts
+    "pyxll_jupyter.pyxll": (15.0, _KERNEL_MODULES + _QT_MODULES + ["pyxll_jupyter.pyxll.impl"]),
+    "pyxll_jupyter.pyxll:ribbon": (15.0, _KERNEL_MODULES + _QT_MODULES + ["pyxll_jupyter.pyxll.impl",
+                                                                          "importlib.resources"]),
+
+    # Imported on the first ribbon click or call to OpenJupyterNotebook
+    "pyxll_jupyter.pyxll.impl": (25.0, _KERNEL_MODULES + _QT_MODULES + ["pyxll_jupyter.onedrive"]),
+
+    # Imported when the kernel is started
+    "pyxll_jupyter.kernel": (1500.0, _QT_MODULES + _KERNEL_LAZY_MODULES + ["pyxll_jupyter.offload",
+                                                                           "multiprocessing",
+                                                                           "webbrowser"]),
+}
+
+
+def _importtime(statement):
+    """Run a statement with -X importtime in a new process and return {module: self time in us}."""
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.abspath(__file__))
+    root = os.path.dirname(here)
+    env["PYTHONPATH"] = os.pathsep.join([here, root] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed:\n{proc.stderr}")
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def _measure(entry_point, repeat):
+    """Return the time taken to import an entry point and the modules it imports, using the fastest of repeat runs."""
+    baseline = set(_importtime("import pyxll"))
+
+    module, _, func = entry_point.partition(":")
+    statement = f"import {module} as m; m.{func}()" if func else f"import {module}"
+
+    best = None
+    for _ in range(repeat):
+        times = {name: us for name, us in _importtime(statement).items() if name not in baseline}
+        total = sum(times.values())
+        if best is None or total < best[0]:
+            best = (total, times)
+
+    total, times = best
+    heaviest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:10]
+    return {
+        "total_ms": total / 1000,
+        "first_party_ms": sum(us for name, us in times.items() if _is_imported("pyxll_jupyter", [name])) / 1000,
+        "modules": len(times),
+        "heaviest_ms": {name: us / 1000 for name, us in heaviest},
+        "imported": sorted(times),
+    }
+
+
+def _is_imported(name, imported):
+    return any(module == name or module.startswith(name + ".") for module in imported)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times to import each entry point.")
+    parser.add_argument("--budget", action="append", default=[], help="Budget override as module=ms.")
+    parser.add_argument("--entry-point", action="append", default=[], help="Only check these entry points.")
+    parser.add_argument("-o", "--output", help="File to write the JSON results to (default stdout).")
+    args = parser.parse_args()
+
+    budgets = {module: budget for module, (budget, _) in ENTRY_POINTS.items()}
+    for override in args.budget:
+        module, _, ms = override.partition("=")
+        if module not in ENTRY_POINTS:
+            parser.error(f"Unknown entry point '{module}'.")
+        budgets[module] = float(ms)
+
+    results = {}
+    failures = []
+    for module, (_, disallowed) in ENTRY_POINTS.items():
+        if args.entry_point and module not in args.entry_point:
+            continue
+
+        result = _measure(module, args.repeat)
+        imported = result.pop("imported")
+        result["budget_ms"] = budgets[module]
+        result["disallowed"] = [name for name in disallowed if _is_imported(name, imported)]
+        results[module] = result
+
+        if result["total_ms"] > budgets[module]:
+            failures.append(f"{module} took {result['total_ms']:.1f}ms to import (budget {budgets[module]:.1f}ms)")
+        for name in result["disallowed"]:
+            failures.append(f"{module} imports {name}")
+
+    report = {
+        "python": sys.version,
+        "platform": platform.platform(),
+        "results": results,
+        "failures": failures,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
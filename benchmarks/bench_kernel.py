@@ -0,0 +1,175 @@
+"""
+Benchmark round-trip latency and throughput of the kernel running without Excel.
+
+The kernel is started with the stand-in pyxll module in this folder, and a
+jupyter_client BlockingKernelClient connects to it through its connection
+file. The following are measured:
+
+- latency: time from sending an execute_request to receiving its execute_reply
+- throughput: rate at which many small cells, all sent at once, are executed
+- iopub: rate at which stream output from a print-heavy cell is received
+- flush: the same as iopub, but flushing after every line as logging handlers do
+
+Results are written as JSON so they can be compared between releases.
+Each --run is a separate child process with its own kernel, and takes a
+comma separated list of JUPYTER config options. For example::
+
+    python benchmarks/bench_kernel.py --run wakeup=timer --run wakeup=zmq,adaptive_polling=1 -o results.json
+
+To compare stream messages per second with and without output coalescing::
+
+    python benchmarks/bench_kernel.py --run wakeup=zmq --run wakeup=zmq,coalesce_output=1
+"""
+from harness import run_kernel, execute, wait_for_idle, percentile
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _latency(client, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        execute(client, "pass")
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "requests": requests,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def _throughput(client, cells):
+    start = time.perf_counter()
+    msg_ids = {client.execute("x = 1", silent=True) for _ in range(cells)}
+    while msg_ids:
+        msg = client.get_shell_msg(timeout=60)
+        msg_ids.discard(msg["parent_header"].get("msg_id"))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "cells": cells,
+        "seconds": elapsed,
+        "cells_per_second": cells / elapsed,
+    }
+
+
+def _iopub(client, lines, flush=False):
+    code = f"for i in range({lines}):\n    print('line', i, flush={flush})"
+
+    start = time.perf_counter()
+    msg_id = client.execute(code)
+    messages = wait_for_idle(client, msg_id, timeout=120)
+    elapsed = time.perf_counter() - start
+
+    streams = [m for m in messages if m["msg_type"] == "stream"]
+    num_bytes = sum(len(m["content"]["text"]) for m in streams)
+    return {
+        "lines": lines,
+        "seconds": elapsed,
+        "stream_messages": len(streams),
+        "messages_per_second": len(streams) / elapsed,
+        "lines_per_second": lines / elapsed,
+        "bytes_per_second": num_bytes / elapsed,
+    }
+
+
+def _run(options, args):
+    """Run all benchmarks in this process and return the results as a dict."""
+    def client_func(client):
+        # Warm up
+        for _ in range(10):
+            execute(client, "pass")
+
+        return {
+            "latency": _latency(client, args.requests),
+            "throughput": _throughput(client, args.cells),
+            "iopub": _iopub(client, args.lines),
+            "flush": _iopub(client, args.flush_lines, flush=True),
+        }
+
+    results = run_kernel(client_func, **options)
+
+    # Include the kernel's own statistics about polling on the main thread
+    from pyxll_jupyter.kernel import get_kernel_stats
+    stats = get_kernel_stats()
+    results["kernel"] = {
+        "wakeup": stats["wakeup"],
+        "total_polls": stats["total_polls"],
+        "total_messages": stats["total_messages"],
+        "schedule_delay_p50_ms": (stats["schedule_delay"]["p50"] or 0) * 1000,
+        "poll_time_p50_ms": (stats["poll_time"]["p50"] or 0) * 1000,
+        "poll_time_p99_ms": (stats["poll_time"]["p99"] or 0) * 1000,
+    }
+
+    return results
+
+
+def _versions():
+    versions = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    for module in ("ipykernel", "jupyter_client", "zmq", "tornado", "IPython"):
+        try:
+            mod = __import__(module)
+            versions[module] = getattr(mod, "__version__", getattr(mod, "version", None))
+        except ImportError:
+            versions[module] = None
+    return versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--run", action="append", default=[],
+                        help="Comma separated JUPYTER config options (option=value) for one run.")
+    parser.add_argument("--requests", type=int, default=200, help="Number of execute requests for the latency test.")
+    parser.add_argument("--cells", type=int, default=500, help="Number of cells for the throughput test.")
+    parser.add_argument("--lines", type=int, default=20000, help="Number of lines printed for the iopub test.")
+    parser.add_argument("--flush-lines", type=int, default=2000, help="Number of lines printed for the flush test.")
+    parser.add_argument("-o", "--output", help="File to write the JSON results to (default stdout).")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        options = dict(o.split("=", 1) for o in args.child.split(",") if o)
+        print(json.dumps(_run(options, args)))
+        return
+
+    runs = []
+    for run in args.run or ["wakeup=timer", "wakeup=zmq"]:
+        cmd = [sys.executable, __file__, "--child", run,
+               "--requests", str(args.requests),
+               "--cells", str(args.cells),
+               "--lines", str(args.lines),
+               "--flush-lines", str(args.flush_lines)]
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        runs.append({
+            "config": dict(o.split("=", 1) for o in run.split(",") if o),
+            "results": json.loads(output.decode().strip().splitlines()[-1]),
+        })
+
+    report = {
+        "timestamp": time.time(),
+        "versions": _versions(),
+        "runs": runs,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
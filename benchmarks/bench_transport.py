@@ -0,0 +1,94 @@
+"""
+Compare execute_request latency for the 'tcp' and 'ipc' kernel transports.
+
+The kernel is started without Excel using the stand-in pyxll module in this
+folder. Each transport is run in its own child process as only one kernel can
+be started per process. The 'ipc' transport uses Unix domain sockets, so this
+runs on Linux (or Windows 10 and later with a libzmq that supports ipc).
+
+As well as the round-trip time of an execute_request, the time taken to
+receive stream output on the iopub channel is measured, as that is where
+most of the data sent by a notebook goes.
+
+Usage::
+
+    python benchmarks/bench_transport.py [--requests N] [--lines N] [--config option=value ...]
+
+Any --config options are set in the JUPYTER section of the config for both
+transports. The 'zmq' wakeup is used unless set otherwise, so that the time
+spent waiting for the next timer poll doesn't hide the difference.
+"""
+from harness import run_kernel, execute, wait_for_idle, percentile
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _run_transport(transport, num_requests, num_lines, options):
+    """Start the kernel in this process and return the measured latencies and iopub time."""
+    def client_func(client):
+        # Warm up
+        for _ in range(10):
+            execute(client, "pass")
+
+        latencies = []
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            execute(client, "pass")
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        msg_id = client.execute(f"for i in range({num_lines}): print(i, 'x' * 64)")
+        wait_for_idle(client, msg_id)
+        iopub_seconds = time.perf_counter() - start
+
+        return {
+            "transport": client.transport,
+            "latencies": latencies,
+            "iopub_seconds": iopub_seconds,
+        }
+
+    options.setdefault("wakeup", "zmq")
+    options["transport"] = transport
+    return run_kernel(client_func, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="Number of execute requests per transport.")
+    parser.add_argument("--lines", type=int, default=20000, help="Number of lines printed for the iopub test.")
+    parser.add_argument("--config", action="append", default=[], help="JUPYTER config option as option=value.")
+    parser.add_argument("--transport", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.transport:
+        options = dict(option.split("=", 1) for option in args.config)
+        result = _run_transport(args.transport, args.requests, args.lines, options)
+        print(json.dumps(result))
+        return
+
+    print(f"{'transport':<10}{'median (ms)':>14}{'p99 (ms)':>14}{'iopub (lines/s)':>18}")
+    for transport in ("tcp", "ipc"):
+        cmd = [sys.executable, __file__, "--transport", transport,
+               "--requests", str(args.requests),
+               "--lines", str(args.lines)]
+        for option in args.config:
+            cmd.extend(["--config", option])
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        if result["transport"] != transport:
+            print(f"{transport:<10} not available (the kernel used '{result['transport']}')")
+            continue
+
+        latencies = result["latencies"]
+        median = statistics.median(latencies) * 1000
+        p99 = percentile(latencies, 99) * 1000
+        lines_per_second = args.lines / result["iopub_seconds"]
+        print(f"{transport:<10}{median:>14.3f}{p99:>14.3f}{lines_per_second:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
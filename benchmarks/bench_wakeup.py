@@ -0,0 +1,67 @@
+"""
+Compare execute_request latency for the 'timer' and 'zmq' kernel wakeup modes.
+
+The kernel is started without Excel using the stand-in pyxll module in this
+folder. Each mode is run in its own child process as only one kernel can be
+started per process.
+
+Usage::
+
+    python benchmarks/bench_wakeup.py [--requests N] [--config option=value ...]
+
+Any --config options are set in the JUPYTER section of the config for both modes.
+"""
+from harness import run_kernel, execute, percentile
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _run_mode(mode, num_requests, options):
+    """Start the kernel in this process and return the measured latencies in seconds."""
+    def client_func(client):
+        # Warm up
+        for _ in range(10):
+            execute(client, "pass")
+
+        latencies = []
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            execute(client, "pass")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    options["wakeup"] = mode
+    return run_kernel(client_func, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="Number of execute requests per mode.")
+    parser.add_argument("--config", action="append", default=[], help="JUPYTER config option as option=value.")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        options = dict(option.split("=", 1) for option in args.config)
+        latencies = _run_mode(args.mode, args.requests, options)
+        print(json.dumps(latencies))
+        return
+
+    print(f"{'mode':<8}{'median (ms)':>14}{'p99 (ms)':>14}")
+    for mode in ("timer", "zmq"):
+        cmd = [sys.executable, __file__, "--mode", mode, "--requests", str(args.requests)]
+        for option in args.config:
+            cmd.extend(["--config", option])
+        output = subprocess.check_output(cmd)
+        latencies = json.loads(output.decode().strip().splitlines()[-1])
+        median = statistics.median(latencies) * 1000
+        p99 = percentile(latencies, 99) * 1000
+        print(f"{mode:<8}{median:>14.2f}{p99:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Run the pyxll_jupyter kernel without Excel for benchmarking.
+
+The stand-in pyxll module in this folder is used in place of the real one.
+The kernel is started on the calling thread, which then acts as Excel's
+main thread and runs everything passed to pyxll.schedule_call, while a
+jupyter_client BlockingKernelClient talks to the kernel from a background
+thread.
+
+Only one kernel can be started per process, so benchmarks comparing
+different settings run each in a separate child process.
+"""
+import os
+import sys
+import threading
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+
+def _setup_path():
+    """Make sure the stand-in pyxll module and this checkout of pyxll_jupyter are imported."""
+    for i, path in enumerate((_here, os.path.dirname(_here))):
+        if path not in sys.path:
+            sys.path.insert(i, path)
+
+
+def run_kernel(client_func, **options):
+    """Start the kernel and call client_func with a connected BlockingKernelClient.
+
+    This blocks, running the emulated main thread, until client_func returns.
+    Returns the value returned by client_func.
+
+    :param client_func: Function taking a BlockingKernelClient.
+    :param options: Options to set in the JUPYTER section of the config.
+    """
+    _setup_path()
+
+    import pyxll
+    pyxll.set_config(**options)
+
+    from jupyter_client import BlockingKernelClient
+    from pyxll_jupyter.kernel import start_kernel
+
+    app, token = start_kernel()
+
+    result = []
+    errors = []
+    stop_event = threading.Event()
+
+    def thread_func():
+        try:
+            client = BlockingKernelClient(connection_file=app.abs_connection_file)
+            client.load_connection_file()
+            client.start_channels()
+            try:
+                client.wait_for_ready(timeout=30)
+                result.append(client_func(client))
+            finally:
+                client.stop_channels()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            stop_event.set()
+
+    thread = threading.Thread(target=thread_func, daemon=True)
+    thread.start()
+    pyxll.run_main_thread(stop_event)
+
+    if errors:
+        raise errors[0]
+    return result[0]
+
+
+def execute(client, code, timeout=30):
+    """Send an execute_request and wait for its execute_reply."""
+    msg_id = client.execute(code)
+    while True:
+        msg = client.get_shell_msg(timeout=timeout)
+        if msg["parent_header"].get("msg_id") == msg_id:
+            return msg
+
+
+def wait_for_idle(client, msg_id, timeout=30):
+    """Read iopub messages until the kernel is idle after handling msg_id.
+    Returns the list of iopub messages for that request.
+    """
+    messages = []
+    while True:
+        msg = client.get_iopub_msg(timeout=timeout)
+        if msg["parent_header"].get("msg_id") != msg_id:
+            continue
+        messages.append(msg)
+        if msg["msg_type"] == "status" and msg["content"]["execution_state"] == "idle":
+            return messages
+
+
+def percentile(values, pct):
+    """Return the pct percentile of a list of values."""
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
@@ -0,0 +1,82 @@
+"""
+Stand-in for the pyxll module so the kernel can be run without Excel.
+
+Only the parts of the pyxll API used by pyxll_jupyter are provided.
+Functions passed to schedule_call are queued and run by run_main_thread,
+which should be called from the thread that started the kernel to emulate
+Excel's main thread.
+
+Config values for the JUPYTER section can be set using set_config.
+"""
+import configparser
+import logging
+import queue
+
+_log = logging.getLogger(__name__)
+
+_config = configparser.ConfigParser()
+_config.add_section("JUPYTER")
+
+_main_thread_queue = queue.Queue()
+
+
+def set_config(**options):
+    """Set options in the JUPYTER section of the config."""
+    for key, value in options.items():
+        _config.set("JUPYTER", key, str(value))
+
+
+def get_config():
+    return _config
+
+
+def schedule_call(func, *args, **kwargs):
+    """Queue a function to be called on the emulated main thread."""
+    _main_thread_queue.put((func, args, kwargs))
+
+
+def run_main_thread(stop_event):
+    """Run functions passed to schedule_call until stop_event is set."""
+    while not stop_event.is_set():
+        try:
+            func, args, kwargs = _main_thread_queue.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            _log.error("Error in scheduled call", exc_info=True)
+
+
+def xl_macro(*args, **kwargs):
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda func: func
+
+
+def xl_on_open(func):
+    return func
+
+
+def xl_app(*args, **kwargs):
+    raise RuntimeError("Excel is not available when running without Excel.")
+
+
+def plot(*args, **kwargs):
+    raise RuntimeError("Excel is not available when running without Excel.")
+
+
+def xlcAlert(message):
+    _log.warning(message)
+
+
+def create_ctp(*args, **kwargs):
+    raise RuntimeError("Excel is not available when running without Excel.")
+
+
+class XLCell:
+
+    @classmethod
+    def from_range(cls, *args, **kwargs):
+        raise RuntimeError("Excel is not available when running without Excel.")
+
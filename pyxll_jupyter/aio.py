@@ -0,0 +1,81 @@
+"""
+Awaitable helpers for using Excel from async notebook cells.
+
+The kernel's event loop is run in short slices on Excel's main thread, so
+a cell awaiting I/O gives control back to Excel between polls and resumes
+when its data is ready. The functions here let coroutines read and write
+Excel ranges in the same way: the work is scheduled on Excel's main thread
+and the coroutine awaits the result without blocking the event loop.
+
+For example, to fetch data concurrently while reading from Excel::
+
+    from pyxll_jupyter.aio import xl_get_async
+    import asyncio
+
+    tickers, prices = await asyncio.gather(
+        xl_get_async("A1:A100"),
+        fetch_prices()
+    )
+"""
+from .mainthread import run_on_main_thread_async
+from pyxll import xl_app, XLCell
+
+__all__ = [
+    "run_on_main_thread_async",
+    "xl_get_async",
+    "xl_set_async",
+]
+
+
+def _get_cell(address):
+    """Return an XLCell for an address, or for the current selection if address is None."""
+    xl = xl_app(com_package="win32com")
+
+    if address:
+        selection = xl.Range(address.strip("\"' "))
+    else:
+        selection = xl.Selection
+        if not selection:
+            raise Exception("Nothing selected")
+
+    return XLCell.from_range(selection)
+
+
+async def xl_get_async(address=None, type=None, auto_resize=True):
+    """Get a value from Excel without blocking the event loop.
+
+    :param address: Address of the range to get, or None for the current selection.
+    :param type: Datatype to convert the value to, e.g. "dataframe".
+    :param auto_resize: Expand the range to include all of the data around it.
+    """
+    def get_value():
+        cell = _get_cell(address)
+        if auto_resize:
+            cell = cell.options(auto_resize=True)
+        if type:
+            cell = cell.options(type=type)
+        return cell.value
+
+    return await run_on_main_thread_async(get_value)
+
+
+async def xl_set_async(address, value, type=None, formatter=None, auto_resize=True):
+    """Set a value in Excel without blocking the event loop.
+
+    :param address: Address of the range to set, or None for the current selection.
+    :param value: Value to set.
+    :param type: Datatype to convert the value from.
+    :param formatter: PyXLL Formatter to use when setting the value.
+    :param auto_resize: Resize the range to fit the value.
+    """
+    def set_value():
+        cell = _get_cell(address)
+        if auto_resize:
+            cell = cell.options(auto_resize=True)
+        if formatter is not None:
+            cell = cell.options(formatter=formatter)
+        if type:
+            cell = cell.options(type=type)
+        cell.value = value
+
+    await run_on_main_thread_async(set_value)
@@ -0,0 +1,142 @@
+"""
+On-disk cache of the command used to start the Jupyter server.
+
+Finding the command to run involves checking installed package versions,
+looking up entry points and searching the PATH, which can take seconds
+when Python is installed on a network drive. The result only changes when
+packages are installed or removed, so it's cached between Excel sessions.
+
+Cached commands are keyed on the Python executable and version, the PATH,
+and the modification times of the site-packages and Scripts folders.
+Installing or removing a package changes the modification time of its
+site-packages folder, and so invalidates the cache automatically.
+
+The cache can be turned off with::
+
+    [JUPYTER]
+    cache_jupyter_command = 0
+"""
+import threading
+import tempfile
+import hashlib
+import logging
+import json
+import site
+import sys
+import os
+
+_log = logging.getLogger(__name__)
+
+# Increment if the format of cached values changes
+_CACHE_VERSION = 1
+
+
+def _get_package_dirs():
+    """Return the folders packages and scripts are installed into."""
+    paths = []
+    try:
+        paths.extend(site.getsitepackages())
+        paths.append(site.getusersitepackages())
+    except AttributeError:
+        # Not available in some virtual environments
+        pass
+
+    # Other sys.path entries are ignored as they may be user code that changes often
+    paths.extend(p for p in sys.path if os.path.basename(p).lower() in ("site-packages", "dist-packages"))
+
+    if sys.executable:
+        paths.append(os.path.join(os.path.dirname(sys.executable), "Scripts"))
+
+    return sorted(set(os.path.normcase(os.path.abspath(p)) for p in paths if p))
+
+
+def get_cache_key():
+    """Return a key that changes when the installed packages or Python environment change."""
+    mtimes = []
+    for path in _get_package_dirs():
+        try:
+            mtimes.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            mtimes.append((path, None))
+
+    parts = {
+        "version": _CACHE_VERSION,
+        "executable": sys.executable,
+        "python": sys.version,
+        "env_path": os.environ.get("PATH", ""),
+        "mtimes": mtimes,
+    }
+
+    data = json.dumps(parts, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_default_cache_path():
+    """Return the path of the cache file, in the local (not roaming) app data folder if available."""
+    root = os.environ.get("LOCALAPPDATA") or tempfile.gettempdir()
+    return os.path.join(root, "pyxll-jupyter", "command-cache.json")
+
+
+class CommandCache:
+    """Stores JSON serializable values in a file, discarding them when the cache key changes.
+
+    :param path: Path of the cache file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_default_cache_path()
+        self.__lock = threading.Lock()
+
+    def __load(self, key):
+        try:
+            with open(self.path, "rt", encoding="utf-8") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            _log.debug(f"Unable to read command cache '{self.path}'.", exc_info=True)
+            return {}
+
+        if not isinstance(data, dict) or data.get("key") != key:
+            _log.debug("Command cache is out of date.")
+            return {}
+
+        values = data.get("values")
+        return values if isinstance(values, dict) else {}
+
+    def __save(self, key, values):
+        # Write to a temporary file first so other Excel processes never see a partial file
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "wt", encoding="utf-8") as fh:
+                json.dump({"key": key, "values": values}, fh, indent=2)
+            os.replace(tmp, self.path)
+        except OSError:
+            _log.debug(f"Unable to write command cache '{self.path}'.", exc_info=True)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def get(self, name, key=None):
+        """Return the cached value for name, or None if not cached or the key has changed."""
+        key = key or get_cache_key()
+        with self.__lock:
+            return self.__load(key).get(name)
+
+    def set(self, name, value, key=None):
+        """Cache a value for name."""
+        key = key or get_cache_key()
+        with self.__lock:
+            values = self.__load(key)
+            values[name] = value
+            self.__save(key, values)
+
+    def remove(self, name):
+        """Remove the cached value for name, if there is one."""
+        key = get_cache_key()
+        with self.__lock:
+            values = self.__load(key)
+            if values.pop(name, None) is not None:
+                self.__save(key, values)
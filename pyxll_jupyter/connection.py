@@ -0,0 +1,140 @@
+"""
+Connection info for the IPython kernel running in Excel.
+
+The Jupyter server is started as a child process of Excel with the path of
+the kernel's connection file in the PYXLL_IPYTHON_CONNECTION_FILE
+environment variable, and the connection info itself as compact JSON in
+PYXLL_IPYTHON_CONNECTION_INFO. These functions are used by the kernel
+provisioner and kernel managers running in the Jupyter server process to
+connect to it.
+
+The connection info is taken from the environment if it's there, so the
+connection file doesn't have to be read each time a notebook is opened.
+Otherwise the file is read, and what was read is reused for as long as the
+file's modification time and size don't change.
+
+The kernel may use either the 'tcp' or 'ipc' ZMQ transport (see the
+'transport' option). For 'ipc', the connection info's 'ip' is the path
+prefix of the kernel's Unix domain sockets, and each port is the suffix of
+one of the socket paths.
+"""
+import threading
+import logging
+import json
+import os
+
+_log = logging.getLogger(__name__)
+
+_port_names = ("shell_port", "stdin_port", "iopub_port", "hb_port", "control_port")
+
+# Environment variable the connection info is passed in
+_connection_info_env = "PYXLL_IPYTHON_CONNECTION_INFO"
+
+# Connection info from the environment, or None if not parsed yet
+_env_connection_info = None
+
+# Connection file path -> (mtime, size, connection info)
+_file_cache = {}
+_lock = threading.Lock()
+
+
+def get_connection_file():
+    """Return the path of the kernel's connection file from the environment."""
+    connection_file = os.environ["PYXLL_IPYTHON_CONNECTION_FILE"]
+    if not os.path.isabs(connection_file):
+        connection_dir = os.path.join(os.environ.get("APPDATA", ""), "jupyter", "runtime")
+        connection_file = os.path.join(connection_dir, connection_file)
+
+    if not os.path.exists(connection_file):
+        _log.warning(f"Jupyter connection file '{connection_file}' does not exist.")
+
+    return connection_file
+
+
+def get_ipc_paths(info):
+    """Return the socket paths used by a kernel with the 'ipc' transport, or an empty list for 'tcp'."""
+    if info.get("transport", "tcp") != "ipc":
+        return []
+    return [f"{info['ip']}-{info[name]}" for name in _port_names if info.get(name)]
+
+
+def encode_connection_info(info):
+    """Return the environment variables used to pass connection info to the Jupyter server."""
+    info = dict(info)
+    if isinstance(info.get("key"), bytes):
+        info["key"] = info["key"].decode("ascii")
+    info = {k: v for k, v in info.items() if isinstance(v, (str, int))}
+    return {_connection_info_env: json.dumps(info, separators=(",", ":"))}
+
+
+def _check_connection_info(info, connection_file):
+    """Make sure info is a usable connection info dict, resolving any relative ipc path."""
+    if not isinstance(info, dict) or "key" not in info or not info.get("ip"):
+        raise ValueError("Connection info is missing 'key' or 'ip'.")
+
+    if info.get("transport", "tcp") == "ipc":
+        if not os.path.isabs(info["ip"]):
+            info["ip"] = os.path.join(os.path.dirname(os.path.abspath(connection_file)), info["ip"])
+
+        for path in get_ipc_paths(info):
+            if not os.path.exists(path):
+                _log.warning(f"Kernel ipc socket '{path}' does not exist.")
+
+        _log.info(f"Connecting to the PyXLL IPython kernel using ipc sockets '{info['ip']}-*'.")
+
+    return info
+
+
+def read_connection_info(connection_file):
+    """Read the kernel's connection info from its connection file.
+
+    If the kernel uses the 'ipc' transport, a relative socket path prefix is taken
+    as relative to the connection file, and a warning is logged for any sockets
+    that don't exist.
+    """
+    with open(connection_file) as f:
+        info = json.load(f)
+    return _check_connection_info(info, connection_file)
+
+
+def _get_env_connection_info():
+    """Return the connection info passed in the environment, or None."""
+    global _env_connection_info
+    if _env_connection_info is None:
+        data = os.environ.get(_connection_info_env)
+        if not data:
+            return None
+        try:
+            connection_file = os.environ.get("PYXLL_IPYTHON_CONNECTION_FILE", "")
+            _env_connection_info = _check_connection_info(json.loads(data), connection_file)
+        except ValueError:
+            _log.warning(f"Unable to use the connection info in {_connection_info_env}; "
+                         "the connection file will be used instead.", exc_info=True)
+            os.environ.pop(_connection_info_env, None)
+            return None
+        _log.info("PyXLL IPython kernel connection info passed in the environment.")
+    return _env_connection_info
+
+
+def get_connection_info():
+    """Return the kernel's connection info.
+
+    The connection info passed in the environment is used if available. Otherwise
+    the connection file is read, unless it's not changed since it was last read.
+    Returns a new dict each time so it can be modified by the caller.
+    """
+    with _lock:
+        info = _get_env_connection_info()
+        if info is not None:
+            return dict(info)
+
+        connection_file = get_connection_file()
+        stat = os.stat(connection_file)
+        cached = _file_cache.get(connection_file)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return dict(cached[2])
+
+        _log.info(f'PyXLL IPython kernel = {connection_file}')
+        info = read_connection_info(connection_file)
+        _file_cache[connection_file] = (stat.st_mtime_ns, stat.st_size, info)
+        return dict(info)
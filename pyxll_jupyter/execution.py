@@ -0,0 +1,150 @@
+"""
+Running notebook cells on a worker thread instead of Excel's main thread.
+
+By default every cell runs on Excel's main thread, as that is where the
+kernel's event loop is polled, and so Excel is unresponsive while a cell
+is running. Cells can instead be run on a dedicated worker thread by
+setting the following in the pyxll.cfg file::
+
+    [JUPYTER]
+    execute_in_thread = 1
+
+The kernel's event loop is still polled on Excel's main thread. Calls to
+xl_app, XLCell and the Excel magic functions made from the worker thread
+are run on Excel's main thread (see the mainthread module).
+"""
+from .mainthread import is_main_thread
+import concurrent.futures
+import contextlib
+import contextvars
+import threading
+import asyncio
+import inspect
+import logging
+
+_log = logging.getLogger(__name__)
+
+
+class ThreadedExecution:
+    """Runs a kernel's execute requests on a dedicated worker thread.
+
+    Only one cell is run at a time, as the kernel waits for each execute
+    request to complete before handling the next shell message.
+
+    :param notify: Function called when a cell completes so the kernel's
+                   event loop can be polled to send the reply.
+    """
+
+    def __init__(self, notify):
+        self.__notify = notify
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                thread_name_prefix="pyxll-jupyter-kernel")
+        self.__thread_ids = set()
+        self.__loop = None
+
+    def is_worker_thread(self):
+        """Return True if called from the worker thread."""
+        return threading.get_ident() in self.__thread_ids
+
+    def install(self, kernel):
+        """Replace the kernel's do_execute method so that it runs on the worker thread."""
+        do_execute = kernel.do_execute
+
+        async def threaded_do_execute(*args, **kwargs):
+            # Copy the context so output is associated with the current request
+            context = contextvars.copy_context()
+            future = self.__executor.submit(context.run, self.__run, do_execute, args, kwargs)
+            result = asyncio.wrap_future(future)
+            future.add_done_callback(lambda f: self.__notify())
+            return await result
+
+        kernel.do_execute = threaded_do_execute
+
+        # SIGINT handlers can only be installed on the main thread
+        cancel_on_sigint = kernel._cancel_on_sigint
+
+        def threaded_cancel_on_sigint(future):
+            if is_main_thread():
+                return cancel_on_sigint(future)
+            return contextlib.nullcontext()
+
+        kernel._cancel_on_sigint = threaded_cancel_on_sigint
+
+    def __run(self, func, args, kwargs):
+        """Called on the worker thread to run do_execute."""
+        self.__thread_ids.add(threading.get_ident())
+
+        # Each worker thread has its own event loop for running async cells
+        if self.__loop is None:
+            self.__loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.__loop)
+
+        result = func(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = self.__loop.run_until_complete(result)
+        return result
+
+
+class ThreadStream:
+    """File-like object that writes to one stream when used from the kernel's
+    worker thread and to another from any other thread.
+
+    This is used in place of sys.stdout and sys.stderr so that output from cells
+    running on the worker thread goes to the notebook, and output from Excel's
+    main thread (e.g. PyXLL functions) goes to the original stream. Output from
+    calls made on the main thread on behalf of the worker thread is sent to the
+    notebook using redirect.
+
+    :param default: Stream used by all other threads.
+    :param kernel_stream: Stream used by the kernel's worker thread.
+    :param is_worker_thread: Function returning True when called from the worker thread.
+    """
+
+    def __init__(self, default, kernel_stream, is_worker_thread):
+        self.__default = default
+        self.__kernel_stream = kernel_stream
+        self.__is_worker_thread = is_worker_thread
+        self.__local = threading.local()
+
+    def __stream(self):
+        stream = getattr(self.__local, "stream", None)
+        if stream is not None:
+            return stream
+        return self.__kernel_stream if self.__is_worker_thread() else self.__default
+
+    def redirect(self):
+        """Return a context manager that sends output from the thread it's entered on
+        to the stream used by the thread calling this method.
+        """
+        return self.__redirect(self.__stream())
+
+    @contextlib.contextmanager
+    def __redirect(self, stream):
+        prev = getattr(self.__local, "stream", None)
+        self.__local.stream = stream
+        try:
+            yield
+        finally:
+            self.__local.stream = prev
+
+    def write(self, data):
+        return self.__stream().write(data)
+
+    def writelines(self, lines):
+        return self.__stream().writelines(lines)
+
+    def flush(self):
+        return self.__stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.__stream(), name)
+
+
+def route_streams(stdout, stderr, ipy_stdout, ipy_stderr, execution):
+    """Return (stdout, stderr) to use in place of sys.stdout and sys.stderr
+    so that output from the worker thread goes to the notebook.
+    """
+    return (
+        ThreadStream(stdout, ipy_stdout, execution.is_worker_thread),
+        ThreadStream(stderr, ipy_stderr, execution.is_worker_thread)
+    )
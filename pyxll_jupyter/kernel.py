@@ -9,6 +9,14 @@ that the following is added to the pyxll.cfg file:
 executable = <path to your python installation>/pythonw.exe
 """
 from .magic import ExcelMagics
+from .polling import create_wakeup, create_idle_wakeup, get_pending_work, AdaptiveInterval, DutyCycleGovernor, MessageCounter
+from .polling import IdleMonitor
+from .stats import KernelStats
+from .execution import ThreadedExecution, route_streams
+from .output import OutputCoalescer
+from .sessions import SessionRegistry
+from .connection import encode_connection_info
+from .mainthread import set_main_thread, set_notify, patch_pyxll
 from ipykernel.kernelapp import IPKernelApp
 from ipykernel.embed import embed_kernel
 from pyxll import schedule_call, get_config
@@ -20,8 +28,8 @@ import threading
 import logging
 import ctypes
 import atexit
-import queue
 import uuid
+import collections
 import zmq
 import sys
 import os
@@ -67,16 +75,43 @@ _subcommand_query_params = {
     "lab": []
 }
 
+# Interface Jupyter servers listen on when their port is pre-assigned
+_preassigned_host = "127.0.0.1"
+
 _log = logging.getLogger(__name__)
-_all_jupyter_processes = {}
 
-# Set to True if the kernel can be paused
-_pause_kernel = False
-_pause_kernal_condition = threading.Condition()
+# Sessions returned by start_kernel, with any Jupyter processes they use
+_sessions = SessionRegistry()
+
+# Jupyter server processes shared between sessions, see _get_server_pool
+_server_pool = None
+
+# Cache of the commands used to start Jupyter, see _get_command_cache
+_command_cache = None
+
+# Reports from the most recent StartupProfiles, see get_startup_reports
+_startup_reports = collections.deque(maxlen=20)
+
+# (connection file, environment variables) used to pass the kernel's connection info to Jupyter
+_connection_info_env = None
+
+# Output of recently started Jupyter servers by pid, see get_server_output
+_server_outputs = collections.OrderedDict()
+
+# Object used to wait between polls of the kernel, set when the kernel starts
+_kernel_wakeup = None
 
-# Dict of tokens retured from start_kernel to True or False, set
-# by pause_kernel and resume_kernel.
-_kernal_paused_state = {}
+# Function that wakes the thread waiting between polls of the kernel, set when the kernel starts
+_kernel_notify = None
+
+# Tracks whether any frontend is using the kernel, set when the kernel starts if idle_timeout is set
+_idle_monitor = None
+
+# Statistics recorded for each poll of the kernel, see _get_kernel_stats
+_kernel_stats = None
+
+# Limits the memory held by the kernel's output history, set when the kernel starts
+_memory_manager = None
 
 
 try:
@@ -150,7 +185,7 @@ def _get_connection_dir(app):
 
     # If Excel is installed as a UWP then AppData will appear as a different folder when the
     # child Python process is run so use a different path.
-    excel_path = _get_excel_path()
+    excel_path = _get_excel_path() if sys.platform == "win32" else ""
     if "WindowsApps" in re.split(r"[/\\]+", excel_path):
         _log.debug("Excel looks like a UWP app.")
         if "AppData" in re.split(r"[/\\]+", connection_dir):
@@ -162,6 +197,326 @@ def _get_connection_dir(app):
     return connection_dir
 
 
+def _get_transport():
+    """Return the ZMQ transport used by the kernel, either 'tcp' or 'ipc'."""
+    transport = "tcp"
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "transport"):
+        transport = cfg.get("JUPYTER", "transport").strip().lower() or transport
+        if transport not in ("tcp", "ipc"):
+            _log.error(f"Unexpected value '{transport}' for JUPYTER.transport. Expected 'tcp' or 'ipc'.")
+            transport = "tcp"
+
+    if transport == "ipc" and not zmq.has("ipc"):
+        _log.warning("The ZMQ 'ipc' transport is not available; 'tcp' will be used instead.")
+        transport = "tcp"
+
+    return transport
+
+
+def _set_transport(app, transport):
+    """Configure the IPKernelApp to use a ZMQ transport before it's initialized.
+
+    For 'ipc', the kernel's sockets are Unix domain sockets in the connection dir
+    named kernel-<pid>-ipc-<n>. The Jupyter server reads them from the connection file.
+    """
+    if transport != "ipc":
+        return
+
+    path = os.path.join(os.path.abspath(app.connection_dir), f"kernel-{os.getpid()}-ipc")
+
+    # Unix domain socket paths are limited to 107 characters, including the '-<n>' suffix
+    if len(path) > 100:
+        _log.warning(f"The path '{path}' is too long to be used for the kernel's ipc sockets; "
+                     "'tcp' will be used instead. Set 'runtime_dir' in the '[JUPYTER]' section "
+                     "of your pyxll.cfg to use a shorter path.")
+        return
+
+    _log.debug(f"Using ipc transport for the IPython kernel ({path}).")
+    app.transport = "ipc"
+    app.ip = path
+
+
+def _get_wakeup_mode():
+    """Return how the kernel's event loop is woken, either 'timer' or 'zmq'."""
+    wakeup = "timer"
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "wakeup"):
+        wakeup = cfg.get("JUPYTER", "wakeup").strip().lower() or wakeup
+        if wakeup not in ("timer", "zmq"):
+            _log.error(f"Unexpected value '{wakeup}' for JUPYTER.wakeup. Expected 'timer' or 'zmq'.")
+            wakeup = "timer"
+
+    return wakeup
+
+
+def _get_float_option(cfg, option, default):
+    """Return a float option from the JUPYTER section of the config, or default if not set."""
+    if cfg.has_option("JUPYTER", option):
+        try:
+            return float(cfg.get("JUPYTER", option))
+        except (ValueError, TypeError):
+            _log.error(f"Unexpected value for JUPYTER.{option}.")
+    return default
+
+
+def _get_adaptive_interval():
+    """Return an AdaptiveInterval if adaptive polling is enabled, or None."""
+    cfg = get_config()
+
+    adaptive_polling = False
+    if cfg.has_option("JUPYTER", "adaptive_polling"):
+        try:
+            adaptive_polling = bool(int(cfg.get("JUPYTER", "adaptive_polling")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.adaptive_polling.")
+
+    if not adaptive_polling:
+        return None
+
+    try:
+        return AdaptiveInterval(min_interval=_get_float_option(cfg, "poll_min_interval", 0.005),
+                                max_interval=_get_float_option(cfg, "poll_max_interval", 1.0),
+                                decay=_get_float_option(cfg, "poll_decay", 1.5))
+    except ValueError as e:
+        _log.error(f"Invalid adaptive polling settings ({e}); using the defaults.")
+        return AdaptiveInterval()
+
+
+def _get_slice_budget():
+    """Return the maximum time in seconds to spend draining the kernel's event
+    loop in a single poll, or 0 to only run the event loop once per poll.
+    """
+    return max(_get_float_option(get_config(), "poll_slice_budget", 0.0), 0.0)
+
+
+def _get_duty_cycle_governor():
+    """Return a DutyCycleGovernor if max_duty_cycle is set, or None."""
+    cfg = get_config()
+    max_duty_cycle = _get_float_option(cfg, "max_duty_cycle", 1.0)
+    window = _get_float_option(cfg, "duty_cycle_window", 1.0)
+
+    if max_duty_cycle >= 1.0:
+        return None
+
+    try:
+        return DutyCycleGovernor(max_duty_cycle=max_duty_cycle, window=window)
+    except ValueError as e:
+        _log.error(f"Invalid duty cycle settings ({e}); the kernel's duty cycle will not be limited.")
+        return None
+
+
+def _get_idle_monitor():
+    """Return an IdleMonitor if idle_timeout is set, or None."""
+    idle_timeout = _get_float_option(get_config(), "idle_timeout", 0.0)
+    if idle_timeout <= 0:
+        return None
+    return IdleMonitor(idle_timeout=idle_timeout)
+
+
+def _get_kernel_stats():
+    """Return the KernelStats object used to record statistics about the kernel."""
+    global _kernel_stats
+    if _kernel_stats is None:
+        size = 1000
+        cfg = get_config()
+        if cfg.has_option("JUPYTER", "stats_history"):
+            try:
+                size = max(int(cfg.get("JUPYTER", "stats_history")), 1)
+            except (ValueError, TypeError):
+                _log.error("Unexpected value for JUPYTER.stats_history.")
+        _kernel_stats = KernelStats(size)
+    return _kernel_stats
+
+
+def get_kernel_stats():
+    """Return a dict summarizing how the kernel has been polled on Excel's main thread.
+
+    The summary includes the delay between scheduling each poll and it running,
+    the time spent in each poll, the number of messages handled by each poll,
+    the number of times each session has paused and resumed the kernel, and
+    whether polling has been stopped because the kernel is idle.
+    """
+    summary = _get_kernel_stats().summary()
+    summary["wakeup"] = _kernel_wakeup.name if _kernel_wakeup is not None else None
+    summary["poll_interval"] = get_poll_interval()
+    summary["idle"] = _idle_monitor.info() if _idle_monitor is not None else None
+    return summary
+
+
+def reset_kernel_stats():
+    """Clear the statistics returned by get_kernel_stats."""
+    _get_kernel_stats().reset()
+
+
+def _get_memory_manager(shell):
+    """Return the MemoryManager used to limit the output history of the kernel's shell."""
+    from .memory import MemoryManager
+
+    cfg = get_config()
+
+    def get_mb(option, default):
+        return int(max(_get_float_option(cfg, option, default), 0) * 1024 * 1024)
+
+    max_outputs = 0
+    if cfg.has_option("JUPYTER", "output_history"):
+        try:
+            max_outputs = max(int(cfg.get("JUPYTER", "output_history")), 0)
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.output_history.")
+
+    return MemoryManager(shell,
+                         max_outputs=max_outputs,
+                         max_output_bytes=get_mb("output_history_size", 0),
+                         memory_limit=get_mb("memory_limit", 0),
+                         evict_min_size=get_mb("memory_evict_min_size", 1))
+
+
+def get_memory_usage(count=20):
+    """Return a dict describing the memory used by the kernel, or None if the kernel has not been started.
+
+    The dict contains Excel's resident memory and the memory limit, the number and
+    estimated size of the results in the output history, and the 'count' largest
+    objects in the kernel's namespace (or all of them if count is 0).
+    """
+    if _memory_manager is None:
+        return None
+    return _memory_manager.usage(count)
+
+
+def evict_outputs(min_size=None):
+    """Remove results of at least min_size bytes from the kernel's output history.
+
+    If min_size is None then the 'memory_evict_min_size' option is used. Returns
+    the number of results removed.
+    """
+    if _memory_manager is None:
+        return 0
+    return len(_memory_manager.evict_large(min_size))
+
+
+def _get_save_namespace_on_release():
+    """Return True if the kernel's namespace should be saved each time a session is released."""
+    save_namespace_on_release = False
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "save_namespace_on_release"):
+        try:
+            save_namespace_on_release = bool(int(cfg.get("JUPYTER", "save_namespace_on_release")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.save_namespace_on_release.")
+
+    return save_namespace_on_release
+
+
+def _get_load_namespace_on_start():
+    """Return True if the saved namespace should be restored when the kernel starts."""
+    load_namespace_on_start = False
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "load_namespace_on_start"):
+        try:
+            load_namespace_on_start = bool(int(cfg.get("JUPYTER", "load_namespace_on_start")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.load_namespace_on_start.")
+
+    return load_namespace_on_start
+
+
+def _get_lazy_load_namespace():
+    """Return True if the namespace restored when the kernel starts should be loaded lazily."""
+    lazy_load_namespace = False
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "lazy_load_namespace"):
+        try:
+            lazy_load_namespace = bool(int(cfg.get("JUPYTER", "lazy_load_namespace")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.lazy_load_namespace.")
+
+    return lazy_load_namespace
+
+
+def _save_namespace():
+    """Save the kernel's namespace to the default snapshot, if the kernel is running."""
+    from .namespace import save_namespace
+
+    if not sys._ipython_app or not sys._ipython_kernel_running:
+        return
+
+    try:
+        saved, errors = save_namespace(sys._ipython_app.shell)
+        for name, error in errors.items():
+            _log.warning(f"Variable '{name}' could not be saved: {error}")
+    except Exception:
+        _log.error("Error saving the IPython kernel's namespace", exc_info=True)
+
+
+def _get_execute_in_thread():
+    """Return True if cells should be run on a worker thread instead of Excel's main thread."""
+    execute_in_thread = False
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "execute_in_thread"):
+        try:
+            execute_in_thread = bool(int(cfg.get("JUPYTER", "execute_in_thread")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.execute_in_thread.")
+
+    return execute_in_thread
+
+
+def _get_preassign_port():
+    """Return True if Jupyter servers should be started on a port and token chosen in advance."""
+    preassign_port = False
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "preassign_port"):
+        try:
+            preassign_port = bool(int(cfg.get("JUPYTER", "preassign_port")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.preassign_port.")
+
+    return preassign_port
+
+
+def _get_output_coalescer(stdout, stderr, notify):
+    """Return an OutputCoalescer if coalesce_output is set, or None."""
+    cfg = get_config()
+
+    coalesce_output = False
+    if cfg.has_option("JUPYTER", "coalesce_output"):
+        try:
+            coalesce_output = bool(int(cfg.get("JUPYTER", "coalesce_output")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.coalesce_output.")
+
+    if not coalesce_output:
+        return None
+
+    try:
+        return OutputCoalescer(stdout,
+                               stderr,
+                               notify=notify,
+                               flush_size=int(_get_float_option(cfg, "output_flush_size", 65536)),
+                               max_rate=_get_float_option(cfg, "output_max_rate", 0.0),
+                               max_size=int(_get_float_option(cfg, "output_max_size", 0)))
+    except ValueError as e:
+        _log.error(f"Invalid output settings ({e}); using the defaults.")
+        return OutputCoalescer(stdout, stderr, notify=notify)
+
+
+def get_poll_interval():
+    """Return the current interval in seconds between polls of the kernel,
+    or None if the kernel has not been started.
+    """
+    if _kernel_wakeup is None:
+        return None
+    return _kernel_wakeup.interval
+
+
 class PushStdout:
     """Context manage to temporarily replace stdout/stderr."""
 
@@ -184,17 +539,25 @@ def release_kernel(token):
     """Call when the Jupyter kernel created by launch_jupyter is no longer needed."""
     _log.debug(f"Releasing kernel session {token}")
 
-    # Pause the kernel if it is no longer needed
-    pause_kernel(token)
+    # Save the namespace so it can be restored after Excel is restarted
+    if _get_save_namespace_on_release():
+        _save_namespace()
 
-    # Remove it from the paused state dict
-    with _pause_kernal_condition:
-        _kernal_paused_state.pop(token, None)
+    # Pause the kernel if it is no longer needed and stop tracking the session
+    shared = _server_pool is not None and token in _server_pool
+    session = _sessions.release(token)
 
-    # And kill any jupyter process associated with this token
-    proc = _all_jupyter_processes.pop(token, None)
-    if proc is not None:
-        kill_process(proc)
+    # Kill the Jupyter server if this was the last session using it
+    if shared:
+        server = _server_pool.release(token)
+        if server is not None:
+            _log.debug(f"Stopping Jupyter server {server.process.pid} as it is no longer used.")
+            kill_process(server.process)
+        return
+
+    # Or kill any jupyter process associated with this token that isn't in the pool
+    if session is not None and session.process is not None:
+        kill_process(session.process)
 
 
 def pause_kernel(token):
@@ -204,20 +567,7 @@ def pause_kernel(token):
     This will only cause the kernel to be paused once there are no callers
     of start_kernel that need the kernel to be running.
     """
-    global _pause_kernel
-
-    with _pause_kernal_condition:
-        _kernal_paused_state[token] = True
-        running_count = sum((1 for paused in _kernal_paused_state.values() if not paused))
-
-        if not _pause_kernel:
-            if running_count > 0:
-                _log.debug(f"Kernel cannot be paused for session {token} as other Jupyter sessions are active")
-            else:
-                _log.debug(f"Kernel paused by session {token}")
-
-        _pause_kernel = running_count == 0
-        _pause_kernal_condition.notify_all()
+    _sessions.pause(token)
 
 
 def resume_kernel(token):
@@ -225,16 +575,47 @@ def resume_kernel(token):
     and should be resumed, if currently paused.
 
     """
-    global _pause_kernel
+    _sessions.resume(token)
+
+
+def get_sessions():
+    """Return a list of dicts describing each session using the kernel.
+
+    Each dict contains the session's token, the pid of its Jupyter process
+    (if any) and whether that process is still running, its URL, when it
+    started and was last active, whether it's paused, and the time spent
+    polling the kernel on Excel's main thread and number of messages handled
+    while the session was running.
+    """
+    return _sessions.list()
+
+
+def add_session_hook(event, func):
+    """Add a function to be called when a session is 'added', 'paused', 'resumed'
+    or 'released'. The function is called with a dict describing the session
+    (see get_sessions).
+    """
+    _sessions.add_hook(event, func)
+
+
+def remove_session_hook(event, func):
+    """Remove a function added using add_session_hook."""
+    _sessions.remove_hook(event, func)
+
+
+def _record_session_transition(info):
+    """Session hook that records pause and resume transitions in the kernel stats."""
+    _get_kernel_stats().record_transition(info["token"], info["paused"])
+
 
-    with _pause_kernal_condition:
-        _kernal_paused_state[token] = False
+def _remove_session_stats(info):
+    """Session hook that stops tracking a released session in the kernel stats."""
+    _get_kernel_stats().remove_session(info["token"])
 
-        if _pause_kernel:
-            _log.debug(f"Kernel resumed by session {token}")
 
-        _pause_kernel = False
-        _pause_kernal_condition.notify_all()
+_sessions.add_hook("paused", _record_session_transition)
+_sessions.add_hook("resumed", _record_session_transition)
+_sessions.add_hook("released", _remove_session_stats)
 
 
 def start_kernel():
@@ -245,6 +626,10 @@ def start_kernel():
 
     release_kernel should be called when the kernel is no longer needed.
     """
+    global _memory_manager
+    from .namespace import load_namespace
+    from .profiler import phase
+
     token = uuid.uuid1()
     _log.debug(f"Starting kernel session {token}.")
 
@@ -252,13 +637,32 @@ def start_kernel():
         resume_kernel(token)
         return sys._ipython_app, token
 
+    # start_kernel is always called on Excel's main thread
+    set_main_thread()
+
     # The stdout/stderrs used by IPython. These get set after the kernel has started.
     ipy_stdout = sys.stdout
     ipy_stderr = sys.stderr
 
+    # Set if cells are to be run on a worker thread instead of the main thread
+    execution = None
+
+    # Set if output sent to the notebook is coalesced
+    coalescer = None
+
     # patch IPKernelApp.start so that it doesn't block
     def _IPKernelApp_start(self):
-        nonlocal ipy_stdout, ipy_stderr
+        global _kernel_wakeup, _kernel_notify, _idle_monitor
+        nonlocal ipy_stdout, ipy_stderr, execution
+
+        # Count the messages handled by each poll (must be done before starting the kernel)
+        message_counter = MessageCounter()
+        message_counter.install(self.kernel)
+
+        # Stop polling when no frontend is using the kernel (also must be done before starting the kernel)
+        idle_monitor = _get_idle_monitor()
+        if idle_monitor is not None:
+            idle_monitor.install(self)
 
         if self.poller is not None:
             self.poller.start()
@@ -267,9 +671,70 @@ def start_kernel():
         # set up a timer to periodically poll the zmq ioloop
         self.loop = IOLoop.current()
 
+        # Used by the scheduler thread to wait between polls
+        execute_in_thread = _get_execute_in_thread()
+        wakeup = _kernel_wakeup = create_wakeup(self, _get_wakeup_mode(), stdin=not execute_in_thread)
+        _log.debug(f"Using '{wakeup.name}' wakeup for the IPython kernel.")
+
+        # While idle the scheduler thread waits on the kernel's sockets for the next message
+        idle_wakeup = None
+        if idle_monitor is not None:
+            idle_wakeup = create_idle_wakeup(self, wakeup, stdin=not execute_in_thread)
+            if idle_wakeup is None:
+                _log.debug("Kernel ZMQ sockets not available; polling will not be stopped when idle.")
+                idle_monitor = None
+            else:
+                _log.debug(f"Polling of the IPython kernel will stop after {idle_monitor.idle_timeout}s idle.")
+        _idle_monitor = idle_monitor
+
+        # Wake the scheduler thread whether it's waiting between polls or while idle
+        wakeups = {wakeup, idle_wakeup} - {None}
+
+        def notify():
+            for w in wakeups:
+                w.notify()
+
+        _kernel_notify = notify
+
+        # Resume coroutines waiting on Excel's main thread as soon as possible
+        set_notify(notify)
+
+        # Run cells on a worker thread, waking the scheduler thread when each one completes
+        if execute_in_thread:
+            _log.debug("Running IPython cells on a worker thread.")
+            execution = ThreadedExecution(notify=notify)
+            execution.install(self.kernel)
+            patch_pyxll()
+
+        # If set, adjusts the wakeup interval depending on how busy the kernel is
+        adaptive_interval = _get_adaptive_interval()
+        if adaptive_interval is not None:
+            _log.debug("Using adaptive polling for the IPython kernel "
+                       f"({adaptive_interval.min_interval}s - {adaptive_interval.max_interval}s).")
+
+        # Limits on how long the main thread is used for
+        slice_budget = _get_slice_budget()
+        governor = _get_duty_cycle_governor()
+        if governor is not None:
+            _log.debug(f"Limiting the IPython kernel to {governor.max_duty_cycle:.0%} of the main thread's time.")
+
         poll_event = threading.Event()
 
+        # Set after each poll so the scheduler thread knows how long it can wait
+        poll_pending = False
+        poll_next_timer = None
+        poll_active = False
+        poll_start = 0.0
+        poll_end = 0.0
+        poll_duration = 0.0
+        poll_messages = 0
+
+        stats = _get_kernel_stats()
+
         def poll_ioloop():
+            nonlocal poll_pending, poll_next_timer, poll_active, poll_start, poll_end, poll_duration, poll_messages
+            poll_start = time.perf_counter()
+            poll_messages = 0
             try:
                 # Use the IPython stdout/stderr while running the kernel
                 with PushStdout(ipy_stdout, ipy_stderr):
@@ -281,29 +746,74 @@ def start_kernel():
                         sys._ipython_kernel_running = False
                         return
 
-                    # otherwise call the event loop but stop immediately if there are no pending events
-                    self.loop.add_timeout(0, lambda: self.loop.add_callback(self.loop.stop))
-                    self.loop.start()
+                    while True:
+                        # otherwise call the event loop but stop immediately if there are no pending events
+                        self.loop.add_timeout(0, lambda: self.loop.add_callback(self.loop.stop))
+                        self.loop.start()
+
+                        # Check if there is more to do before the scheduler thread waits again
+                        waiting = wakeup.drain()
+                        if idle_wakeup is not None and idle_wakeup is not wakeup:
+                            waiting = idle_wakeup.drain() or waiting
+                        poll_pending, poll_next_timer = get_pending_work(self.loop)
+                        poll_pending = poll_pending or waiting
+
+                        # Keep draining the event loop until there's nothing left or
+                        # the time budget for this slice has been used.
+                        if not poll_pending or time.perf_counter() - poll_start >= slice_budget:
+                            break
+
+                    # Send any output buffered during this poll
+                    if coalescer is not None:
+                        coalescer.send()
+
+                    poll_messages = message_counter.take()
+                    poll_active = poll_messages > 0 or waiting
             except:
                 _log.error("Error polling Jupyter loop", exc_info=True)
             finally:
+                poll_end = time.perf_counter()
+                poll_duration = poll_end - poll_start
                 poll_event.set()
 
         def schedule_ioloop_polling():
             while True:
-                with _pause_kernal_condition:
-                    if _pause_kernel > 0:
-                        _pause_kernal_condition.wait()
-                    paused = _pause_kernel
-
+                paused = _sessions.wait_while_paused()
                 if not paused:
                     # Call poll_ioloop on the main thread and wait for it to complete
                     poll_event.clear()
+                    scheduled_at = time.perf_counter()
                     schedule_call(poll_ioloop)
                     poll_event.wait()
 
-                    # Wait 0.1 seconds since the last poll
-                    time.sleep(0.1)
+                    stats.record_poll(poll_start - scheduled_at, poll_duration, poll_messages)
+                    _sessions.record_poll(poll_duration, poll_messages)
+
+                    if governor is not None:
+                        governor.record(poll_end, poll_duration)
+                        if poll_active or poll_pending:
+                            duty_cycle = governor.duty_cycle(poll_end)
+                            _log.debug(f"Kernel poll took {poll_duration * 1000:.1f}ms "
+                                       f"(duty cycle {duty_cycle:.0%}).")
+
+                        # Hold off polling again if the kernel has used too much of the main thread
+                        delay = governor.delay(time.perf_counter())
+                        if delay > 0:
+                            _log.debug(f"Kernel duty cycle over {governor.max_duty_cycle:.0%}; "
+                                       f"delaying the next poll by {delay * 1000:.1f}ms.")
+                            time.sleep(delay)
+                    elif poll_active or poll_pending:
+                        _log.debug(f"Kernel poll took {poll_duration * 1000:.1f}ms.")
+
+                    # Stop polling until the next message if no frontend is using the kernel
+                    if idle_monitor is not None and idle_monitor.update(poll_active) and not poll_pending:
+                        idle_wakeup.wait_for_message(poll_next_timer)
+                        continue
+
+                    # Wait until the kernel needs polling again
+                    if adaptive_interval is not None:
+                        wakeup.interval = adaptive_interval.update(poll_active)
+                    wakeup.wait(poll_pending, poll_next_timer)
 
         scheduler_thread = threading.Thread(target=schedule_ioloop_polling)
         scheduler_thread.daemon = True
@@ -324,14 +834,29 @@ def start_kernel():
     else:
         ipy = IPKernelApp.instance()
         ipy.connection_dir = _get_connection_dir(ipy)
-        ipy.initialize([])
+        _set_transport(ipy, _get_transport())
+        with phase("IPKernelApp.initialize"):
+            ipy.initialize([])
 
     # call the API embed function, which will use the monkey-patched method above
-    embed_kernel(local_ns={})
+    with phase("embed_kernel"):
+        embed_kernel(local_ns={})
 
     # register the magic functions
     ipy.shell.register_magics(ExcelMagics)
 
+    # Limit the memory held by results kept in the output history
+    _memory_manager = _get_memory_manager(ipy.shell)
+    _memory_manager.install()
+
+    # Restore the saved namespace, optionally loading each variable only when first used
+    if _get_load_namespace_on_start():
+        try:
+            with phase("load namespace"):
+                load_namespace(ipy.shell, lazy=_get_lazy_load_namespace())
+        except Exception:
+            _log.error("Error restoring the IPython kernel's namespace", exc_info=True)
+
     # Keep a reference to the kernel even if this module is reloaded
     sys._ipython_app = ipy
 
@@ -341,6 +866,17 @@ def start_kernel():
     sys.stdout = sys_stdout
     sys.stderr = sys_stderr
 
+    # Buffer output so it is sent once per poll instead of on every flush
+    coalescer = _get_output_coalescer(ipy_stdout, ipy_stderr, _kernel_notify)
+    if coalescer is not None:
+        _log.debug("Coalescing output from the IPython kernel.")
+        coalescer.install(ipy.kernel)
+        ipy_stdout, ipy_stderr = coalescer.stdout, coalescer.stderr
+
+    # Output from cells running on the worker thread needs to go to IPython
+    if execution is not None:
+        sys.stdout, sys.stderr = route_streams(sys_stdout, sys_stderr, ipy_stdout, ipy_stderr, execution)
+
     # patch user_global_ns so that it always references the user_ns dict
     setattr(ipy.shell.__class__, 'user_global_ns', property(lambda self: self.user_ns))
 
@@ -352,7 +888,8 @@ def start_kernel():
     mpl = ipy.shell.find_magic("matplotlib")
     if mpl:
         try:
-            mpl("inline")
+            with phase("matplotlib inline"):
+                mpl("inline")
         except ImportError:
             pass
 
@@ -383,8 +920,12 @@ def _check_requirement(requirement):
             return
 
 
-def _get_jupyter_args(subcommand):
-    """Get the args for a Jupyter subcommand."""
+def _get_jupyter_args(subcommand, port=None):
+    """Get the args for a Jupyter subcommand.
+
+    If port is set the server is started on that port on the loopback interface,
+    and fails rather than trying other ports if it's not available.
+    """
     if subcommand not in _subcommand_jupyter_args:
         raise RuntimeError(f"Unexpected Juputer subcommand '{subcommand}'")
 
@@ -392,11 +933,18 @@ def _get_jupyter_args(subcommand):
     requirement = "unknown"
     for requirement, args in _subcommand_jupyter_args[subcommand]:
         if requirement is None or _check_requirement(requirement):
+            if port is not None:
+                args = args + _get_port_args(port)
             return args
 
     raise RuntimeError(f"Requirements for Jupyter {subcommand} not satisfied ({requirement}).")
 
 
+def _get_port_args(port, host=_preassigned_host):
+    """Get the args to start a Jupyter server on a port, on the loopback interface by default."""
+    return [f"--ip={host}", f"--port={port}", "--port-retries=0"]
+
+
 def _find_jupyter_script(subcommand="notebook"):
     """Returns the path to 'jupyter-notebook-script.py' or 'jupyter-lab-script.py" used to start
     the Jupyter notebook server. Returns None if the script can't be found.
@@ -503,36 +1051,64 @@ def _find_jupyter_cmd(subcommand="notebook"):
     return None
 
 
-def launch_jupyter(initial_path=None,
-                   notebook_path=None,
-                   subcommand="notebook",
-                   timeout=60,
-                   no_browser=False):
-    """Start the IPython kernel and launch a Jupyter notebook server as a child process.
+def _start_server_output(proc):
+    """Start reading the output of a Jupyter server process (see ServerOutput)."""
+    from .serverlog import ServerOutput
 
-    launch_jupyter must be called with the returned token when the kernel and Jupyter
-    server process are no longer required.
+    cfg = get_config()
 
-    :param initial_path: Directory to start Jupyter in
-    :param notebook_path: Path of notebook to open.
-    :param timeout: Timeout in seconds to wait for the Jupyter process to start.
-    :param no_browser: Don't open a web browser if False.
-    :return: (token, URL string)
+    buffer_size = 256
+    if cfg.has_option("JUPYTER", "server_log_size"):
+        try:
+            buffer_size = max(int(cfg.get("JUPYTER", "server_log_size")), 1)
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.server_log_size.")
+
+    level = logging.INFO
+    if cfg.has_option("JUPYTER", "server_log_level"):
+        name = cfg.get("JUPYTER", "server_log_level").strip().upper()
+        level = logging.getLevelName(name)
+        if not isinstance(level, int):
+            _log.error(f"Unexpected value '{name}' for JUPYTER.server_log_level.")
+            level = logging.INFO
+
+    max_rate = max(_get_float_option(cfg, "server_log_rate", 0.0), 0.0)
+
+    output = ServerOutput(proc, buffer_size=buffer_size * 1024, level=level, max_rate=max_rate)
+    output.start()
+
+    # Keep the output of the most recent servers, including ones that have stopped
+    _server_outputs[proc.pid] = output
+    while len(_server_outputs) > 10:
+        _server_outputs.popitem(last=False)
+
+    return output
+
+
+def get_server_output(lines=None, pid=None):
+    """Return the most recent output of the Jupyter server processes started from Excel.
+
+    :param lines: Number of lines to return for each server, or None for all buffered output.
+    :param pid: Only return the output of the server with this process id.
+    :return: List of dicts with each server's 'pid', whether it's 'running', and its 'output' lines.
     """
-    notebook = None
-    if notebook_path is not None:
-        if initial_path is not None:
-            raise RuntimeError("'notebook_path' and 'initial_path' cannot be set together.")
-        initial_path = os.path.dirname(notebook_path)
-        notebook = os.path.basename(notebook_path)
+    return [{
+        "pid": output.pid,
+        "running": output.running,
+        "started": output.started,
+        "total_bytes": output.total_bytes,
+        "output": output.lines(lines)
+    } for output in list(_server_outputs.values()) if pid is None or output.pid == pid]
 
-    # Start the kernel and open Jupyter in a new tab
-    app, token = start_kernel()
-    connection_file = os.path.abspath(app.abs_connection_file)
-    _log.debug(f"Kernel started with connection file '{connection_file}'")
 
+def _resolve_jupyter_command(subcommand):
+    """Find the command used to start a Jupyter server.
+
+    :return: dict with the command line 'cmd', folders to add to the start of
+             the PYTHONPATH 'pythonpath', and the Jupyter server 'args'.
+    """
     cmd = []
-    pythonpath = list(sys.path)
+    pythonpath = []
 
     if sys.executable and os.path.basename(sys.executable).lower() in ("python.exe", "pythonw.exe"):
         python = os.path.join(os.path.dirname(sys.executable), "python.exe")
@@ -557,6 +1133,121 @@ def launch_jupyter(initial_path=None,
         cmd.append(jupyter_cmd)
         _log.debug("Using Jupyter command '%s'" % jupyter_cmd)
 
+    return {
+        "cmd": cmd,
+        "pythonpath": pythonpath,
+        "args": _get_jupyter_args(subcommand)
+    }
+
+
+def _get_server_pool():
+    """Return the ServerPool of Jupyter servers shared between sessions."""
+    global _server_pool
+    if _server_pool is None:
+        from .servers import ServerPool
+        _server_pool = ServerPool()
+    return _server_pool
+
+
+def _get_command_cache():
+    """Return the CommandCache used for Jupyter commands, or None if disabled."""
+    global _command_cache
+
+    cache_jupyter_command = True
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "cache_jupyter_command"):
+        try:
+            cache_jupyter_command = bool(int(cfg.get("JUPYTER", "cache_jupyter_command")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.cache_jupyter_command.")
+
+    if not cache_jupyter_command:
+        return None
+
+    if _command_cache is None:
+        from .cmdcache import CommandCache
+        _command_cache = CommandCache()
+    return _command_cache
+
+
+def _is_valid_command(command, subcommand):
+    """Check a cached command can still be used."""
+    if not isinstance(command, dict) or not command.get("cmd"):
+        return False
+
+    # The args must be one of the sets of args for the subcommand in this version of pyxll-jupyter
+    if command.get("args") not in (args for _, args in _subcommand_jupyter_args.get(subcommand, [])):
+        return False
+
+    # And the executable and any script folders must still exist
+    paths = [command["cmd"][0]] + list(command.get("pythonpath", []))
+    return all(os.path.exists(path) for path in paths)
+
+
+def _get_jupyter_command(subcommand):
+    """Return the command used to start a Jupyter server (see _resolve_jupyter_command),
+    using the cached command if available.
+    """
+    from .cmdcache import get_cache_key
+    from .profiler import phase
+
+    with phase("resolve command", subcommand=subcommand) as args:
+        cache = _get_command_cache()
+
+        if cache is not None:
+            key = get_cache_key()
+            command = cache.get(subcommand, key=key)
+            if command is not None:
+                if _is_valid_command(command, subcommand):
+                    _log.debug(f"Using cached Jupyter command {command['cmd']}.")
+                    args["cached"] = True
+                    return command
+                _log.debug("Cached Jupyter command is no longer valid.")
+
+        start_time = time.perf_counter()
+        command = _resolve_jupyter_command(subcommand)
+        _log.debug(f"Jupyter command resolved in {time.perf_counter() - start_time:.3f}s.")
+        args["cached"] = False
+
+        if cache is not None:
+            cache.set(subcommand, command, key=key)
+
+        return command
+
+
+def _get_connection_info_env(connection_file):
+    """Return the environment variables used to pass the kernel's connection info to the Jupyter server.
+
+    The connection info is taken from the running IPKernelApp if it's using connection_file,
+    so the connection file isn't read. Otherwise nothing is passed and the file is used instead.
+    """
+    global _connection_info_env
+
+    if _connection_info_env is None or _connection_info_env[0] != connection_file:
+        app = getattr(sys, "_ipython_app", None)
+        if app is None or os.path.abspath(app.abs_connection_file) != connection_file:
+            return {}
+        _connection_info_env = connection_file, encode_connection_info(app.get_connection_info())
+
+    return _connection_info_env[1]
+
+
+def _popen_jupyter_server(connection_file, initial_path, subcommand, no_browser, port=None, server_token=None,
+                          host=_preassigned_host):
+    """Start a Jupyter server process connecting to the kernel's connection file.
+
+    If port is set the server is started on that port on host (the loopback interface by
+    default), and if server_token is set that's used as the server's token. The server uses the same runtime
+    folder as the kernel's connection file for its server info file.
+
+    :return: Popen object for the server process.
+    """
+    from .profiler import phase
+
+    command = _get_jupyter_command(subcommand)
+    cmd = list(command["cmd"])
+    pythonpath = command["pythonpath"] + list(sys.path)
+
     # Use the current python path when launching
     env = dict(os.environ)
     env["PYTHONPATH"] = ";".join(pythonpath)
@@ -568,13 +1259,25 @@ def launch_jupyter(initial_path=None,
         path.insert(0, os.path.dirname(pywintypes.__file__))
         env["PATH"] = ";".join(path)
 
-    # Set PYXLL_IPYTHON_CONNECTION_FILE so the manager knows what to connect to
+    # Set PYXLL_IPYTHON_CONNECTION_FILE so the manager knows what to connect to, and pass the
+    # connection info itself so it doesn't need to read the file each time a notebook is opened.
     env["PYXLL_IPYTHON_CONNECTION_FILE"] = connection_file
+    env.update(_get_connection_info_env(connection_file))
+
+    # The runtime folder Excel sees may be different to the server's default, e.g. if Excel
+    # is a Windows Store app, so tell the server where to write its server info file.
+    env["JUPYTER_RUNTIME_DIR"] = os.path.dirname(connection_file)
+
+    # The token is passed in the environment so it doesn't appear in the command line
+    if server_token is not None:
+        env["JUPYTER_TOKEN"] = server_token
 
     if no_browser:
         cmd.append("--no-browser")
 
-    cmd.extend(_get_jupyter_args(subcommand))
+    cmd.extend(command["args"])
+    if port is not None:
+        cmd.extend(_get_port_args(port, host))
     cmd.append("-y")
 
     # run jupyter in it's own process
@@ -595,89 +1298,446 @@ def launch_jupyter(initial_path=None,
     if initial_path:
         _log.debug(f"Starting Jupyter in '{initial_path}'.")
 
-    proc = subprocess.Popen(cmd,
-                            cwd=initial_path,
-                            env=env,
-                            shell=shell,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT,
-                            startupinfo=si,
-                            **popen_kwargs)
+    with phase("Popen"):
+        proc = subprocess.Popen(cmd,
+                                cwd=initial_path,
+                                env=env,
+                                shell=shell,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                startupinfo=si,
+                                **popen_kwargs)
 
     if proc.poll() is not None:
         raise Exception("Command '%s' failed to start" % " ".join(cmd))
 
-    # Add it to the dict of processes to be killed when Excel exits
-    _all_jupyter_processes[token] = proc
-
-    # Monitor the output of the process in a background thread
-    def thread_func(proc, url_queue, killed_event):
-        encoding = sys.getfilesystemencoding()
-        next_line_is_url = False
-        matched_url = None
-
-        while proc.poll() is None:
-            # Let the main thread know we're still alive
-            if matched_url is None:
-                url_queue.put(None)
-
-            # Get the next line from stdout and log it
-            line = proc.stdout.readline().decode(encoding, "replace").strip()
-            if not line:
-                continue
-            if line.startswith("DEBUG"):
-                _log.debug(line)
-                continue
-            _log.info(line)
-
-            # Look for the Jupyter URL
-            if matched_url is None:
-                if next_line_is_url:
-                    match = re.search(r"(?:^|\s)(https?://.*)$", line, re.IGNORECASE)
-                    if match:
-                        matched_url = match.group(1).strip()
-                        _log.info("Found Jupyter notebook server running on '%s'" % matched_url)
-                        next_line_is_url = False
-                        url_queue.put(matched_url)
-                        continue
+    # Read and log the output of the process in a background thread
+    _start_server_output(proc)
+
+    return proc
 
-                if re.search(r"(^|\s)Jupyter (.+) is running at:", line, re.IGNORECASE):
-                    next_line_is_url = True
-                    continue
 
-        if matched_url is None and not killed_event.is_set():
-            _log.error("Jupyter process ended without printing a URL.")
-            url_queue.put(False)
+def _start_jupyter_server(token, connection_file, initial_path, subcommand, timeout, no_browser, wait=True):
+    """Start a Jupyter server process for a kernel session and wait for it to be ready.
+
+    The process is added to the session so that it is killed when the session is released.
+    If the server isn't ready before the timeout the session is released and RuntimeError
+    is raised.
+
+    If wait is False and the server's port is pre-assigned (see preassign_port) this
+    returns straight away, and the returned future completes once the server is ready.
+
+    :return: (process, URL of the Jupyter server including the token query parameter,
+              Future that completes with the URL when the server is ready,
+              host the server is running on, token the server was started with or "" if none)
+    """
+    from .servers import list_server_info_files, wait_for_server_info, get_server_url, get_free_port, \
+        wait_for_port
+    from .profiler import begin
+    import concurrent.futures
+    import urllib.parse
+    import secrets
+
+    # Choose the port and token here so the URL is known before the server has started.
+    host, port, server_token = None, None, None
+    if _get_preassign_port():
+        host = _preassigned_host
+        port = get_free_port(_preassigned_host)
+        server_token = secrets.token_hex(24)
+        _log.debug(f"Starting Jupyter on pre-assigned port {port}.")
+
+    # Server info files already in the runtime folder aren't for the new server
+    runtime_dir = os.path.dirname(connection_file)
+    existing_server_files = list_server_info_files(runtime_dir)
+
+    proc = _popen_jupyter_server(connection_file, initial_path, subcommand, no_browser, port, server_token)
+
+    # Keep track of the process so it can be killed when released or when Excel exits
+    _sessions.update(token, process=proc)
+
+    wait_phase = begin("wait for server", preassigned_port=port is not None)
+
+    def wait_until_ready():
+        nonlocal host, server_token
+        if port is not None:
+            # Wait for the server to accept connections on the pre-assigned port
+            ready = wait_for_port(proc, _preassigned_host, port, timeout)
+            if wait_phase is not None:
+                wait_phase.end(ready=ready)
+            if ready:
+                return url
+        else:
+            # Wait for the server to write its server info file and start responding, or
+            # use the URL it prints if the file can't be found.
+            output = _server_outputs.get(proc.pid)
+            get_url = (lambda: output.url) if output is not None else None
+            info = wait_for_server_info(proc, runtime_dir, existing_server_files, initial_path, timeout,
+                                        get_url=get_url)
+            if wait_phase is not None:
+                wait_phase.end(ready=info is not None)
+            if info is not None:
+                host = urllib.parse.urlsplit(info["url"]).hostname
+                server_token = info.get("token") or ""
+                return get_server_url(info)
+
+        if proc.poll() is None:
+            _log.error("Timed-out waiting for the Jupyter server to start.")
+        else:
+            _log.error("Jupyter process ended before the server started.")
 
-    url_queue = queue.Queue()
-    killed_event = threading.Event()
-    thread = threading.Thread(target=thread_func, args=(proc, url_queue, killed_event))
+            # Don't use the same command next time in case it's out of date
+            cache = _get_command_cache()
+            if cache is not None:
+                cache.remove(subcommand)
+
+        # Release the session, which kills the process
+        release_kernel(token)
+        raise RuntimeError("Timed-out waiting for the Jupyter notebook URL.")
+
+    ready = concurrent.futures.Future()
+
+    url = None
+    if port is not None:
+        url = f"http://{_preassigned_host}:{port}/?token={server_token}"
+
+    # Without a pre-assigned port the URL isn't known until the server is ready
+    if wait or url is None:
+        url = wait_until_ready()
+        _log.info("Found Jupyter notebook server running on '%s'" % url)
+        ready.set_result(url)
+        return proc, url, ready, host, server_token
+
+    def ready_thread_func():
+        try:
+            ready.set_result(wait_until_ready())
+            _log.info("Jupyter notebook server running on '%s'" % url)
+        except BaseException as e:
+            ready.set_exception(e)
+
+    thread = threading.Thread(target=ready_thread_func, name="pyxll-jupyter-server-ready")
     thread.daemon = True
     thread.start()
 
-    # Wait for the URL to be logged
-    url = None
+    return proc, url, ready, host, server_token
+
+
+# Restarts servers in _server_pool that fail, see _start_supervisor
+_server_supervisor = None
+_server_supervisor_lock = threading.Lock()
+
+
+# Server started in the background by prewarm_jupyter, waiting to be used by launch_jupyter
+_prewarmed_server = None
+_prewarmed_server_lock = threading.Lock()
+
+
+def _get_server_key(initial_path, subcommand):
+    """Return the key used to find a running or pre-warmed server for a folder and subcommand."""
+    path = os.path.normcase(os.path.abspath(initial_path)) if initial_path else None
+    return subcommand, path
+
+
+def prewarm_jupyter(initial_path=None, subcommand="notebook", timeout=60):
+    """Start the IPython kernel and a Jupyter server in the background so that
+    the next call to launch_jupyter for the same folder and subcommand doesn't
+    have to wait for the server to start.
+
+    This must be called on Excel's main thread. Only the kernel is started on
+    the main thread, and the Jupyter server is waited for on a background thread.
+
+    :param initial_path: Directory to start Jupyter in.
+    :param subcommand: Jupyter subcommand, 'notebook' or 'lab'.
+    :param timeout: Timeout in seconds to wait for the Jupyter process to start.
+    """
+    global _prewarmed_server
+    import concurrent.futures
+
+    with _prewarmed_server_lock:
+        if _prewarmed_server is not None:
+            _log.debug("A Jupyter server has already been pre-warmed.")
+            return
+
+    start_time = time.perf_counter()
+
+    # The kernel isn't needed until the server is used, so it's paused straight away
+    app, token = start_kernel()
+    pause_kernel(token)
+    connection_file = os.path.abspath(app.abs_connection_file)
+    _log.debug(f"Kernel started for pre-warmed Jupyter server in {time.perf_counter() - start_time:.2f}s.")
+
+    future = concurrent.futures.Future()
+    with _prewarmed_server_lock:
+        _prewarmed_server = (_get_server_key(initial_path, subcommand), token, future)
+
+    def thread_func():
+        key = _get_server_key(initial_path, subcommand)
+        try:
+            proc, url, _, host, server_token = _start_jupyter_server(token, connection_file, initial_path, subcommand,
+                                                                     timeout, no_browser=True)
+            _get_server_pool().add(key, proc, url, token,
+                                   connection_file=connection_file,
+                                   host=host,
+                                   server_token=server_token)
+            _start_supervisor()
+        except BaseException as e:
+            _log.error("Error pre-warming the Jupyter server", exc_info=True)
+            release_kernel(token)
+            future.set_exception(e)
+            return
+
+        _log.info(f"Pre-warmed Jupyter {subcommand} server ready in {time.perf_counter() - start_time:.2f}s.")
+        future.set_result(url)
+
+    thread = threading.Thread(target=thread_func, name="pyxll-jupyter-prewarm")
+    thread.daemon = True
+    thread.start()
+
+
+def _claim_prewarmed_server(initial_path, subcommand, timeout):
+    """Return (token, url) of the pre-warmed server if there is one for the
+    same folder and subcommand, or None.
+
+    If the server is still starting this waits for it. Once claimed, the
+    pre-warmed server is not returned again.
+    """
+    global _prewarmed_server
+    import concurrent.futures
+
+    with _prewarmed_server_lock:
+        if _prewarmed_server is None:
+            return None
+
+        key, token, future = _prewarmed_server
+        if key != _get_server_key(initial_path, subcommand):
+            _log.debug("Pre-warmed Jupyter server not used as it was started for a different folder or subcommand.")
+            return None
+
+        _prewarmed_server = None
+
+    if not future.done():
+        _log.debug("Waiting for the pre-warmed Jupyter server to start...")
+
     try:
-        while url is None:
-            url = url_queue.get(timeout=timeout)
-    except queue.Empty:
-        _log.error("Timed-out waiting for the Jupyter notebook URL.")
-        url = False
+        url = future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        _log.warning("Timed-out waiting for the pre-warmed Jupyter server.")
+        release_kernel(token)
+        return None
+    except Exception:
+        return None
+
+    session = _sessions.info(token)
+    if session is None or not session["process_running"]:
+        _log.warning("Pre-warmed Jupyter server is no longer running.")
+        release_kernel(token)
+        return None
 
-    if not url:
-        if proc.poll() is None:
-            _log.debug("Killing Jupyter notebook process...")
-            killed_event.set()
+    return token, url
+
+
+def _start_supervisor():
+    """Start checking the Jupyter servers in the pool and restarting any that fail, if
+    supervise_server is set (off by default).
+    """
+    global _server_supervisor
+
+    cfg = get_config()
+    supervise = False
+    if cfg.has_option("JUPYTER", "supervise_server"):
+        try:
+            supervise = bool(int(cfg.get("JUPYTER", "supervise_server")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.supervise_server.")
+
+    if not supervise:
+        return
+
+    with _server_supervisor_lock:
+        if _server_supervisor is None:
+            from .supervisor import ServerSupervisor
+
+            max_restarts = 5
+            if cfg.has_option("JUPYTER", "max_server_restarts"):
+                try:
+                    max_restarts = int(cfg.get("JUPYTER", "max_server_restarts"))
+                except (ValueError, TypeError):
+                    _log.error("Unexpected value for JUPYTER.max_server_restarts.")
+
+            _server_supervisor = ServerSupervisor(
+                _get_server_pool(),
+                _restart_jupyter_server,
+                interval=max(_get_float_option(cfg, "health_check_interval", 2.0), 0.1),
+                max_failures=int(_get_float_option(cfg, "health_check_failures", 3)),
+                max_restarts=max_restarts)
+
+    _server_supervisor.start()
+
+
+def _restart_jupyter_server(server, timeout=60):
+    """Restart a Jupyter server that has exited or stopped responding.
+
+    The new server is started on the same host and port, and with the same token, so that
+    pages already open reconnect to it. Called by the ServerSupervisor.
+
+    :return: True if restarted, or False if the server was released while restarting.
+    """
+    from .servers import wait_for_port, probe_server
+    import urllib.parse
+
+    port = urllib.parse.urlsplit(server.url).port
+    if port is None:
+        raise RuntimeError(f"Unable to restart Jupyter server as its URL '{server.url}' has no port.")
+    host = server.host or _preassigned_host
+
+    # Wait for the old process to end so its port is free
+    old = server.process
+    kill_process(old)
+    try:
+        old.wait(5)
+    except subprocess.TimeoutExpired:
+        _log.warning(f"Jupyter server {old.pid} has not ended after being killed.")
+
+    subcommand, initial_path = server.key
+    proc = _popen_jupyter_server(server.connection_file, initial_path, subcommand, True, port, server.server_token, host)
+    try:
+        if not wait_for_port(proc, host, port, timeout) or not probe_server(server.url):
+            raise RuntimeError(f"Restarted Jupyter server did not start on port {port}.")
+
+        tokens = _server_pool.replace_process(server, proc)
+        if tokens is None or _server_supervisor.stopped:
             kill_process(proc)
-            del _all_jupyter_processes[token]
+            return False
+    except BaseException:
+        kill_process(proc)
+        raise
 
-        if thread.is_alive():
-            _log.debug("Waiting for background thread to complete...")
-            thread.join(timeout=1)
-            if thread.is_alive():
-                _log.warning("Timed out waiting for background thread.")
+    for token in tokens:
+        _sessions.update(token, process=proc)
 
-        raise RuntimeError("Timed-out waiting for the Jupyter notebook URL.")
+    return True
+
+
+def get_server_health():
+    """Return a list of dicts describing the health of each running Jupyter server.
+
+    Each dict contains the server's pid and URL, whether it's running and responding
+    to HTTP requests, how many times it's been restarted by the supervisor after
+    exiting or not responding, and the time taken to recover in seconds.
+    """
+    if _server_supervisor is None:
+        return []
+    return _server_supervisor.report()
+
+
+def launch_jupyter(initial_path=None,
+                   notebook_path=None,
+                   subcommand="notebook",
+                   timeout=60,
+                   no_browser=False,
+                   wait=True):
+    """Start the IPython kernel and launch a Jupyter notebook server as a child process.
+
+    launch_jupyter must be called with the returned token when the kernel and Jupyter
+    server process are no longer required.
+
+    If a Jupyter server is already running for the same folder and subcommand, either
+    for another session or started in the background by prewarm_jupyter, then that
+    server is used instead of starting a new one. The server is only stopped once
+    all sessions using it have been released.
+
+    :param initial_path: Directory to start Jupyter in
+    :param notebook_path: Path of notebook to open.
+    :param timeout: Timeout in seconds to wait for the Jupyter process to start.
+    :param no_browser: Don't open a web browser if False.
+    :param wait: Wait for the Jupyter server to be ready before returning. If False and
+                 the server's port is pre-assigned (see the preassign_port option) the
+                 URL is returned straight away, and the server may not be ready yet.
+    :return: (token, URL string)
+    """
+    from .profiler import StartupProfile, get_active_profile
+
+    kwargs = dict(initial_path=initial_path,
+                  notebook_path=notebook_path,
+                  subcommand=subcommand,
+                  timeout=timeout,
+                  no_browser=no_browser,
+                  wait=wait)
+
+    # Record the startup phases, unless already being profiled by the caller
+    if get_active_profile() is not None:
+        return _launch_jupyter(**kwargs)
+
+    profile = StartupProfile("launch_jupyter")
+    try:
+        with profile.active():
+            return _launch_jupyter(**kwargs)
+    finally:
+        finish_startup_profile(profile)
+
+
+def is_port_preassigned():
+    """Return True if Jupyter servers are started on a port and token chosen in advance
+    (see the preassign_port option), in which case launch_jupyter can return the server's
+    URL without waiting for the server to start.
+    """
+    return _get_preassign_port()
+
+
+def _launch_jupyter(initial_path, notebook_path, subcommand, timeout, no_browser, wait):
+    """Implementation of launch_jupyter."""
+    from .profiler import get_active_profile, phase
+
+    start_time = time.perf_counter()
+
+    notebook = None
+    if notebook_path is not None:
+        if initial_path is not None:
+            raise RuntimeError("'notebook_path' and 'initial_path' cannot be set together.")
+        initial_path = os.path.dirname(notebook_path)
+        notebook = os.path.basename(notebook_path)
+
+    # Use the pre-warmed server if there is one, or a running server for the same folder
+    # and subcommand. Otherwise start a new server.
+    start = "cold"
+    with phase("claim pre-warmed server"):
+        prewarmed = _claim_prewarmed_server(initial_path, subcommand, timeout)
+    if prewarmed is not None:
+        token, url = prewarmed
+        resume_kernel(token)
+        start = "pre-warmed"
+    else:
+        with phase("start_kernel"):
+            app, token = start_kernel()
+        connection_file = os.path.abspath(app.abs_connection_file)
+        _log.debug(f"Kernel started with connection file '{connection_file}'")
+
+        key = _get_server_key(initial_path, subcommand)
+        server = _get_server_pool().acquire(key, token)
+        if server is not None and wait and not server.ready.done():
+            # The server was started without waiting and may still be starting
+            try:
+                with phase("wait for shared server"):
+                    server.ready.result(timeout)
+            except Exception:
+                _log.warning("Jupyter server failed to start; starting a new one.")
+                _server_pool.release(token)
+                server = None
+
+        if server is not None:
+            _log.debug(f"Using running Jupyter server {server.process.pid} ({len(server.tokens)} sessions).")
+            _sessions.update(token, process=server.process)
+            url = server.url
+            start = "shared"
+        else:
+            proc, url, ready, host, server_token = _start_jupyter_server(token,
+                                                     connection_file,
+                                                     initial_path,
+                                                     subcommand,
+                                                     timeout,
+                                                     no_browser,
+                                                     wait=wait)
+            _server_pool.add(key, proc, url, token, ready, connection_file, host, server_token)
+            _start_supervisor()
 
     root, params = url.split("?", 1) if "?" in url else (url, "")
     params = params.split("&")
@@ -689,102 +1749,104 @@ def launch_jupyter(initial_path=None,
 
     # Return the proc and url
     url = root + (("?" + "&".join(params)) if params else "")
+    _sessions.update(token, url=url)
+
+    # Only a newly started server opens the browser itself
+    if start != "cold" and not no_browser:
+        import webbrowser
+        webbrowser.open(url)
+
+    _log.info(f"Jupyter {subcommand} opened in {time.perf_counter() - start_time:.2f}s ({start} start).")
+
+    profile = get_active_profile()
+    if profile is not None:
+        profile.args.update(subcommand=subcommand, start=start)
+
     return token, url
 
 
+def finish_startup_profile(profile):
+    """Finish a StartupProfile, logging its report and writing it as a Chrome trace
+    to the startup_trace_dir folder if set.
+    """
+    from .profiler import format_report, write_chrome_trace
+
+    if not profile.finish():
+        return
+
+    report = profile.report()
+    _startup_reports.append(report)
+    _log.info(format_report(report))
+
+    cfg = get_config()
+    if cfg.has_option("JUPYTER", "startup_trace_dir"):
+        trace_dir = cfg.get("JUPYTER", "startup_trace_dir").strip()
+        if trace_dir:
+            timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(report["started"]))
+            path = os.path.join(trace_dir, f"pyxll-jupyter-startup-{timestamp}-{os.getpid()}.json")
+            try:
+                os.makedirs(trace_dir, exist_ok=True)
+                write_chrome_trace(path, [report])
+                _log.debug(f"Startup trace written to '{path}'.")
+            except OSError:
+                _log.warning(f"Unable to write startup trace to '{path}'.", exc_info=True)
+
+
+def get_startup_reports():
+    """Return a list of reports of how long each phase of opening Jupyter took,
+    for the most recent times Jupyter was opened.
+
+    Each report is a dict with the name of what was profiled, when it started, the total
+    time taken in seconds, and a list of phases. Each phase has a name, its start time in
+    seconds relative to the start of the report, its duration, and the thread it ran on.
+    Reports can be converted to Chrome trace JSON using pyxll_jupyter.profiler.write_chrome_trace.
+    """
+    return list(_startup_reports)
+
+
 def kill_process(proc):
     """Kill a process and its children.
 
     :param proc: Popen process object
     """
-    if proc.poll() is not None:
-        return
+    kill_processes([proc])
 
-    # Use CreateToolhelp32Snapshot to find child processes
-    _TH32CS_SNAPPROCESS = 0x00000002
-    _PROCESS_TERMINATE = 0x0001
-
-    class _PROCESSENTRY32(ctypes.Structure):
-        _fields_ = [("dwSize", ctypes.c_ulong),
-                    ("cntUsage", ctypes.c_ulong),
-                    ("th32ProcessID", ctypes.c_ulong),
-                    ("th32DefaultHeapID", ctypes.c_void_p),
-                    ("th32ModuleID", ctypes.c_ulong),
-                    ("cntThreads", ctypes.c_ulong),
-                    ("th32ParentProcessID", ctypes.c_ulong),
-                    ("pcPriClassBase", ctypes.c_ulong),
-                    ("dwFlags", ctypes.c_ulong),
-                    ("szExeFile", ctypes.c_char * 260)]
-
-    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
-    CreateToolhelp32Snapshot = kernel32.CreateToolhelp32Snapshot
-    Process32First = kernel32.Process32First
-    Process32Next = kernel32.Process32Next
-    OpenProcess = kernel32.OpenProcess
-    TerminateProcess = kernel32.TerminateProcess
-    CloseHandle = kernel32.CloseHandle
-
-    def get_running_procs():
-        """Return return a dict of ppid -> set of child pids for children of the current process.
-        If a process has no children there is an empty set in the dict.
-        """
-        processes = {}
-        snapshot = CreateToolhelp32Snapshot(_TH32CS_SNAPPROCESS, 0)
-        try:
-            entry = _PROCESSENTRY32()
-            entry.dwSize = ctypes.sizeof(_PROCESSENTRY32)
-            if not Process32First(snapshot, ctypes.byref(entry)):
-                raise OSError('Process32First failed with error code %d' % ctypes.get_last_error())
-            while True:
-                # Make sure each process has an entry in the dict and add this process to its parent
-                processes.setdefault(entry.th32ProcessID, set())
-                processes.setdefault(entry.th32ParentProcessID, set()).add(entry.th32ProcessID)
-                if not Process32Next(snapshot, ctypes.byref(entry)):
-                    break
-        finally:
-            CloseHandle(snapshot)
-        return processes
-
-    def kill_proc_tree(pid):
-        running_procs = get_running_procs()
-        if pid not in running_procs:
-            return
 
-        # Terminate the process
-        proc = OpenProcess(_PROCESS_TERMINATE, False, pid)
-        if not proc:
-            raise OSError("OpenProcess failed with error code %d" % ctypes.get_last_error())
-        try:
-            if 0 == TerminateProcess(proc, -9):
-                raise OSError("TerminateProcess failed with error code %d" % ctypes.get_last_error())
-        finally:
-            CloseHandle(proc)
-
-        # Then terminate any remaining child processes
-        children = running_procs[pid]
-        if children:
-            # Check which are still running after terminating the parent process
-            running_procs = get_running_procs()
-            children = [c for c in children if c in running_procs]
-            for child_pid in children:
-                kill_proc_tree(child_pid)
+def kill_processes(procs):
+    """Kill processes and their children, using a single snapshot of the running processes.
+
+    :param procs: List of Popen process objects
+    """
+    pids = [proc.pid for proc in procs if proc.poll() is None]
+    if not pids:
+        return
+
+    from .processes import kill_process_trees
 
     try:
-        kill_proc_tree(proc.pid)
+        kill_process_trees(pids)
     except:
-        _log.warning("Failed to kill Jupyter process %d" % proc.pid, exc_info=True)
+        _log.warning("Failed to kill Jupyter processes %s" % ", ".join(map(str, pids)), exc_info=True)
 
 
 @atexit.register
 def _kill_jupyter_processes():
     """Ensure all Jupyter processes are killed."""
-    global _all_jupyter_processes
-
-    for proc in _all_jupyter_processes.values():
-        kill_process(proc)
-
-    _all_jupyter_processes = {
-        token: proc
-        for token, proc in _all_jupyter_processes.items()
-        if proc.poll() is None
-    }
+    # Stop the supervisor first so it doesn't restart the servers
+    if _server_supervisor is not None:
+        _server_supervisor.stop()
+
+    processes = {id(proc): proc for proc in _sessions.processes().values()}
+    servers = {}
+    if _server_pool is not None:
+        servers = {id(server.process): (server.process, server.url) for server in _server_pool.servers()}
+    processes.update((key, proc) for key, (proc, url) in servers.items())
+
+    # Ask the servers to shut down cleanly first, and then kill whatever is left
+    timeout = max(_get_float_option(get_config(), "shutdown_timeout", 1.0), 0.0)
+    if timeout > 0 and servers:
+        from .servers import shutdown_servers
+        remaining = {id(proc) for proc in shutdown_servers(list(servers.values()), timeout)}
+        processes = {key: proc for key, proc in processes.items() if key not in servers or key in remaining}
+
+    kill_processes(list(processes.values()))
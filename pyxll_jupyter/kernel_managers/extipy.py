@@ -9,9 +9,7 @@ and so need to patch the kernel in the mananger to connect to the existing kerne
 Most Jupyter configurations should use the kernel provisioner factory option
 instead of this manager.
 """
-import os
-import os.path
-
+from ..connection import get_connection_file, get_connection_info
 from jupyter_client.multikernelmanager import MultiKernelManager
 from notebook.services.kernels.kernelmanager import MappingKernelManager
 
@@ -39,17 +37,15 @@ class ExternalMappingKernelManager(MappingKernelManager):
         for port_name in port_names:
             setattr(kernel, port_name, 0)
 
-        # Connect to kernel started by PyXLL
-        connection_file = os.environ["PYXLL_IPYTHON_CONNECTION_FILE"]
-        if not os.path.abspath(connection_file):
-            connection_dir = os.path.join(os.environ["APPDATA"], "jupyter", "runtime")
-            connection_file = os.path.join(connection_dir, connection_file)
-
-        if not os.path.exists(connection_file):
-            _log.warning(f"Jupyter connection file '{connection_file}' does not exist.")
-
-        _log.info(f'PyXLL IPython kernel = {connection_file}')
-        kernel.load_connection_file(connection_file)
+        # Connect to kernel started by PyXLL, using whichever transport it was started with
+        info = get_connection_info()
+        info["key"] = info["key"].encode()
+        if hasattr(kernel, "load_connection_info"):
+            kernel.load_connection_info(info)
+        else:
+            kernel.transport = info.get("transport", "tcp")
+            kernel.load_connection_file(get_connection_file())
+            kernel.ip = info["ip"]
 
     async def start_kernel(self, **kwargs):
         """Attach to the kernel started by PyXLL.
@@ -1,14 +1,36 @@
 """
 Magic functions for use when running IPython inside Excel.
 """
-from IPython.core.magic import Magics, magics_class, line_magic
+from IPython.core.magic import Magics, magics_class, line_magic, cell_magic
 from IPython.core.magic_arguments import argument, magic_arguments, parse_argstring
+from IPython import get_ipython
+from .mainthread import main_thread
 from pyxll import xl_app, plot, XLCell
 import logging
+import sys
+import re
 
 _log = logging.getLogger(__name__)
 
 
+def _await_offload(lines):
+    """IPython input transformer that runs %%xl_offload cells using ExcelMagics.xl_offload_async.
+
+    Awaiting the worker process lets the kernel's event loop, and so Excel, keep
+    running while the cell runs. Cells are left unchanged if autoawait is disabled.
+    """
+    if not lines or not re.match(r"%%xl_offload(\s|$)", lines[0]):
+        return lines
+
+    shell = get_ipython()
+    if shell is None or not getattr(shell, "autoawait", False):
+        return lines
+
+    line = lines[0][len("%%xl_offload"):].strip()
+    cell = "".join(lines[1:])
+    return [f"await get_ipython().find_cell_magic('xl_offload').__self__.xl_offload_async({line!r}, {cell!r})\n"]
+
+
 @magics_class
 class ExcelMagics(Magics):
     """Magic functions for interacting with Excel."""
@@ -16,6 +38,13 @@ class ExcelMagics(Magics):
     xlDown = -4121
     xlToRight = -4161
 
+    def __init__(self, shell=None, **kwargs):
+        super().__init__(shell, **kwargs)
+
+        # Await %%xl_offload cells instead of blocking while the worker process runs them
+        if shell is not None and _await_offload not in shell.input_transformers_cleanup:
+            shell.input_transformers_cleanup.append(_await_offload)
+
     @line_magic
     @magic_arguments()
     @argument("-c", "--cell", help="Address of cell to get value of.")
@@ -23,6 +52,7 @@ class ExcelMagics(Magics):
     @argument("-f", "--formatter", help="PyXLL Formatter to use when setting the value.")
     @argument("-x", "--no-auto-resize", action="store_true", help="Don't auto-resize the range.")
     @argument("value", type=str, help="Value to set in Excel.")
+    @main_thread
     def xl_set(self, line):
         """Set a value to the current selection in Excel."""
         argv = self._split_args(line)
@@ -71,6 +101,7 @@ class ExcelMagics(Magics):
     @argument("-c", "--cell", help="Address of cell to get value of.")
     @argument("-t", "--type", help="Datatype to convert the value to.")
     @argument("-x", "--no-auto-resize", action="store_true", help="Don't auto-resize the range.")
+    @main_thread
     def xl_get(self, line):
         """Get the current selection in Excel into Python."""
         argv = self._split_args(line)
@@ -161,6 +192,7 @@ class ExcelMagics(Magics):
     @argument("-w", "--width", type=float, help="Width in points to use when creating the Picture in Excel.")
     @argument("-h", "--height", type=float, help="Height in points to use when creating the Picture in Excel.")
     @argument("figure", type=str, help="Figure to plot.")
+    @main_thread
     def xl_plot(self, line):
         """Plot a figure to Excel in the same way as pyxll.plot.
 
@@ -186,6 +218,234 @@ class ExcelMagics(Magics):
              height=args.height,
              **kwargs)
 
+    @line_magic
+    @magic_arguments()
+    @argument("-r", "--reset", action="store_true", help="Reset the statistics after showing them.")
+    @argument("-d", "--dict", action="store_true", help="Return the statistics as a dict instead of printing them.")
+    def xl_stats(self, line):
+        """Show statistics about how the kernel is polled on Excel's main thread.
+
+        This includes the delay between each poll being scheduled and it running
+        on Excel's main thread, the time spent in each poll, the number of messages
+        handled by each poll, and how often each session has paused and resumed
+        the kernel.
+        """
+        from .kernel import get_kernel_stats, reset_kernel_stats
+        from .stats import format_summary
+
+        argv = self._split_args(line)
+        args = self.xl_stats.parser.parse_args(argv)
+
+        summary = get_kernel_stats()
+        if args.reset:
+            reset_kernel_stats()
+
+        if args.dict:
+            return summary
+
+        print(format_summary(summary))
+
+    @line_magic
+    @magic_arguments()
+    @argument("-d", "--dict", action="store_true", help="Return the sessions as a list of dicts instead of printing them.")
+    def xl_sessions(self, line):
+        """Show the sessions using the kernel and their resource use.
+
+        Each Jupyter task pane or browser session opened from Excel is a
+        separate session. For each one this shows whether it is running or
+        paused, its Jupyter server process, how long since it started and
+        was last active, and the time spent by the kernel on Excel's main
+        thread and number of messages handled while it was running.
+        """
+        from .kernel import get_sessions
+        from .sessions import format_sessions
+
+        argv = self._split_args(line)
+        args = self.xl_sessions.parser.parse_args(argv)
+
+        sessions = get_sessions()
+        if args.dict:
+            return sessions
+
+        print(format_sessions(sessions))
+
+    @line_magic
+    @magic_arguments()
+    @argument("-n", "--lines", type=int, default=50, help="Number of lines to show for each server (0 for all).")
+    @argument("-p", "--pid", type=int, help="Only show the output of the server with this process id.")
+    def xl_server_log(self, line):
+        """Show the most recent output of the Jupyter servers started from Excel.
+
+        The output of each Jupyter server is kept in a buffer, including
+        lines that weren't written to the log because of the server log
+        level or rate limit. The output of servers that have stopped is
+        also shown, most recently started last.
+        """
+        from .kernel import get_server_output
+
+        argv = self._split_args(line)
+        args = self.xl_server_log.parser.parse_args(argv)
+
+        servers = get_server_output(lines=args.lines or None, pid=args.pid)
+        if not servers:
+            print("No Jupyter server output." if args.pid is None else f"No output for Jupyter server {args.pid}.")
+            return
+
+        for server in servers:
+            status = "running" if server["running"] else "stopped"
+            print(f"--- Jupyter server {server['pid']} ({status}, {server['total_bytes']} bytes written) ---")
+            for text in server["output"]:
+                print(text)
+
+    @line_magic
+    @magic_arguments()
+    @argument("-n", "--count", type=int, default=20, help="Number of objects to show (0 for all).")
+    @argument("-e", "--evict", action="store_true", help="Remove large results from the output history first.")
+    @argument("-d", "--dict", action="store_true", help="Return the memory usage as a dict instead of printing it.")
+    def xl_memory(self, line):
+        """Show the largest objects in the kernel's namespace and Excel's memory use.
+
+        Object sizes are estimates. For NumPy arrays and pandas objects only
+        the size of their data is counted, and the size of other containers
+        is estimated from a sample of their items. The number and size of the
+        results kept in the output history (Out, _N, _, __ and ___) and the
+        limits set for them are also shown.
+        """
+        from .kernel import get_memory_usage, evict_outputs
+        from .memory import format_usage
+
+        argv = self._split_args(line)
+        args = self.xl_memory.parser.parse_args(argv)
+
+        if args.evict:
+            removed = evict_outputs()
+            if not args.dict:
+                print(f"Removed {removed} results from the output history.\n")
+
+        usage = get_memory_usage(args.count)
+        if args.dict:
+            return usage
+
+        print(format_usage(usage))
+
+    @line_magic
+    @magic_arguments()
+    @argument("-n", "--name", help="Name of the snapshot to save to.")
+    @argument("variables", nargs="*", help="Variables to save (all variables if not set).")
+    def xl_save_ns(self, line):
+        """Save the variables in the kernel's namespace so they can be restored after Excel is restarted.
+
+        NumPy arrays and pandas DataFrames are saved in a format that can be
+        memory mapped when loaded, and other variables are pickled. Modules,
+        functions, classes and variables starting with an underscore are not
+        saved. Anything previously saved to the same snapshot is replaced.
+        """
+        from .namespace import save_namespace
+
+        argv = self._split_args(line)
+        args = self.xl_save_ns.parser.parse_args(argv)
+
+        saved, errors = save_namespace(self.shell, name=args.name, names=args.variables or None)
+        print(f"Saved {len(saved)} variables: {', '.join(saved)}" if saved else "No variables saved.")
+
+        for name, error in errors.items():
+            print(f"Variable '{name}' could not be saved: {error}", file=sys.stderr)
+
+    @line_magic
+    @magic_arguments()
+    @argument("-n", "--name", help="Name of the snapshot to load from.")
+    @argument("--lazy", action="store_true", help="Load each variable when a cell that names it is first run.")
+    @argument("-r", "--replace", action="store_true", help="Replace variables that are already set.")
+    @argument("-l", "--list", action="store_true", help="List the variables in the snapshot without loading them.")
+    @argument("variables", nargs="*", help="Variables to load (all variables if not set).")
+    def xl_load_ns(self, line):
+        """Restore variables saved using %xl_save_ns.
+
+        Arrays are memory mapped, so restoring them is quick. With --lazy each
+        variable is only loaded the first time a cell that names it is run.
+        Variables only used indirectly, e.g. by functions defined in earlier
+        cells, using eval or globals(), or in a %timeit string, are not loaded
+        lazily and raise a NameError until loaded. Variables that are already
+        set are not replaced unless --replace is used.
+        """
+        from .namespace import load_namespace, get_namespace_store, format_snapshot
+
+        argv = self._split_args(line)
+        args = self.xl_load_ns.parser.parse_args(argv)
+
+        if args.list:
+            print(format_snapshot(get_namespace_store(args.name)))
+            return
+
+        restored, errors = load_namespace(self.shell,
+                                          name=args.name,
+                                          names=args.variables or None,
+                                          lazy=args.lazy,
+                                          replace=args.replace)
+        print(f"Restored {len(restored)} variables: {', '.join(restored)}" if restored else "No variables restored.")
+
+        for name, error in errors.items():
+            print(f"Variable '{name}' could not be restored: {error}", file=sys.stderr)
+
+    @cell_magic
+    @magic_arguments()
+    @argument("-i", "--inputs", nargs="+", help="Variables to send to the worker process.")
+    @argument("-o", "--outputs", nargs="+", help="Variables to return from the worker process.")
+    @argument("-t", "--timeout", type=float, help="Maximum time in seconds to wait for the cell to complete.")
+    def xl_offload(self, line, cell):
+        """Run a cell in a separate Python process outside of Excel.
+
+        Use this for CPU heavy code that would otherwise compete with Excel
+        for the GIL. The cell is run in one of a pool of worker processes that
+        are reused between calls.
+
+        The variables used by the cell are sent to the worker process, and
+        the variables it sets are returned, unless --inputs or --outputs are
+        used. Modules are imported again in the worker process, and large
+        NumPy arrays and pandas DataFrames are passed using shared memory.
+
+        Functions and classes defined in the notebook can't be sent to the
+        worker process and should be defined in the cell or imported from
+        a module instead.
+        """
+        from .offload import get_offload_pool
+
+        kwargs = self._offload_args(line)
+        values, errors, output = get_offload_pool().run(cell, self.shell.user_ns, **kwargs)
+        self._offload_done(values, errors, output)
+
+    async def xl_offload_async(self, line, cell):
+        """Run a cell using %%xl_offload, awaiting the worker process so that the
+        kernel's event loop and Excel aren't blocked while the cell runs.
+
+        %%xl_offload cells are run using this when autoawait is enabled
+        (see _await_offload).
+        """
+        from .offload import get_offload_pool
+
+        kwargs = self._offload_args(line)
+        values, errors, output = await get_offload_pool().run_async(cell, self.shell.user_ns, **kwargs)
+        self._offload_done(values, errors, output)
+
+    def _offload_args(self, line):
+        """Parse the arguments to %%xl_offload, returning the kwargs for OffloadPool.run."""
+        argv = self._split_args(line)
+        args = self.xl_offload.parser.parse_args(argv)
+        return dict(inputs=args.inputs,
+                    outputs=args.outputs,
+                    timeout=args.timeout,
+                    exclude=self.shell.user_ns_hidden)
+
+    def _offload_done(self, values, errors, output):
+        """Update the namespace with the results of %%xl_offload."""
+        if output:
+            print(output, end="")
+
+        self.shell.user_ns.update(values)
+
+        for name, error in errors.items():
+            print(f"Variable '{name}' could not be returned from the worker process: {error}", file=sys.stderr)
+
     @staticmethod
     def _split_args(line):
         """This is used instead of the standard arg_split to allow full Python
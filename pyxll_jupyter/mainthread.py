@@ -0,0 +1,302 @@
+"""
+Helpers for calling into Excel from threads other than Excel's main thread.
+
+Excel's COM objects should only be used from Excel's main thread. When the
+kernel runs cells on a worker thread (see the execution module) calls to
+xl_app, XLCell and the Excel magic functions are run on Excel's main thread
+using pyxll.schedule_call, and the calling thread waits for the result.
+
+COM objects returned to other threads are wrapped in a MainThreadProxy so
+that everything done with them also happens on Excel's main thread.
+
+Coroutines can use run_on_main_thread_async instead, which doesn't block
+the event loop while waiting for Excel.
+
+Anything printed by a function run on Excel's main thread for another
+thread is written to the calling thread's stdout and stderr, so output
+from a cell still appears in the notebook.
+"""
+from pyxll import schedule_call
+import concurrent.futures
+import contextlib
+import contextvars
+import asyncio
+import functools
+import threading
+import logging
+import sys
+
+_log = logging.getLogger(__name__)
+
+# Thread id of Excel's main thread, set by set_main_thread
+_main_thread_id = None
+
+# Function to wake the kernel's scheduler thread, set by set_notify
+_notify = None
+
+
+def set_main_thread():
+    """Record the current thread as Excel's main thread."""
+    global _main_thread_id
+    _main_thread_id = threading.get_ident()
+
+
+def is_main_thread():
+    """Return True if called from Excel's main thread, or if it's not known yet."""
+    return _main_thread_id is None or threading.get_ident() == _main_thread_id
+
+
+def run_on_main_thread(func, *args, **kwargs):
+    """Call a function on Excel's main thread and wait for the result.
+
+    If called from the main thread the function is called immediately.
+    Any exception raised by the function is raised in the calling thread.
+    """
+    if is_main_thread():
+        return func(*args, **kwargs)
+
+    func = _with_caller_output(func)
+    future = concurrent.futures.Future()
+
+    def call():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    schedule_call(call)
+    return future.result()
+
+
+def _with_caller_output(func):
+    """Wrap func so that output it writes when called on another thread goes to
+    the calling thread's stdout and stderr (see execution.ThreadStream).
+
+    The function is also run in a copy of the calling thread's context so that
+    the kernel sends its output as part of the cell that made the call.
+    """
+    from .execution import ThreadStream
+
+    context = contextvars.copy_context()
+    redirects = [s.redirect() for s in (sys.stdout, sys.stderr) if isinstance(s, ThreadStream)]
+
+    def run(*args, **kwargs):
+        with contextlib.ExitStack() as stack:
+            for redirect in redirects:
+                stack.enter_context(redirect)
+            return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(run, *args, **kwargs)
+
+    return wrapper
+
+
+def set_notify(notify):
+    """Set the function called to wake the kernel after run_on_main_thread_async
+    completes, so the waiting coroutine is resumed as soon as possible.
+    """
+    global _notify
+    _notify = notify
+
+
+async def run_on_main_thread_async(func, *args, **kwargs):
+    """Call a function on Excel's main thread and await the result.
+
+    The call is scheduled using pyxll.schedule_call and the event loop keeps
+    running while it waits, so other coroutines and Excel are not blocked.
+    This can be used from the main thread as well as from other threads.
+    Any exception raised by the function is raised in the awaiting coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    wrap = not is_main_thread()
+    if wrap:
+        func = _with_caller_output(func)
+
+    def set_result(result, exc):
+        if future.done():
+            return
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(result)
+
+    def call():
+        if future.done():
+            return
+
+        result, exc = None, None
+        try:
+            result = func(*args, **kwargs)
+            if wrap:
+                result = _wrap(result)
+        except BaseException as e:
+            exc = e
+
+        try:
+            loop.call_soon_threadsafe(set_result, result, exc)
+        except RuntimeError:
+            _log.debug("Event loop closed before a call on Excel's main thread completed.")
+            return
+
+        if _notify is not None:
+            _notify()
+
+    if wrap:
+        args, kwargs = _unwrap_args(args, kwargs)
+
+    schedule_call(call)
+    return await future
+
+
+def _is_com_object(obj):
+    """Return True if obj looks like a COM object from win32com or comtypes."""
+    module = type(obj).__module__ or ""
+    if module.split(".", 1)[0] in ("win32com", "comtypes", "pythoncom", "pywintypes"):
+        return True
+    return type(obj).__name__ == "PyIDispatch" or hasattr(obj, "_oleobj_")
+
+
+def _wrap(value, callables=False):
+    """Wrap a value returned on the main thread if it needs to stay there."""
+    if isinstance(value, MainThreadProxy):
+        return value
+    if _is_com_object(value):
+        return MainThreadProxy(value)
+    if callables and callable(value) and not isinstance(value, type):
+        return MainThreadProxy(value)
+    return value
+
+
+def _unwrap(value):
+    """Return the object wrapped by a MainThreadProxy, or value if not a proxy."""
+    if isinstance(value, MainThreadProxy):
+        return object.__getattribute__(value, "_MainThreadProxy__obj")
+    return value
+
+
+def _unwrap_args(args, kwargs):
+    return (
+        tuple(_unwrap(a) for a in args),
+        {k: _unwrap(v) for k, v in kwargs.items()}
+    )
+
+
+class MainThreadProxy:
+    """Proxy for an object that must only be used on Excel's main thread.
+
+    Getting and setting attributes, calling, indexing and iterating are all
+    done on Excel's main thread. Any COM objects or methods returned are
+    also wrapped in a MainThreadProxy.
+    """
+
+    __slots__ = ("__obj",)
+
+    def __init__(self, obj):
+        object.__setattr__(self, "_MainThreadProxy__obj", obj)
+
+    def __getattr__(self, name):
+        obj = self.__obj
+        return run_on_main_thread(lambda: _wrap(getattr(obj, name), callables=True))
+
+    def __setattr__(self, name, value):
+        run_on_main_thread(setattr, self.__obj, name, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        obj = self.__obj
+        args, kwargs = _unwrap_args(args, kwargs)
+        return run_on_main_thread(lambda: _wrap(obj(*args, **kwargs)))
+
+    def __getitem__(self, key):
+        obj = self.__obj
+        return run_on_main_thread(lambda: _wrap(obj[_unwrap(key)]))
+
+    def __setitem__(self, key, value):
+        obj = self.__obj
+        run_on_main_thread(obj.__setitem__, _unwrap(key), _unwrap(value))
+
+    def __iter__(self):
+        obj = self.__obj
+        return iter(run_on_main_thread(lambda: [_wrap(x) for x in obj]))
+
+    def __len__(self):
+        return run_on_main_thread(len, self.__obj)
+
+    def __bool__(self):
+        return run_on_main_thread(bool, self.__obj)
+
+    def __eq__(self, other):
+        return run_on_main_thread(lambda: self.__obj == _unwrap(other))
+
+    def __hash__(self):
+        return hash(self.__obj)
+
+    def __str__(self):
+        return run_on_main_thread(str, self.__obj)
+
+    def __repr__(self):
+        return run_on_main_thread(repr, self.__obj)
+
+
+def main_thread(func):
+    """Decorator for functions that must run on Excel's main thread.
+
+    When called from another thread the function is run on Excel's main
+    thread and the caller waits for the result. Any COM object returned
+    is wrapped in a MainThreadProxy.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if is_main_thread():
+            return func(*args, **kwargs)
+        args, kwargs = _unwrap_args(args, kwargs)
+        return run_on_main_thread(lambda: _wrap(func(*args, **kwargs)))
+
+    wrapper._pyxll_jupyter_main_thread = True
+    return wrapper
+
+
+def _patch_class(cls):
+    """Replace the public methods and properties of a class so they run on Excel's main thread."""
+    for name, attr in list(vars(cls).items()):
+        if name.startswith("_"):
+            continue
+
+        if isinstance(attr, property):
+            patched = property(main_thread(attr.fget) if attr.fget else None,
+                               main_thread(attr.fset) if attr.fset else None,
+                               attr.fdel,
+                               attr.__doc__)
+        elif isinstance(attr, classmethod):
+            patched = classmethod(main_thread(attr.__func__))
+        elif isinstance(attr, staticmethod):
+            patched = staticmethod(main_thread(attr.__func__))
+        elif callable(attr) and not getattr(attr, "_pyxll_jupyter_main_thread", False):
+            patched = main_thread(attr)
+        else:
+            continue
+
+        setattr(cls, name, patched)
+
+    cls._pyxll_jupyter_main_thread = True
+
+
+def patch_pyxll():
+    """Patch pyxll.xl_app and pyxll.XLCell so they can be used from any thread.
+
+    Calls made from Excel's main thread are unaffected.
+    """
+    import pyxll
+
+    if not getattr(pyxll.xl_app, "_pyxll_jupyter_main_thread", False):
+        pyxll.xl_app = main_thread(pyxll.xl_app)
+
+    try:
+        if not getattr(pyxll.XLCell, "_pyxll_jupyter_main_thread", False):
+            _patch_class(pyxll.XLCell)
+    except TypeError:
+        _log.warning("pyxll.XLCell can't be patched and must only be used from Excel's main thread.")
@@ -0,0 +1,378 @@
+"""
+Limits on the memory held by the IPython kernel running in Excel.
+
+IPython keeps a reference to the result of every cell in Out (also _oh)
+and _N, as well as the last three in _, __ and ___. In Excel, where the
+results are often large DataFrames returned by %xl_get, this can pin a
+lot of memory that would otherwise be freed.
+
+If configured, the output history is trimmed after each cell so that no
+more than 'output_history' results, and no more than 'output_history_size'
+MB of results, are kept. If the Excel process's resident memory is over
+'memory_limit' MB then any cached results of at least
+'memory_evict_min_size' MB are also removed::
+
+    [JUPYTER]
+    output_history = 100
+    output_history_size = 1024
+    memory_limit = 8192
+    memory_evict_min_size = 1
+
+Removing a result from the output history only drops IPython's own
+references to it. Results that are also assigned to a variable aren't
+freed until that variable is deleted.
+
+Sizes are estimates. NumPy arrays and pandas objects report the size of
+their data without inspecting any Python objects they contain, and other
+containers are estimated from a sample of their items, so that sizing
+everything in the namespace stays cheap.
+
+The largest objects in the namespace can be listed using the %xl_memory
+magic, or obtained as a dict using pyxll_jupyter.kernel.get_memory_usage.
+"""
+import itertools
+import logging
+import ctypes
+import sys
+import gc
+import os
+
+_log = logging.getLogger(__name__)
+
+# Number of items of a container used to estimate the size of the rest
+_sample_size = 100
+
+_unders = ("_", "__", "___")
+
+_MB = 1024 * 1024
+
+
+def _is_type(obj, module, names):
+    """Return True if obj is an instance of one of the named classes from a module, without importing it."""
+    for cls in type(obj).__mro__:
+        if cls.__module__.split(".")[0] == module and cls.__name__ in names:
+            return True
+    return False
+
+
+def estimate_size(obj):
+    """Return an estimate of the memory used by obj in bytes.
+
+    NumPy arrays and pandas objects use the size of their data. Strings
+    and bytes use sys.getsizeof. For lists, tuples, sets and dicts the size
+    of the items (but not anything they contain) is estimated from a sample.
+    """
+    try:
+        if _is_type(obj, "numpy", ("ndarray", "generic")):
+            return int(obj.nbytes)
+
+        if _is_type(obj, "pandas", ("DataFrame",)):
+            return int(obj.memory_usage(index=True, deep=False).sum())
+
+        if _is_type(obj, "pandas", ("Series",)):
+            return int(obj.memory_usage(index=True, deep=False))
+
+        if _is_type(obj, "pandas", ("Index",)):
+            return int(obj.memory_usage(deep=False))
+
+        if isinstance(obj, memoryview):
+            return obj.nbytes
+
+        size = sys.getsizeof(obj)
+
+        if isinstance(obj, (list, tuple, set, frozenset, dict)) and len(obj) > 0:
+            items = obj.items() if isinstance(obj, dict) else obj
+            sample = list(itertools.islice(items, _sample_size))
+            if isinstance(obj, dict):
+                sample_size = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in sample)
+            else:
+                sample_size = sum(sys.getsizeof(item) for item in sample)
+            size += int(sample_size * len(obj) / len(sample))
+
+        return size
+    except Exception:
+        _log.debug(f"Unable to estimate the size of a {type(obj).__name__}", exc_info=True)
+        return sys.getsizeof(obj, 0)
+
+
+class _PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+    _fields_ = [("cb", ctypes.c_ulong),
+                ("PageFaultCount", ctypes.c_ulong),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t)]
+
+
+def get_rss():
+    """Return the resident memory (working set) of this process in bytes, or None if not known."""
+    try:
+        if sys.platform == "win32":
+            kernel32 = ctypes.WinDLL("kernel32")
+            kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+            counters = _PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            if not kernel32.K32GetProcessMemoryInfo(ctypes.c_void_p(kernel32.GetCurrentProcess()),
+                                                    ctypes.byref(counters),
+                                                    counters.cb):
+                return None
+            return counters.WorkingSetSize
+
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+
+class MemoryManager:
+    """Caps the output history of an IPython shell and evicts large results under memory pressure.
+
+    :param shell: The kernel's InteractiveShell.
+    :param max_outputs: Maximum number of results kept in the output history, or 0 for no limit.
+    :param max_output_bytes: Maximum estimated size of the results kept, or 0 for no limit.
+    :param memory_limit: Resident memory in bytes above which large results are evicted, or 0.
+    :param evict_min_size: Results smaller than this aren't evicted when over memory_limit.
+    """
+
+    def __init__(self, shell, max_outputs=0, max_output_bytes=0, memory_limit=0, evict_min_size=_MB):
+        self.shell = shell
+        self.max_outputs = max_outputs
+        self.max_output_bytes = max_output_bytes
+        self.memory_limit = memory_limit
+        self.evict_min_size = evict_min_size
+        self.__sizes = {}
+        self.__warned = False
+
+    def install(self):
+        """Trim the output history after each cell is run."""
+        self.shell.events.register("post_run_cell", self.post_run_cell)
+
+    def uninstall(self):
+        """Stop trimming the output history."""
+        self.shell.events.unregister("post_run_cell", self.post_run_cell)
+
+    def post_run_cell(self, result=None):
+        """Called by IPython after each cell is run."""
+        try:
+            self.trim()
+            self.check_memory()
+        except Exception:
+            _log.warning("Error limiting the output history", exc_info=True)
+
+    def __output_history(self):
+        """Return the shell's output history dict of {execution count: result}."""
+        output_hist = self.shell.user_ns.get("_oh")
+        if output_hist is None:
+            output_hist = getattr(self.shell.history_manager, "output_hist", {})
+        return output_hist
+
+    def __size(self, n, obj):
+        """Return the estimated size of a result, reusing the estimate for results already seen."""
+        cached = self.__sizes.get(n)
+        if cached is not None and cached[0] is obj:
+            return cached[1]
+        size = estimate_size(obj)
+        self.__sizes[n] = (obj, size)
+        return size
+
+    def outputs(self):
+        """Return a list of (execution count, estimated size) of the results in the output history, oldest first."""
+        output_hist = self.__output_history()
+        outputs = [(n, self.__size(n, obj)) for n, obj in sorted(output_hist.items())]
+
+        # Forget the sizes of results no longer in the history so they can be freed
+        for n in list(self.__sizes):
+            if n not in output_hist:
+                del self.__sizes[n]
+
+        return outputs
+
+    def evict(self, numbers):
+        """Remove results from the output history and IPython's other references to them.
+
+        _N is only removed if it still refers to the result, and _, __ and ___ are
+        only cleared if they haven't been assigned to something else by the user.
+
+        :param numbers: Execution counts of the results to remove.
+        :return: Estimated number of bytes removed.
+        """
+        output_hist = self.__output_history()
+        user_ns = self.shell.user_ns
+        displayhook = self.shell.displayhook
+
+        total = 0
+        for n in numbers:
+            if n not in output_hist:
+                continue
+            obj = output_hist.pop(n)
+            total += self.__sizes.pop(n, (None, 0))[1]
+
+            name = f"_{n}"
+            if user_ns.get(name) is obj:
+                del user_ns[name]
+
+            for unders in _unders:
+                if getattr(displayhook, unders, None) is obj:
+                    if user_ns.get(unders) is obj:
+                        user_ns[unders] = ""
+                    setattr(displayhook, unders, "")
+
+            if getattr(self.shell.last_execution_result, "result", None) is obj:
+                self.shell.last_execution_result.result = None
+
+        return total
+
+    def trim(self):
+        """Remove the oldest results from the output history until it's within the limits.
+        Returns the execution counts of the results removed.
+        """
+        outputs = self.outputs()
+
+        # Keep the newest results that fit within both limits
+        keep = 0
+        total = 0
+        for n, size in reversed(outputs):
+            if self.max_outputs and keep >= self.max_outputs:
+                break
+            if self.max_output_bytes and keep > 0 and total + size > self.max_output_bytes:
+                break
+            keep += 1
+            total += size
+
+        removed = [n for n, size in outputs[:len(outputs) - keep]]
+        if removed:
+            freed = self.evict(removed)
+            _log.debug(f"Removed {len(removed)} results from the output history ({freed / _MB:.1f}MB).")
+        return removed
+
+    def check_memory(self):
+        """Evict large results from the output history if the process is using more than memory_limit.
+        Returns the execution counts of the results removed.
+        """
+        if not self.memory_limit:
+            return []
+
+        rss = get_rss()
+        if rss is None or rss <= self.memory_limit:
+            self.__warned = False
+            return []
+
+        removed = self.evict_large()
+        if removed:
+            gc.collect()
+            after = get_rss() or rss
+            _log.warning(f"Excel is using {rss / _MB:.0f}MB, over the limit of {self.memory_limit / _MB:.0f}MB. "
+                         f"Removed {len(removed)} large results from the output history "
+                         f"({max(rss - after, 0) / _MB:.0f}MB freed).")
+            rss = after
+
+        if rss > self.memory_limit and not self.__warned:
+            self.__warned = True
+            print(f"Warning: Excel is using {rss / _MB:.0f}MB of memory, over the limit of "
+                  f"{self.memory_limit / _MB:.0f}MB. Use %xl_memory to find the largest objects.",
+                  file=sys.stderr)
+
+        return removed
+
+    def evict_large(self, min_size=None):
+        """Remove all results of at least min_size bytes from the output history, largest first.
+        If min_size is None then evict_min_size is used. Returns the execution counts of the
+        results removed.
+        """
+        if min_size is None:
+            min_size = self.evict_min_size
+        outputs = sorted(self.outputs(), key=lambda item: item[1], reverse=True)
+        removed = [n for n, size in outputs if size >= min_size]
+        if removed:
+            self.evict(removed)
+        return removed
+
+    def usage(self, count=20):
+        """Return a dict describing the memory used by the kernel.
+
+        The dict contains the process's resident memory, the memory limit, the
+        number and estimated size of the results in the output history, and a
+        list of the 'count' largest objects in the namespace as dicts of name,
+        type and estimated size.
+        """
+        user_ns = self.shell.user_ns
+        hidden = getattr(self.shell, "user_ns_hidden", {})
+
+        objects = []
+        for name, obj in list(user_ns.items()):
+            if name in hidden and hidden[name] is obj:
+                continue
+            if name.startswith("__") and name.endswith("__"):
+                continue
+            if name.startswith("_") and (name in _unders or name[1:].isdigit() or name in ("_oh", "_ih", "_ii", "_iii")):
+                continue
+            # Modules, functions and classes aren't usually what's using the memory
+            if isinstance(obj, type(sys)) or (callable(obj) and not hasattr(obj, "__len__")):
+                continue
+            objects.append({
+                "name": name,
+                "type": f"{type(obj).__module__}.{type(obj).__qualname__}".replace("builtins.", ""),
+                "size": estimate_size(obj),
+            })
+
+        objects.sort(key=lambda item: item["size"], reverse=True)
+        outputs = self.outputs()
+
+        return {
+            "rss": get_rss(),
+            "memory_limit": self.memory_limit or None,
+            "outputs": len(outputs),
+            "output_bytes": sum(size for n, size in outputs),
+            "max_outputs": self.max_outputs or None,
+            "max_output_bytes": self.max_output_bytes or None,
+            "objects": objects[:count] if count else objects,
+        }
+
+
+def format_usage(usage):
+    """Format a dict returned by MemoryManager.usage as text."""
+    def mb(value):
+        return "-" if value is None else f"{value / _MB:.1f}MB"
+
+    lines = [
+        f"Excel memory: {mb(usage['rss'])} (limit {mb(usage['memory_limit'])})",
+        f"Output history: {usage['outputs']} results, {mb(usage['output_bytes'])} "
+        f"(limits {usage['max_outputs'] or '-'} results, {mb(usage['max_output_bytes'])})",
+    ]
+
+    objects = usage["objects"]
+    if not objects:
+        lines.append("")
+        lines.append("No variables.")
+        return "\n".join(lines)
+
+    width = max(max(len(obj["name"]) for obj in objects), 8) + 2
+    lines.append("")
+    lines.append(f"{'name':<{width}}{'size':>12}  type")
+    for obj in objects:
+        lines.append(f"{obj['name']:<{width}}{mb(obj['size']):>12}  {obj['type']}")
+
+    return "\n".join(lines)
+
+
+def set_underscore(shell, value):
+    """Set '_' in the shell's namespace as if value was the result of a cell.
+
+    IPython stops updating _, __ and ___ once the user has assigned any of them,
+    so setting user_ns['_'] directly would keep value alive until it's replaced.
+    Updating the display hook as well means value is moved to __ and ___ and then
+    released as cells produce new results.
+    """
+    displayhook = shell.displayhook
+    if all(shell.user_ns.get(unders) is getattr(displayhook, unders, None)
+           for unders in _unders if unders in shell.user_ns):
+        displayhook.___ = displayhook.__
+        displayhook.__ = displayhook._
+        displayhook._ = value
+        shell.user_ns.update({"_": displayhook._, "__": displayhook.__, "___": displayhook.___})
+    else:
+        shell.user_ns["_"] = value
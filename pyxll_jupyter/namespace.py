@@ -0,0 +1,516 @@
+"""
+Saving and restoring the variables in the IPython kernel's namespace.
+
+Everything in the kernel running in Excel is lost when Excel is closed.
+The %xl_save_ns magic saves the variables in the namespace to a local
+folder, and %xl_load_ns restores them, so that slow loading cells don't
+have to be run again after restarting Excel.
+
+Each variable is saved to its own file or files. NumPy arrays are saved
+in .npy format, and the columns of pandas DataFrames with NumPy dtypes
+are each saved as a separate .npy file, so that they can be memory
+mapped when loaded instead of being read in full. Anything else that can
+be pickled is saved as a pickle. Modules, functions, classes and names
+starting with an underscore are not saved.
+
+Arrays are memory mapped copy-on-write, so loading them is quick and
+changes made to them in the kernel are never written back to the saved
+files.
+
+Variables can also be loaded lazily. Restoring a snapshot then only reads
+the list of variables it contains, and each variable is loaded the first
+time a cell that names it is run. Only names that appear in the cell's code
+(or the arguments to its magics) are found, so a variable that's only used
+indirectly, such as by a function defined in an earlier cell, through
+eval, exec or globals(), or in the string passed to %timeit, isn't loaded
+and raises a NameError. Loading it with %xl_load_ns or naming it in a cell
+loads it.
+
+Snapshots are kept in the local app data folder by default, and the
+namespace can be saved each time a Jupyter session is closed and
+restored when the kernel starts::
+
+    [JUPYTER]
+    namespace_dir = C:\\Path\\To\\Snapshots
+    save_namespace_on_release = 1
+    load_namespace_on_start = 1
+    lazy_load_namespace = 0
+
+Only one Excel process should save to the same snapshot at a time.
+"""
+from .memory import estimate_size
+import itertools
+import threading
+import tempfile
+import logging
+import pickle
+import types
+import json
+import time
+import ast
+import sys
+import os
+import re
+
+_log = logging.getLogger(__name__)
+
+# Increment if the format of saved snapshots changes
+_SNAPSHOT_VERSION = 1
+
+_manifest_name = "manifest.json"
+
+# Name of the snapshot used if no name is given
+DEFAULT_SNAPSHOT = "default"
+
+# The LazyNamespace used by the kernel's shell, see get_lazy_namespace
+_lazy_namespace = None
+
+_identifier_re = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# NumPy dtype kinds that can be saved to .npy files without pickling
+_npy_kinds = "biufcmM"
+
+# Distinguishes the files of snapshots saved by this process in the same millisecond
+_generations = itertools.count()
+
+
+def get_default_namespace_dir():
+    """Return the folder snapshots are saved in, in the local (not roaming) app data folder if available."""
+    root = os.environ.get("LOCALAPPDATA") or tempfile.gettempdir()
+    return os.path.join(root, "pyxll-jupyter", "namespaces")
+
+
+def _is_npy_array(obj):
+    """Return True if obj is a NumPy array that can be saved as .npy without pickling."""
+    np = sys.modules.get("numpy")
+    return (np is not None
+            and type(obj) in (np.ndarray, np.memmap)
+            and not obj.dtype.hasobject
+            and obj.dtype.kind in _npy_kinds)
+
+
+def _is_dataframe(obj):
+    """Return True if obj is a pandas DataFrame."""
+    pd = sys.modules.get("pandas")
+    return pd is not None and type(obj) is pd.DataFrame
+
+
+def _load_npy(path):
+    """Load a .npy file, memory mapped copy-on-write if possible."""
+    import numpy as np
+    try:
+        return np.load(path, mmap_mode="c", allow_pickle=False)
+    except ValueError:
+        # Empty arrays can't be memory mapped
+        return np.load(path, allow_pickle=False)
+
+
+class NamespaceStore:
+    """A folder containing a saved snapshot of a namespace.
+
+    The folder contains a manifest.json file listing the saved variables,
+    and the files each variable was saved to. Saving writes a new set of
+    files and then replaces the manifest, so a snapshot that's being read
+    is never left half written.
+
+    :param path: Path of the snapshot folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+
+    def manifest(self):
+        """Return the saved manifest, or None if nothing has been saved."""
+        try:
+            with open(os.path.join(self.path, _manifest_name), "rt", encoding="utf-8") as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return None
+
+        if manifest.get("version") != _SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot '{self.path}' was saved by an incompatible version of pyxll-jupyter.")
+        return manifest
+
+    def variables(self):
+        """Return a dict of the saved variables' manifest entries, by name."""
+        manifest = self.manifest()
+        return manifest["variables"] if manifest is not None else {}
+
+    def __write(self, prefix, value):
+        """Write a single value to files starting with prefix and return its manifest entry."""
+        entry = {
+            "type": f"{type(value).__module__}.{type(value).__qualname__}",
+            "size": estimate_size(value),
+        }
+
+        if _is_npy_array(value):
+            import numpy as np
+            filename = f"{prefix}.npy"
+            np.save(os.path.join(self.path, filename), value, allow_pickle=False)
+            entry.update(format="npy", files=[filename])
+            return entry
+
+        if _is_dataframe(value):
+            import numpy as np
+            meta = {"index": value.index, "columns": value.columns, "arrays": {}, "objects": {}}
+            files = []
+            for i in range(value.shape[1]):
+                column = value.iloc[:, i]
+                if isinstance(column.dtype, np.dtype) and column.dtype.kind in _npy_kinds:
+                    filename = f"{prefix}-{i}.npy"
+                    np.save(os.path.join(self.path, filename), column.to_numpy(), allow_pickle=False)
+                    meta["arrays"][i] = filename
+                    files.append(filename)
+                else:
+                    meta["objects"][i] = column.array
+
+            filename = f"{prefix}.frame.pkl"
+            with open(os.path.join(self.path, filename), "wb") as fh:
+                pickle.dump(meta, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            entry.update(format="frame", files=[filename] + files)
+            return entry
+
+        filename = f"{prefix}.pkl"
+        with open(os.path.join(self.path, filename), "wb") as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        entry.update(format="pickle", files=[filename])
+        return entry
+
+    def save(self, values, keep=None):
+        """Save a dict of values, replacing anything saved previously.
+
+        :param values: Dict of name to value.
+        :param keep: Dict of name to manifest entry of variables already saved in
+                     this store to include in the new snapshot without writing
+                     them again.
+        :return: Tuple of (saved names, dict of name to error message for values that couldn't be saved).
+        """
+        with self.__lock:
+            os.makedirs(self.path, exist_ok=True)
+            generation = f"{int(time.time() * 1000):x}{os.getpid():x}{next(_generations):x}"
+
+            entries = dict(keep or {})
+            errors = {}
+            for index, (name, value) in enumerate(sorted(values.items())):
+                prefix = f"{generation}-{index}"
+                try:
+                    entries[name] = self.__write(prefix, value)
+                except Exception as e:
+                    errors[name] = f"{type(e).__name__}: {e}"
+                    _log.debug(f"Unable to save variable '{name}'", exc_info=True)
+                    for filename in os.listdir(self.path):
+                        if filename.startswith((f"{prefix}.", f"{prefix}-")):
+                            self.__remove(filename)
+
+            manifest = {
+                "version": _SNAPSHOT_VERSION,
+                "saved": time.time(),
+                "variables": entries,
+            }
+
+            # Write to a temporary file first so the manifest is never partially written
+            path = os.path.join(self.path, _manifest_name)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wt", encoding="utf-8") as fh:
+                json.dump(manifest, fh, indent=2)
+            os.replace(tmp, path)
+
+            self.__clean(entries)
+            return sorted(values.keys() - errors.keys()), errors
+
+    def __remove(self, filename):
+        try:
+            os.unlink(os.path.join(self.path, filename))
+            return True
+        except OSError:
+            # Files that are memory mapped can't be removed on Windows, and will be removed after a later save
+            _log.debug(f"Unable to remove '{filename}' from snapshot '{self.path}'", exc_info=True)
+            return False
+
+    def __clean(self, entries):
+        """Remove files not used by any of entries."""
+        used = {filename for entry in entries.values() for filename in entry["files"]}
+        used.add(_manifest_name)
+        for filename in os.listdir(self.path):
+            if filename not in used and not filename.endswith(".tmp"):
+                self.__remove(filename)
+
+    def load(self, entry):
+        """Load a value from its manifest entry."""
+        paths = [os.path.join(self.path, filename) for filename in entry["files"]]
+
+        if entry["format"] == "npy":
+            return _load_npy(paths[0])
+
+        if entry["format"] == "frame":
+            import pandas as pd
+            with open(paths[0], "rb") as fh:
+                meta = pickle.load(fh)
+
+            data = dict(meta["objects"])
+            for i, filename in meta["arrays"].items():
+                data[i] = _load_npy(os.path.join(self.path, filename))
+
+            # Columns are keyed by position so that duplicate and non-string column names are kept
+            frame = pd.DataFrame({i: data[i] for i in sorted(data)}, index=meta["index"], copy=False)
+            frame.columns = meta["columns"]
+            return frame
+
+        if entry["format"] == "pickle":
+            with open(paths[0], "rb") as fh:
+                return pickle.load(fh)
+
+        raise ValueError(f"Unknown snapshot format '{entry['format']}'.")
+
+
+class LazyNamespace(ast.NodeTransformer):
+    """Loads saved variables into a shell's namespace the first time they're used.
+
+    This is added to the shell's AST transformers so that before each cell is
+    run, any pending variables referenced by the cell are loaded. Names used
+    in the arguments to line and cell magics are also loaded, as magics such
+    as %xl_set and %%xl_offload look up variables by name. Variables that are
+    only used indirectly, e.g. by functions defined in earlier cells, are not
+    loaded.
+
+    :param shell: The kernel's InteractiveShell.
+    """
+
+    def __init__(self, shell):
+        super().__init__()
+        self.shell = shell
+        self.__pending = {}
+        self.__lock = threading.RLock()
+
+    def install(self):
+        """Add this to the shell's AST transformers."""
+        if self not in self.shell.ast_transformers:
+            self.shell.ast_transformers.append(self)
+
+    def add(self, store, entries):
+        """Add variables to be loaded when first used.
+
+        :param store: The NamespaceStore the variables were saved in.
+        :param entries: Dict of name to manifest entry.
+        """
+        with self.__lock:
+            for name, entry in entries.items():
+                self.__pending[name] = (store, entry)
+
+    def pending(self):
+        """Return a dict of name to (NamespaceStore, manifest entry) for the variables not loaded yet."""
+        with self.__lock:
+            return dict(self.__pending)
+
+    def discard(self, names):
+        """Stop waiting to load any of names."""
+        with self.__lock:
+            for name in names:
+                self.__pending.pop(name, None)
+
+    def load(self, names=None):
+        """Load pending variables into the namespace now.
+
+        Variables that have been set in the namespace since the snapshot was
+        restored are not replaced.
+
+        :param names: Names of the variables to load, or None to load all pending variables.
+        :return: Dict of name to error message for variables that couldn't be loaded.
+        """
+        errors = {}
+        with self.__lock:
+            if names is None:
+                names = list(self.__pending)
+
+            user_ns = self.shell.user_ns
+            for name in names:
+                pending = self.__pending.pop(name, None)
+                if pending is None or name in user_ns:
+                    continue
+
+                store, entry = pending
+                start = time.perf_counter()
+                try:
+                    user_ns[name] = store.load(entry)
+                except Exception as e:
+                    errors[name] = f"{type(e).__name__}: {e}"
+                    _log.warning(f"Unable to load variable '{name}' from snapshot '{store.path}'", exc_info=True)
+                    continue
+                _log.debug(f"Loaded '{name}' from snapshot '{store.path}' in "
+                           f"{(time.perf_counter() - start) * 1000:.1f}ms.")
+
+        return errors
+
+    def __referenced(self, node):
+        """Return the pending names referenced by an AST."""
+        pending = self.__pending
+        names = set()
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name):
+                if child.id in pending:
+                    names.add(child.id)
+            elif isinstance(child, ast.Call) \
+                    and isinstance(child.func, ast.Attribute) \
+                    and child.func.attr in ("run_line_magic", "run_cell_magic"):
+                for arg in child.args:
+                    if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                        names.update(name for name in _identifier_re.findall(arg.value) if name in pending)
+        return names
+
+    def visit(self, node):
+        """Called by IPython with each cell's AST before it's run."""
+        # IPython removes any AST transformer that raises an exception
+        try:
+            if self.__pending:
+                names = self.__referenced(node)
+                if names:
+                    for name, error in self.load(names).items():
+                        print(f"Variable '{name}' could not be loaded: {error}", file=sys.stderr)
+        except Exception:
+            _log.warning("Error loading saved variables", exc_info=True)
+        return node
+
+
+def get_namespace_store(name=None):
+    """Return the NamespaceStore for a named snapshot.
+
+    Snapshots are saved in the folder set by the 'namespace_dir' option in the
+    JUPYTER section of the pyxll.cfg file, or in the local app data folder.
+    """
+    name = name or DEFAULT_SNAPSHOT
+    if not re.fullmatch(r"[\w\-. ]+", name) or name.strip(". ") != name:
+        raise ValueError(f"Invalid snapshot name '{name}'.")
+
+    from pyxll import get_config
+    cfg = get_config()
+
+    root = None
+    if cfg.has_option("JUPYTER", "namespace_dir"):
+        root = os.path.expandvars(os.path.expanduser(cfg.get("JUPYTER", "namespace_dir").strip()))
+
+    return NamespaceStore(os.path.join(root or get_default_namespace_dir(), name))
+
+
+def get_lazy_namespace(shell):
+    """Return the LazyNamespace used to load saved variables into the shell's namespace."""
+    global _lazy_namespace
+    if _lazy_namespace is None or _lazy_namespace.shell is not shell:
+        _lazy_namespace = LazyNamespace(shell)
+        _lazy_namespace.install()
+    return _lazy_namespace
+
+
+def _is_saveable(name, value, hidden):
+    """Return True if a variable should be included when saving the whole namespace."""
+    if name.startswith("_"):
+        return False
+    if name in hidden and hidden[name] is value:
+        return False
+    return not isinstance(value, (types.ModuleType,
+                                  types.FunctionType,
+                                  types.BuiltinFunctionType,
+                                  types.MethodType,
+                                  type))
+
+
+def save_namespace(shell, name=None, names=None):
+    """Save the variables in a shell's namespace to a snapshot.
+
+    Variables restored from the same snapshot that haven't been used yet are
+    kept without being loaded. Variables restored from other snapshots are
+    loaded first so they can be saved.
+
+    :param shell: The kernel's InteractiveShell.
+    :param name: Name of the snapshot, or None for the default.
+    :param names: Names of the variables to save, or None for all variables.
+    :return: Tuple of (saved names, dict of name to error message for variables that couldn't be saved).
+    """
+    store = get_namespace_store(name)
+    lazy = get_lazy_namespace(shell)
+
+    # Keep variables from this snapshot that haven't been loaded, and load any others
+    keep = {}
+    pending = lazy.pending()
+    for var, (pending_store, entry) in pending.items():
+        if names is not None and var not in names:
+            continue
+        if os.path.abspath(pending_store.path) == os.path.abspath(store.path):
+            keep[var] = entry
+        else:
+            lazy.load([var])
+
+    user_ns = shell.user_ns
+    if names is None:
+        hidden = getattr(shell, "user_ns_hidden", {})
+        values = {var: value for var, value in list(user_ns.items())
+                  if var not in keep and _is_saveable(var, value, hidden)}
+        errors = {}
+    else:
+        values = {var: user_ns[var] for var in names if var in user_ns and var not in keep}
+        errors = {var: "Not defined" for var in names if var not in user_ns and var not in keep}
+
+    start = time.perf_counter()
+    saved, save_errors = store.save(values, keep=keep)
+    errors.update(save_errors)
+    _log.info(f"Saved {len(saved) + len(keep)} variables to snapshot '{store.path}' in "
+              f"{time.perf_counter() - start:.2f}s.")
+    return sorted(saved + list(keep)), errors
+
+
+def load_namespace(shell, name=None, names=None, lazy=False, replace=False):
+    """Restore variables saved in a snapshot into a shell's namespace.
+
+    :param shell: The kernel's InteractiveShell.
+    :param name: Name of the snapshot, or None for the default.
+    :param names: Names of the variables to restore, or None for all variables.
+    :param lazy: Only load each variable when a cell that names it is first run,
+                 instead of loading them all now (see LazyNamespace).
+    :param replace: Replace variables already in the namespace. Otherwise they're skipped.
+    :return: Tuple of (restored names, dict of name to error message for variables that couldn't be restored).
+    """
+    store = get_namespace_store(name)
+    lazy_ns = get_lazy_namespace(shell)
+
+    variables = store.variables()
+    errors = {}
+    if names is not None:
+        errors.update({var: "Not in snapshot" for var in names if var not in variables})
+        variables = {var: entry for var, entry in variables.items() if var in names}
+
+    user_ns = shell.user_ns
+    if not replace:
+        variables = {var: entry for var, entry in variables.items() if var not in user_ns}
+    else:
+        for var in variables:
+            user_ns.pop(var, None)
+
+    lazy_ns.add(store, variables)
+    if not lazy:
+        errors.update(lazy_ns.load(list(variables)))
+
+    restored = sorted(var for var in variables if var not in errors)
+    _log.info(f"Restored {len(restored)} variables from snapshot '{store.path}'"
+              f"{' (loaded when first used)' if lazy else ''}.")
+    return restored, errors
+
+
+def format_snapshot(store):
+    """Format the variables saved in a NamespaceStore as text."""
+    manifest = store.manifest()
+    if manifest is None:
+        return f"No snapshot saved in '{store.path}'."
+
+    variables = manifest["variables"]
+    saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(manifest["saved"]))
+    lines = [f"Snapshot '{store.path}' saved {saved}, {len(variables)} variables", ""]
+    if not variables:
+        return "\n".join(lines[:1])
+
+    width = max(max(len(name) for name in variables), 8) + 2
+    lines.append(f"{'name':<{width}}{'size':>12}  {'format':<8}type")
+    for name, entry in sorted(variables.items()):
+        size = f"{entry['size'] / (1024 * 1024):.1f}MB"
+        lines.append(f"{name:<{width}}{size:>12}  {entry['format']:<8}{entry['type']}")
+
+    return "\n".join(lines)
@@ -0,0 +1,444 @@
+"""
+Running notebook cells in a pool of worker processes outside of Excel.
+
+Even when cells are run on a worker thread, CPU heavy pure Python code
+competes with Excel and PyXLL for the GIL. The %%xl_offload cell magic
+runs a cell in a separate Python process instead, copying the variables
+it uses in and the variables it sets back into the notebook.
+
+Large buffers, such as the data in NumPy arrays and pandas DataFrames,
+are passed between processes in shared memory rather than being copied
+through a pipe.
+
+The worker processes are started the first time they are needed and
+are reused for later cells. By default one less than the number of CPUs
+is used, up to a maximum of 4, and this can be changed in the pyxll.cfg
+file::
+
+    [JUPYTER]
+    offload_processes = 2
+
+This module is imported by the worker processes and so must not import
+pyxll at module level.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import concurrent.futures
+import multiprocessing
+import contextlib
+import asyncio
+import importlib
+import logging
+import atexit
+import pickle
+import types
+import ast
+import gc
+import io
+import os
+import sys
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+_log = logging.getLogger(__name__)
+
+# Buffers smaller than this are pickled rather than put in shared memory
+DEFAULT_SHM_THRESHOLD = 64 * 1024
+
+# Shared memory blocks held by a worker process until they are no longer needed
+_held_blocks = []
+
+# The pool returned by get_offload_pool
+_offload_pool = None
+
+
+class _ModuleRef:
+    """Sent in place of a module so the worker process imports it instead."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _dumps(obj, threshold):
+    """Pickle obj with any large out-of-band buffers copied into shared memory.
+
+    Returns (payload, blocks) where blocks are the SharedMemory objects created.
+    The caller is responsible for closing and unlinking them.
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+
+    chunks, blocks = [], []
+    try:
+        for buffer in buffers:
+            raw = buffer.raw()
+            if raw.nbytes < threshold:
+                chunks.append(raw.tobytes())
+                continue
+
+            block = shared_memory.SharedMemory(create=True, size=max(raw.nbytes, 1))
+            blocks.append(block)
+            block.buf[:raw.nbytes] = raw
+            chunks.append((block.name, raw.nbytes))
+    except BaseException:
+        _release(blocks, unlink=True)
+        raise
+
+    return (data, chunks), blocks
+
+
+def _loads(payload, copy):
+    """Unpickle a payload created by _dumps.
+
+    If copy is False the unpickled object uses the shared memory directly and
+    so the returned blocks must be kept open for as long as it's in use.
+
+    Returns (obj, blocks) where blocks are the SharedMemory objects opened.
+    """
+    data, chunks = payload
+    buffers, blocks = [], []
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, tuple):
+                name, size = chunk
+                block = shared_memory.SharedMemory(name=name)
+                blocks.append(block)
+                buffers.append(bytearray(block.buf[:size]) if copy else block.buf[:size])
+            else:
+                buffers.append(bytearray(chunk))
+
+        return pickle.loads(data, buffers=buffers), blocks
+    except BaseException:
+        del buffers
+        _release(blocks)
+        raise
+
+
+def _release(blocks, unlink=False):
+    """Close shared memory blocks, returning any still in use."""
+    in_use = []
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            in_use.append(block)
+            continue
+        if unlink:
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+    return in_use
+
+
+def _run_cell(code, inputs, outputs, threshold):
+    """Called in a worker process to run a cell.
+
+    :param code: Source code of the cell.
+    :param inputs: Dict of variable names to payloads created by _dumps.
+    :param outputs: Names of the variables to return, or None to return all
+                    variables set by the cell.
+    :param threshold: Minimum buffer size to return in shared memory.
+
+    :return: (results, errors, output) where results maps variable names to
+             payloads, errors maps variable names to why they couldn't be
+             returned, and output is the text written to stdout and stderr.
+    """
+    global _held_blocks
+
+    # Blocks returned by the last call have been read by now
+    _held_blocks = _release(_held_blocks)
+
+    namespace = {"__name__": "__xl_offload__"}
+    blocks = []
+    value = initial = None
+    try:
+        for name, payload in inputs.items():
+            value, value_blocks = _loads(payload, copy=False)
+            blocks.extend(value_blocks)
+            if isinstance(value, _ModuleRef):
+                value = importlib.import_module(value.name)
+            namespace[name] = value
+
+        initial = dict(namespace)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            exec(compile(code, "<xl_offload>", "exec"), namespace)
+
+        if outputs is None:
+            outputs = [name for name, value in namespace.items()
+                       if not name.startswith("__")
+                       and not isinstance(value, types.ModuleType)
+                       and initial.get(name, _run_cell) is not value]
+
+        results, errors = {}, {}
+        for name in outputs:
+            if name not in namespace:
+                errors[name] = "not defined"
+                continue
+            try:
+                results[name], value_blocks = _dumps(namespace[name], threshold)
+                _held_blocks.extend(value_blocks)
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+
+        return results, errors, output.getvalue()
+    finally:
+        # Nothing can be using the input blocks once the namespace is cleared
+        namespace.clear()
+        value = initial = None
+        gc.collect()
+        _held_blocks.extend(_release(blocks))
+
+
+def _init_worker(pid_queue):
+    """Called in each worker process when it starts to send its pid to the OffloadPool."""
+    pid_queue.put(os.getpid())
+
+
+def _find_inputs(code, namespace, exclude=()):
+    """Return the names of variables in namespace that are used by code."""
+    names = set()
+    for node in ast.walk(ast.parse(code)):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+
+    return sorted(name for name in names
+                  if name in namespace
+                  and name not in exclude
+                  and not name.startswith("_"))
+
+
+def _get_python_executable():
+    """Return the Python executable used for the worker processes."""
+    executable = sys.executable
+    if executable and os.path.basename(executable).lower() in ("python.exe", "pythonw.exe"):
+        # Use pythonw.exe so the worker processes don't open a console window
+        pythonw = os.path.join(os.path.dirname(executable), "pythonw.exe")
+        if os.path.exists(pythonw):
+            executable = pythonw
+    return executable
+
+
+class OffloadPool:
+    """Persistent pool of worker processes for running cells outside of Excel.
+
+    :param processes: Maximum number of worker processes, or None for one less than the
+                      number of CPUs, up to a maximum of 4.
+    :param shm_threshold: Minimum size in bytes of buffers passed in shared memory.
+    """
+
+    def __init__(self, processes=None, shm_threshold=DEFAULT_SHM_THRESHOLD):
+        if shared_memory is None:
+            raise RuntimeError("Offloading cells to worker processes requires Python 3.8 or later.")
+
+        if processes is None:
+            processes = max(1, min(4, (os.cpu_count() or 2) - 1))
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+
+        self.processes = processes
+        self.shm_threshold = shm_threshold
+        self.__executor = None
+        self.__pid_queue = None
+        self.__worker_pids = set()
+
+    def __get_executor(self):
+        if self.__executor is None:
+            context = multiprocessing.get_context("spawn")
+            context.set_executable(_get_python_executable())
+
+            # Each worker process reports its pid so it can be killed if a cell doesn't complete
+            self.__pid_queue = context.SimpleQueue()
+            self.__worker_pids = set()
+            self.__executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                  mp_context=context,
+                                                  initializer=_init_worker,
+                                                  initargs=(self.__pid_queue,))
+            _log.debug(f"Created offload pool with up to {self.processes} processes.")
+        return self.__executor
+
+    def run(self, code, namespace, inputs=None, outputs=None, timeout=None, exclude=()):
+        """Run code in a worker process and return the variables it sets.
+
+        The calling thread is blocked until the worker process has finished. Use
+        run_async to wait without blocking the event loop.
+
+        :param code: Python code to run.
+        :param namespace: Dict the inputs are read from.
+        :param inputs: Names of the variables to send to the worker process.
+                       If None, all variables in namespace used by code are sent.
+        :param outputs: Names of the variables to return. If None, all variables
+                        set by code are returned.
+        :param timeout: Maximum time in seconds to wait for the result.
+        :param exclude: Names to ignore when finding the inputs automatically.
+
+        :return: (values, errors, output) where values is a dict of the variables
+                 returned, errors maps variable names to why they couldn't be
+                 returned, and output is the text written to stdout and stderr.
+        """
+        future, blocks = self.__submit(code, namespace, inputs, outputs, exclude)
+        try:
+            results, errors, output = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            self.__timed_out(timeout)
+            raise
+        finally:
+            _release(blocks, unlink=True)
+
+        return self.__receive(results, errors, output)
+
+    async def run_async(self, code, namespace, inputs=None, outputs=None, timeout=None, exclude=()):
+        """Run code in a worker process and return the variables it sets.
+
+        The same as run, except that the event loop keeps running while waiting
+        for the worker process. If cancelled, the worker processes are restarted.
+        """
+        future, blocks = self.__submit(code, namespace, inputs, outputs, exclude)
+        try:
+            results, errors, output = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            self.__timed_out(timeout)
+            raise
+        except asyncio.CancelledError:
+            self.__terminate()
+            raise
+        finally:
+            _release(blocks, unlink=True)
+
+        return self.__receive(results, errors, output)
+
+    def __submit(self, code, namespace, inputs, outputs, exclude):
+        """Start running code in a worker process.
+
+        :return: (future, blocks) where blocks are the shared memory blocks used for
+                 the inputs, which must be released once the future completes.
+        """
+        if inputs is None:
+            inputs = _find_inputs(code, namespace, exclude)
+
+        payloads, blocks = {}, []
+        try:
+            for name in inputs:
+                if name not in namespace:
+                    raise NameError(f"name '{name}' is not defined")
+
+                value = namespace[name]
+                if isinstance(value, types.ModuleType):
+                    value = _ModuleRef(value.__name__)
+
+                try:
+                    payloads[name], value_blocks = _dumps(value, self.shm_threshold)
+                except Exception as e:
+                    raise TypeError(f"Variable '{name}' can't be sent to a worker process: {e}") from e
+                blocks.extend(value_blocks)
+
+            future = self.__get_executor().submit(_run_cell, code, payloads, outputs, self.shm_threshold)
+        except BaseException:
+            _release(blocks, unlink=True)
+            raise
+
+        return future, blocks
+
+    @staticmethod
+    def __receive(results, errors, output):
+        """Load the variables returned by _run_cell."""
+        values = {}
+        for name, payload in results.items():
+            # The values are copied out of shared memory, and the blocks are unlinked
+            # here as the worker process doesn't unlink the blocks it creates.
+            try:
+                values[name], value_blocks = _loads(payload, copy=True)
+                _release(value_blocks, unlink=True)
+            except Exception as e:
+                errors[name] = f"{type(e).__name__}: {e}"
+                _unlink_payload(payload)
+
+        return values, errors, output
+
+    def __timed_out(self, timeout):
+        """Called when a cell doesn't complete in time."""
+        # The worker may still be using the inputs, so stop it before they're released
+        _log.warning(f"Offloaded cell didn't complete within {timeout}s; restarting the worker processes.")
+        self.__terminate()
+
+    def __terminate(self):
+        """Kill the worker processes and wait for them to exit.
+
+        The executor is recreated the next time the pool is used.
+        """
+        executor, self.__executor = self.__executor, None
+        if executor is None:
+            return
+
+        pids = self.__worker_pids
+        while not self.__pid_queue.empty():
+            pids.add(self.__pid_queue.get())
+
+        if not pids:
+            _log.warning("Offload worker processes have not started; they can't be killed.")
+            executor.shutdown(wait=False)
+            return
+
+        from .processes import kill_process_trees
+        kill_process_trees(pids)
+
+        # Once any worker has been killed the executor stops the others, and this waits for them to exit
+        executor.shutdown(wait=True)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes. They are restarted if the pool is used again."""
+        executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def _unlink_payload(payload):
+    """Unlink any shared memory blocks used by a payload created by _dumps."""
+    for chunk in payload[1]:
+        if isinstance(chunk, tuple):
+            try:
+                block = shared_memory.SharedMemory(name=chunk[0])
+            except FileNotFoundError:
+                continue
+            _release([block], unlink=True)
+
+
+def get_offload_pool():
+    """Return the OffloadPool used by the %%xl_offload magic.
+
+    The pool is created the first time this is called using the
+    'offload_processes' and 'offload_shm_threshold' options from the
+    JUPYTER section of the pyxll.cfg file.
+    """
+    global _offload_pool
+    if _offload_pool is None:
+        from pyxll import get_config
+        cfg = get_config()
+
+        processes = None
+        if cfg.has_option("JUPYTER", "offload_processes"):
+            try:
+                value = cfg.get("JUPYTER", "offload_processes").strip()
+                if value:
+                    processes = max(int(value), 1)
+            except (ValueError, TypeError):
+                _log.error("Unexpected value for JUPYTER.offload_processes.")
+
+        shm_threshold = DEFAULT_SHM_THRESHOLD
+        if cfg.has_option("JUPYTER", "offload_shm_threshold"):
+            try:
+                shm_threshold = max(int(cfg.get("JUPYTER", "offload_shm_threshold")), 0)
+            except (ValueError, TypeError):
+                _log.error("Unexpected value for JUPYTER.offload_shm_threshold.")
+
+        _offload_pool = OffloadPool(processes, shm_threshold)
+    return _offload_pool
+
+
+@atexit.register
+def _shutdown_offload_pool():
+    if _offload_pool is not None:
+        _offload_pool.shutdown(wait=False)
@@ -0,0 +1,196 @@
+"""
+Coalescing of stdout and stderr output sent from the kernel to the notebook.
+
+IPython's output streams send a message to the notebook each time they are
+flushed, and each flush made from Excel's main thread waits for the message
+to be sent. Code that flushes after every write, such as logging handlers or
+print(..., flush=True), can generate thousands of small messages.
+
+When enabled, writes are buffered and sent once at the end of each poll of
+the kernel, or sooner if the buffer exceeds a size threshold. All remaining
+output is always sent before a cell's reply. The rate of messages and the
+amount of output per cell can also be limited::
+
+    [JUPYTER]
+    coalesce_output = 1
+    output_flush_size = 65536
+    output_max_rate = 0
+    output_max_size = 0
+"""
+from .mainthread import is_main_thread
+import contextvars
+import threading
+import inspect
+import logging
+import time
+
+_log = logging.getLogger(__name__)
+
+
+class CoalescingStream:
+    """File-like object that buffers writes to an IPython output stream.
+
+    Buffered output is sent when send is called, or when the buffer reaches
+    flush_size characters. Calls to flush don't send anything themselves.
+
+    IPython associates output with the request being handled when it is
+    written, so the context of each write is kept and the output is sent
+    to the IPython stream in that same context.
+
+    :param stream: IPython OutStream to send output to.
+    :param notify: Function called when output is flushed from a thread other
+                   than Excel's main thread, so the kernel gets polled.
+    :param flush_size: Number of buffered characters that causes output to be sent immediately.
+    :param max_rate: Maximum number of times per second output is sent by send, or 0 for no limit.
+    :param max_size: Maximum number of characters sent per cell, or 0 for no limit.
+    """
+
+    def __init__(self, stream, notify=None, flush_size=65536, max_rate=0.0, max_size=0):
+        self.__stream = stream
+        self.__notify = notify
+        self.__lock = threading.RLock()
+        self.__buffer = []
+        self.__buffer_size = 0
+        self.__last_send = 0.0
+        self.__sent = 0
+        self.__dropped = 0
+        self.flush_size = flush_size
+        self.max_rate = max_rate
+        self.max_size = max_size
+
+    def write(self, data):
+        if not isinstance(data, str):
+            raise TypeError(f"write() argument must be str, not {type(data).__name__}")
+
+        length = len(data)
+        with self.__lock:
+            if self.max_size:
+                available = max(self.max_size - self.__sent - self.__buffer_size, 0)
+                if length > available:
+                    self.__dropped += length - available
+                    data = data[:available]
+
+            if data:
+                parent = getattr(self.__stream, "parent_header", None)
+                if self.__buffer and self.__buffer[-1][0] is parent:
+                    self.__buffer[-1][2].append(data)
+                else:
+                    self.__buffer.append((parent, contextvars.copy_context(), [data]))
+                self.__buffer_size += len(data)
+
+            if self.__buffer_size >= self.flush_size:
+                self.__send()
+
+        return length
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Buffered output is sent at the end of the next poll of the kernel.
+
+        If called from another thread the kernel is woken up so that
+        output is sent without waiting for the next scheduled poll.
+        """
+        if self.__buffer and self.__notify is not None and not is_main_thread():
+            self.__notify()
+
+    def send(self, force=False):
+        """Send any buffered output to the notebook.
+
+        Unless force is set this does nothing if output was sent too
+        recently for max_rate. If force is set the IPython stream is
+        also flushed, and a message is added if any output was dropped.
+        """
+        with self.__lock:
+            if not force and self.max_rate > 0:
+                if time.perf_counter() - self.__last_send < 1.0 / self.max_rate:
+                    return
+
+            if force and self.__dropped:
+                message = (f"\n[{self.__dropped} characters of output were not shown "
+                           f"as the limit of {self.max_size} per cell was reached]\n")
+                self.__buffer.append((None, contextvars.copy_context(), [message]))
+                self.__dropped = 0
+
+            self.__send()
+
+        if force:
+            self.__stream.flush()
+
+    def reset(self):
+        """Reset the per-cell output limit. Called before each cell is run."""
+        with self.__lock:
+            self.__sent = 0
+            self.__dropped = 0
+
+    def set_parent(self, parent):
+        # Output buffered so far belongs to the previous request
+        self.send(force=True)
+        self.__stream.set_parent(parent)
+
+    def __send(self):
+        if not self.__buffer:
+            return
+
+        buffer = self.__buffer
+        self.__buffer = []
+        self.__buffer_size = 0
+        self.__last_send = time.perf_counter()
+
+        for parent, context, chunks in buffer:
+            data = "".join(chunks)
+            self.__sent += len(data)
+            context.run(self.__stream.write, data)
+
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
+
+
+class OutputCoalescer:
+    """Wraps the kernel's stdout and stderr in CoalescingStreams.
+
+    :param stdout: IPython stdout stream.
+    :param stderr: IPython stderr stream.
+    :param notify: Function used to wake the kernel (see CoalescingStream).
+    :param flush_size: See CoalescingStream.
+    :param max_rate: See CoalescingStream.
+    :param max_size: See CoalescingStream.
+    """
+
+    def __init__(self, stdout, stderr, notify=None, flush_size=65536, max_rate=0.0, max_size=0):
+        if flush_size < 1:
+            raise ValueError("flush_size must be at least 1.")
+        if max_rate < 0:
+            raise ValueError("max_rate must not be negative.")
+        if max_size < 0:
+            raise ValueError("max_size must not be negative.")
+
+        kwargs = dict(notify=notify, flush_size=flush_size, max_rate=max_rate, max_size=max_size)
+        self.stdout = CoalescingStream(stdout, **kwargs)
+        self.stderr = CoalescingStream(stderr, **kwargs)
+
+    def install(self, kernel):
+        """Replace the kernel's do_execute method so that the output limits
+        are reset before each cell, and all output is sent before the reply.
+        """
+        do_execute = kernel.do_execute
+
+        async def coalescing_do_execute(*args, **kwargs):
+            self.stdout.reset()
+            self.stderr.reset()
+            try:
+                result = do_execute(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            finally:
+                self.send(force=True)
+
+        kernel.do_execute = coalescing_do_execute
+
+    def send(self, force=False):
+        """Send any buffered output. Called on Excel's main thread after each poll."""
+        self.stdout.send(force=force)
+        self.stderr.send(force=force)
@@ -0,0 +1,592 @@
+"""
+Helpers used by the kernel to decide when the IPython kernel's event loop
+needs to be polled on Excel's main thread.
+
+The kernel's event loop is never run continuously in Excel. Instead, a
+background thread waits until there may be something to do and then uses
+pyxll.schedule_call to run the loop briefly on Excel's main thread.
+
+How that background thread waits is controlled by the 'wakeup' option
+in the JUPYTER section of the pyxll.cfg file::
+
+    [JUPYTER]
+    wakeup = zmq
+
+'timer' (the default) polls at a fixed interval. 'zmq' watches the
+kernel's ZMQ sockets and only polls when messages are waiting to be read.
+It also watches the sockets used by the kernel's asyncio event loop, so
+that cells awaiting network I/O resume as soon as data arrives.
+
+The interval between polls can also be made adaptive, so that the kernel
+is polled quickly after any traffic and backs off while it is idle::
+
+    [JUPYTER]
+    adaptive_polling = 1
+    poll_min_interval = 0.005
+    poll_max_interval = 1.0
+    poll_decay = 1.5
+
+Each poll drains the kernel's event loop for up to 'poll_slice_budget'
+seconds, and the share of the main thread's time used by the kernel can
+be capped over a rolling window::
+
+    [JUPYTER]
+    poll_slice_budget = 0.02
+    max_duty_cycle = 0.5
+    duty_cycle_window = 1.0
+
+If set, polling stops altogether once no frontend has used the kernel for
+'idle_timeout' seconds, or no frontend has been connected for a few
+seconds, and starts again as soon as the next message arrives. This
+is off by default::
+
+    [JUPYTER]
+    idle_timeout = 300
+"""
+import collections
+import selectors
+import atexit
+import threading
+import logging
+import select
+import socket
+import time
+import zmq
+from zmq.utils.monitor import recv_monitor_message
+
+_log = logging.getLogger(__name__)
+
+
+def get_pending_work(loop):
+    """Return a tuple of (pending, next_timer) for a tornado IOLoop.
+
+    pending is True if the loop has callbacks that are ready to run now.
+    next_timer is the number of seconds until the loop's next timer is
+    due, or None if there are no timers.
+
+    This looks at the underlying asyncio loop. For any other kind of loop
+    (False, None) is returned.
+    """
+    asyncio_loop = getattr(loop, "asyncio_loop", None)
+    if asyncio_loop is None:
+        return False, None
+
+    pending = bool(getattr(asyncio_loop, "_ready", None))
+
+    next_timer = None
+    scheduled = getattr(asyncio_loop, "_scheduled", None)
+    if scheduled:
+        next_timer = max(scheduled[0].when() - asyncio_loop.time(), 0.0)
+
+    return pending, next_timer
+
+
+def get_loop_fds(loop, exclude=()):
+    """Return a tuple of ([readers], [writers]) of the file descriptors
+    registered with the asyncio loop underlying a tornado IOLoop.
+
+    This must be called on the thread that runs the loop. If the loop
+    doesn't use a selector then ([], []) is returned.
+
+    :param exclude: File descriptors to leave out.
+    """
+    asyncio_loop = getattr(loop, "asyncio_loop", None)
+    selector = getattr(asyncio_loop, "_selector", None)
+    if selector is None:
+        return [], []
+
+    readers, writers = [], []
+    for key in list(selector.get_map().values()):
+        if key.fd in exclude:
+            continue
+        if key.events & selectors.EVENT_READ:
+            readers.append(key.fd)
+        if key.events & selectors.EVENT_WRITE:
+            writers.append(key.fd)
+
+    return readers, writers
+
+
+class MessageCounter:
+    """Counts the shell messages dispatched by an IPython kernel.
+
+    install must be called before the kernel is started.
+    """
+
+    def __init__(self):
+        self.__count = 0
+
+    def install(self, kernel):
+        """Wrap the kernel's dispatch_shell method to count each message."""
+        dispatch_shell = kernel.dispatch_shell
+
+        def counting_dispatch_shell(*args, **kwargs):
+            self.__count += 1
+            return dispatch_shell(*args, **kwargs)
+
+        kernel.dispatch_shell = counting_dispatch_shell
+
+    def take(self):
+        """Return the number of messages dispatched since take was last called."""
+        count, self.__count = self.__count, 0
+        return count
+
+
+class AdaptiveInterval:
+    """Interval between polls that shortens after traffic and backs off when idle.
+
+    After any poll that handled messages the interval snaps back to min_interval.
+    After each poll with nothing to do the interval is multiplied by decay, up
+    to max_interval.
+
+    :param min_interval: Interval in seconds used right after traffic.
+    :param max_interval: Interval in seconds used once the kernel is idle.
+    :param decay: Factor the interval is multiplied by after each idle poll.
+    """
+
+    def __init__(self, min_interval=0.005, max_interval=1.0, decay=1.5):
+        if min_interval <= 0:
+            raise ValueError("min_interval must be greater than zero.")
+        if max_interval < min_interval:
+            raise ValueError("max_interval must not be less than min_interval.")
+        if decay < 1.0:
+            raise ValueError("decay must be at least 1.0.")
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.decay = decay
+        self.current = min_interval
+
+    def update(self, active):
+        """Update and return the interval after a poll.
+
+        :param active: True if the poll handled any messages.
+        """
+        if active:
+            if self.current > self.min_interval:
+                _log.debug(f"Kernel poll interval reset to {self.min_interval:.3f}s after activity.")
+            self.current = self.min_interval
+        elif self.current < self.max_interval:
+            self.current = min(self.current * self.decay, self.max_interval)
+            if self.current >= self.max_interval:
+                _log.debug(f"Kernel idle; poll interval backed off to {self.max_interval:.3f}s.")
+
+        return self.current
+
+
+class DutyCycleGovernor:
+    """Keeps the fraction of time spent polling the kernel under a maximum.
+
+    The time taken by each poll is recorded, and delay returns how long to wait
+    before the next poll so that the total time spent polling within any
+    rolling window stays under max_duty_cycle.
+
+    :param max_duty_cycle: Maximum fraction (0 - 1) of the window spent polling.
+    :param window: Length of the rolling window in seconds.
+    """
+
+    def __init__(self, max_duty_cycle=1.0, window=1.0):
+        if not 0.0 < max_duty_cycle <= 1.0:
+            raise ValueError("max_duty_cycle must be greater than 0 and no more than 1.")
+        if window <= 0:
+            raise ValueError("window must be greater than zero.")
+
+        self.max_duty_cycle = max_duty_cycle
+        self.window = window
+        self.__slices = collections.deque()
+        self.__busy = 0.0
+
+    def __prune(self, now):
+        while self.__slices and self.__slices[0][0] <= now - self.window:
+            _, duration = self.__slices.popleft()
+            self.__busy -= duration
+
+    def record(self, end, duration):
+        """Record a poll that ended at 'end' (time.perf_counter) and took 'duration' seconds."""
+        self.__slices.append((end, duration))
+        self.__busy += duration
+        self.__prune(end)
+
+    def duty_cycle(self, now):
+        """Return the fraction of the window up to 'now' that was spent polling."""
+        self.__prune(now)
+        return max(self.__busy, 0.0) / self.window
+
+    def delay(self, now):
+        """Return the time in seconds to wait before polling again."""
+        self.__prune(now)
+        allowed = self.max_duty_cycle * self.window
+        if self.__busy <= allowed:
+            return 0.0
+
+        # Wait until enough of the oldest polls have dropped out of the window
+        busy = self.__busy
+        for end, duration in self.__slices:
+            busy -= duration
+            if busy <= allowed:
+                return max(end + self.window - now, 0.0)
+
+        return self.window
+
+
+class TimerWakeup:
+    """Waits for a fixed interval between each poll of the kernel.
+
+    :param interval: Time in seconds to wait after each poll.
+    """
+
+    name = "timer"
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.__notified = threading.Event()
+
+    def wait(self, pending=False, next_timer=None):
+        """Wait until the kernel should be polled again."""
+        self.__notified.wait(self.interval)
+        self.__notified.clear()
+        return False
+
+    def notify(self):
+        """Wake the waiting thread so the kernel is polled as soon as possible.
+        May be called from any thread.
+        """
+        self.__notified.set()
+
+    def drain(self):
+        """Called on the main thread after each poll.
+        Returns True if any messages are still waiting to be read.
+        """
+        return False
+
+
+class ZMQWakeup:
+    """Waits until one of the kernel's ZMQ sockets is readable.
+
+    ZMQ sockets expose a file descriptor that becomes readable whenever the
+    socket's state may have changed. That file descriptor is selected on
+    from the background thread, and the socket itself is only ever touched
+    from the main thread in 'drain', as ZMQ sockets are not thread safe.
+
+    If the kernel's event loop is given then any other file descriptors
+    registered with it, such as sockets used by coroutines, are also watched.
+    These are read from the loop on the main thread in 'drain'.
+
+    :param sockets: ZMQ sockets read from Excel's main thread.
+    :param interval: Maximum time in seconds to wait without polling, so that
+                     any timers in the kernel's event loop still run.
+    :param loop: The kernel's tornado IOLoop.
+    :param streams: ZMQStreams the kernel reads the sockets with.
+    """
+
+    name = "zmq"
+
+    def __init__(self, sockets, interval=1.0, loop=None, streams=()):
+        self.interval = interval
+        self.__sockets = list(sockets)
+        self.__loop = loop
+        self.__streams = {stream.socket: stream for stream in streams}
+        self.__notify_recv, self.__notify_send = socket.socketpair()
+        self.__notify_recv.setblocking(False)
+        self.__notify_send.setblocking(False)
+        self.__fds = [s.getsockopt(zmq.FD) for s in self.__sockets] + [self.__notify_recv]
+        self.__exclude = {s.getsockopt(zmq.FD) for s in self.__sockets}
+        self.__loop_readers, self.__loop_writers = [], []
+
+    def wait(self, pending=False, next_timer=None):
+        """Wait until a socket is ready, a timer is due, or the interval
+        has elapsed. Returns True if a socket is ready.
+        """
+        if pending:
+            return False
+
+        timeout = self.interval
+        if next_timer is not None:
+            timeout = min(timeout, next_timer)
+
+        return self.__select(timeout)
+
+    def wait_for_message(self, next_timer=None):
+        """Wait until a socket is ready or a timer is due, without any maximum interval.
+        Used while the kernel is idle. Returns True if a socket is ready.
+        """
+        return self.__select(next_timer)
+
+    def __select(self, timeout):
+        try:
+            readable, writable, _ = select.select(self.__fds + self.__loop_readers,
+                                                  self.__loop_writers,
+                                                  [],
+                                                  timeout)
+        except (OSError, ValueError):
+            # One of the event loop's file descriptors was closed after 'drain'.
+            # Wait on the kernel's own sockets until the next poll updates them.
+            self.__loop_readers, self.__loop_writers = [], []
+            readable, writable, _ = select.select(self.__fds, [], [], timeout)
+
+        if self.__notify_recv in readable:
+            try:
+                while self.__notify_recv.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+        return bool(readable or writable)
+
+    def notify(self):
+        """Wake the waiting thread so the kernel is polled as soon as possible.
+        May be called from any thread.
+        """
+        try:
+            self.__notify_send.send(b"\0")
+        except BlockingIOError:
+            # The buffer is full, so the waiting thread will be woken anyway
+            pass
+
+    def drain(self):
+        """Called on the main thread after each poll.
+
+        Reading ZMQ_EVENTS resets each socket's file descriptor so that it
+        only becomes readable again when something new arrives.
+
+        Returns True if any messages are still waiting to be read.
+        """
+        waiting = False
+        for sock in self.__sockets:
+            if sock.getsockopt(zmq.EVENTS) & zmq.POLLIN:
+                waiting = True
+
+                # Reading ZMQ_EVENTS also resets the file descriptor the event loop is waiting
+                # on for the socket's stream, so messages that arrived since the stream last
+                # read the socket have to be passed to the stream directly.
+                stream = self.__streams.get(sock)
+                if stream is not None:
+                    stream.flush(zmq.POLLIN)
+
+        if self.__loop is not None:
+            self.__loop_readers, self.__loop_writers = get_loop_fds(self.__loop, exclude=self.__exclude)
+
+        return waiting
+
+
+class IdleMonitor:
+    """Tracks whether any frontend is connected to or using the kernel.
+
+    Connections to the kernel's shell socket are counted using a ZMQ socket
+    monitor. Each notebook or console connects its own shell socket, and so
+    once they have all been closed no frontend is connected.
+
+    The kernel is considered idle if no shell or control messages have been
+    received for idle_timeout seconds, or sooner if no frontends have been
+    connected for disconnected_timeout seconds. Nothing needs to be done to
+    resume the kernel other than calling 'update' after the next message.
+
+    :param idle_timeout: Seconds without any messages before the kernel is idle.
+    :param disconnected_timeout: Seconds without any connected frontends before
+                                 the kernel is idle.
+    """
+
+    def __init__(self, idle_timeout=300.0, disconnected_timeout=5.0):
+        if idle_timeout <= 0:
+            raise ValueError("idle_timeout must be greater than zero.")
+
+        self.idle_timeout = idle_timeout
+        self.disconnected_timeout = min(disconnected_timeout, idle_timeout)
+        self.__monitor = None
+        self.__monitor_lock = threading.Lock()
+        self.__connected = None
+        self.__last_activity = time.monotonic()
+        self.__disconnected_since = None
+        self.__idle = False
+        self.__idle_since = None
+
+    @property
+    def connected(self):
+        """Number of frontends connected to the kernel, or None if not known."""
+        return self.__connected
+
+    @property
+    def idle(self):
+        """True if the kernel was idle when 'update' was last called."""
+        return self.__idle
+
+    def install(self, app):
+        """Start monitoring an IPKernelApp.
+
+        This must be called on the thread that uses the kernel's shell socket,
+        and before the kernel is started.
+        """
+        kernel = app.kernel
+        dispatch_control = kernel.dispatch_control
+
+        async def monitored_dispatch_control(*args, **kwargs):
+            self.record_activity()
+            return await dispatch_control(*args, **kwargs)
+
+        kernel.dispatch_control = monitored_dispatch_control
+
+        try:
+            self.__monitor = app.shell_socket.get_monitor_socket(zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED)
+            self.__monitor.linger = 0
+            self.__connected = 0
+        except Exception:
+            _log.warning("Unable to monitor connections to the kernel; only messages will be used "
+                         "to decide if the kernel is idle.", exc_info=True)
+            return
+
+        # The monitor socket has to be closed before IPKernelApp.close terminates the ZMQ context
+        # (atexit functions are called in reverse order, and IPKernelApp registers its first).
+        atexit.register(self.close)
+
+    def close(self):
+        """Stop monitoring connections to the kernel. May be called from any thread."""
+        # The monitor socket is read by 'update' on the polling thread, so wait for any
+        # update in progress to finish with it before closing it.
+        with self.__monitor_lock:
+            monitor, self.__monitor = self.__monitor, None
+        if monitor is not None:
+            monitor.close()
+
+    def record_activity(self):
+        """Record that a message has been received. May be called from any thread."""
+        self.__last_activity = time.monotonic()
+
+    def __read_events(self, monitor, now):
+        """Update the number of connected frontends from the socket monitor."""
+        while True:
+            try:
+                event = recv_monitor_message(monitor, zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            except zmq.ZMQError:
+                # The monitor has been closed
+                self.__monitor = None
+                break
+
+            if event["event"] == zmq.EVENT_ACCEPTED:
+                self.__connected += 1
+                self.__disconnected_since = None
+                _log.debug(f"Frontend connected to the kernel ({self.__connected} connected).")
+            elif event["event"] == zmq.EVENT_DISCONNECTED:
+                self.__connected = max(self.__connected - 1, 0)
+                if self.__connected == 0:
+                    self.__disconnected_since = now
+                _log.debug(f"Frontend disconnected from the kernel ({self.__connected} connected).")
+
+    def update(self, active=False):
+        """Update and return whether the kernel is idle.
+
+        This is called from the thread that schedules polls of the kernel after each poll.
+
+        :param active: True if the last poll handled any messages.
+        """
+        now = time.monotonic()
+        if active:
+            self.__last_activity = now
+
+        with self.__monitor_lock:
+            monitor = self.__monitor
+            if monitor is not None:
+                self.__read_events(monitor, now)
+
+        idle_for = now - self.__last_activity
+        idle = idle_for >= self.idle_timeout
+        if not idle and self.__disconnected_since is not None:
+            idle = min(idle_for, now - self.__disconnected_since) >= self.disconnected_timeout
+
+        if idle and not self.__idle:
+            self.__idle_since = now
+            reason = "no frontends connected" if self.__connected == 0 else f"no messages for {idle_for:.0f}s"
+            _log.info(f"IPython kernel idle ({reason}); polling paused until the next message.")
+        elif self.__idle and not idle:
+            _log.info(f"IPython kernel polling resumed after being idle for {now - self.__idle_since:.0f}s.")
+
+        self.__idle = idle
+        return idle
+
+    def info(self):
+        """Return a dict describing whether the kernel is idle and the number of connected frontends."""
+        return {
+            "idle": self.__idle,
+            "connected": self.__connected,
+            "seconds_since_activity": time.monotonic() - self.__last_activity,
+            "idle_timeout": self.idle_timeout,
+        }
+
+
+def _get_wakeup_sockets(app, stdin=True):
+    """Return the ZMQ sockets of an IPKernelApp that are read on the main thread."""
+    kernel = app.kernel
+
+    # ipykernel >= 7 receives shell messages on its own thread and forwards them
+    # to the main thread internally, so the sockets can't be used directly.
+    if getattr(kernel, "shell_channel_thread", None) is not None:
+        return []
+
+    sockets = [app.shell_socket]
+
+    # The stdin socket isn't used on the main thread if cells are run on another thread
+    if stdin:
+        sockets.append(app.stdin_socket)
+
+    # ipykernel >= 6 handles control messages on a separate thread and so
+    # they don't need the main thread to be woken.
+    if getattr(app, "control_thread", None) is None:
+        sockets.append(app.control_socket)
+
+    return [s for s in sockets if s is not None]
+
+
+def _get_kernel_streams(kernel):
+    """Return the ZMQStreams used by an IPython kernel to read its sockets."""
+    streams = list(getattr(kernel, "shell_streams", None) or [])
+    for name in ("shell_stream", "control_stream"):
+        stream = getattr(kernel, name, None)
+        if stream is not None and stream not in streams:
+            streams.append(stream)
+    return streams
+
+
+def create_idle_wakeup(app, wakeup, stdin=True):
+    """Return the ZMQWakeup used to wait for the next message while the kernel is idle,
+    or None if the kernel's sockets can't be watched.
+
+    If the kernel already uses a ZMQWakeup that is returned, otherwise a new one is
+    created. Its 'drain' method must be called after each poll, the same as 'wakeup'.
+
+    :param app: IPKernelApp instance.
+    :param wakeup: The wakeup returned by create_wakeup.
+    :param stdin: Watch the stdin socket, if it is read from the main thread.
+    """
+    if isinstance(wakeup, ZMQWakeup):
+        return wakeup
+
+    try:
+        sockets = _get_wakeup_sockets(app, stdin=stdin)
+        if sockets:
+            return ZMQWakeup(sockets, loop=getattr(app, "loop", None), streams=_get_kernel_streams(app.kernel))
+    except Exception:
+        _log.warning("Error watching kernel ZMQ sockets.", exc_info=True)
+
+    return None
+
+
+def create_wakeup(app, mode="timer", stdin=True):
+    """Create the object used to wait between polls of the kernel.
+
+    If the 'zmq' mode can't be used with the installed version of ipykernel
+    then the 'timer' mode is used instead.
+
+    :param app: IPKernelApp instance.
+    :param mode: Either 'timer' or 'zmq'.
+    :param stdin: Watch the stdin socket, if it is read from the main thread.
+    """
+    if mode == "zmq":
+        try:
+            sockets = _get_wakeup_sockets(app, stdin=stdin)
+            if sockets:
+                return ZMQWakeup(sockets, loop=getattr(app, "loop", None), streams=_get_kernel_streams(app.kernel))
+            _log.warning("Kernel ZMQ sockets not available; falling back to timer based polling.")
+        except Exception:
+            _log.warning("Error watching kernel ZMQ sockets; falling back to timer based polling.", exc_info=True)
+
+    return TimerWakeup()
@@ -0,0 +1,216 @@
+"""
+Termination of process trees.
+
+The Jupyter server may start child processes of its own (for example, when
+started via a cmd shell or for terminals), so stopping a server means
+terminating the whole tree of processes under it.
+
+The tree is found from a single snapshot of all running processes, and all
+processes in the trees being killed are terminated in parallel. Finding the
+running processes and terminating them is done by a platform specific
+ProcessBackend; Windows uses the Toolhelp32 API and other platforms use
+/proc or ps and signals.
+"""
+from abc import ABC, abstractmethod
+import concurrent.futures
+import subprocess
+import logging
+import signal
+import ctypes
+import sys
+import os
+
+_log = logging.getLogger(__name__)
+
+
+class ProcessBackend(ABC):
+    """Platform specific functions used to find and terminate processes."""
+
+    @abstractmethod
+    def snapshot(self):
+        """Return a dict of {pid: parent pid} of all running processes."""
+
+    @abstractmethod
+    def terminate(self, pid):
+        """Terminate a process. Returns False if the process was no longer running."""
+
+
+class WindowsProcessBackend(ProcessBackend):
+    """ProcessBackend using the Windows Toolhelp32 API."""
+
+    _TH32CS_SNAPPROCESS = 0x00000002
+    _PROCESS_TERMINATE = 0x0001
+    _ERROR_INVALID_PARAMETER = 87
+    _INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    class _PROCESSENTRY32(ctypes.Structure):
+        _fields_ = [("dwSize", ctypes.c_ulong),
+                    ("cntUsage", ctypes.c_ulong),
+                    ("th32ProcessID", ctypes.c_ulong),
+                    ("th32DefaultHeapID", ctypes.c_void_p),
+                    ("th32ModuleID", ctypes.c_ulong),
+                    ("cntThreads", ctypes.c_ulong),
+                    ("th32ParentProcessID", ctypes.c_ulong),
+                    ("pcPriClassBase", ctypes.c_ulong),
+                    ("dwFlags", ctypes.c_ulong),
+                    ("szExeFile", ctypes.c_char * 260)]
+
+    def __init__(self):
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        self.__CreateToolhelp32Snapshot = kernel32.CreateToolhelp32Snapshot
+        self.__CreateToolhelp32Snapshot.restype = ctypes.c_void_p
+        self.__Process32First = kernel32.Process32First
+        self.__Process32Next = kernel32.Process32Next
+        self.__OpenProcess = kernel32.OpenProcess
+        self.__OpenProcess.restype = ctypes.c_void_p
+        self.__TerminateProcess = kernel32.TerminateProcess
+        self.__TerminateProcess.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+        self.__CloseHandle = kernel32.CloseHandle
+        self.__CloseHandle.argtypes = [ctypes.c_void_p]
+
+    def snapshot(self):
+        processes = {}
+        snapshot = self.__CreateToolhelp32Snapshot(self._TH32CS_SNAPPROCESS, 0)
+        if snapshot is None or snapshot == self._INVALID_HANDLE_VALUE:
+            raise OSError('CreateToolhelp32Snapshot failed with error code %d' % ctypes.get_last_error())
+        try:
+            entry = self._PROCESSENTRY32()
+            entry.dwSize = ctypes.sizeof(self._PROCESSENTRY32)
+            if not self.__Process32First(ctypes.c_void_p(snapshot), ctypes.byref(entry)):
+                raise OSError('Process32First failed with error code %d' % ctypes.get_last_error())
+            while True:
+                processes[entry.th32ProcessID] = entry.th32ParentProcessID
+                if not self.__Process32Next(ctypes.c_void_p(snapshot), ctypes.byref(entry)):
+                    break
+        finally:
+            self.__CloseHandle(snapshot)
+        return processes
+
+    def terminate(self, pid):
+        handle = self.__OpenProcess(self._PROCESS_TERMINATE, False, pid)
+        if not handle:
+            error = ctypes.get_last_error()
+            if error == self._ERROR_INVALID_PARAMETER:
+                return False
+            raise OSError("OpenProcess failed with error code %d" % error)
+        try:
+            if 0 == self.__TerminateProcess(handle, 0xFFFFFFF7):
+                raise OSError("TerminateProcess failed with error code %d" % ctypes.get_last_error())
+        finally:
+            self.__CloseHandle(handle)
+        return True
+
+
+class PosixProcessBackend(ProcessBackend):
+    """ProcessBackend using /proc (or ps if /proc isn't available) and SIGKILL."""
+
+    def snapshot(self):
+        if os.path.isdir("/proc/self"):
+            return self.__proc_snapshot()
+        return self.__ps_snapshot()
+
+    @staticmethod
+    def __proc_snapshot():
+        processes = {}
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{name}/stat", "rb") as fh:
+                    stat = fh.read()
+            except OSError:
+                continue
+
+            # The process name is in brackets and may contain spaces, and the parent pid follows the state
+            fields = stat.rsplit(b")", 1)[-1].split()
+            if len(fields) > 1:
+                processes[int(name)] = int(fields[1])
+        return processes
+
+    @staticmethod
+    def __ps_snapshot():
+        output = subprocess.check_output(["ps", "-A", "-o", "pid=", "-o", "ppid="])
+        processes = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                processes[int(fields[0])] = int(fields[1])
+        return processes
+
+    def terminate(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return False
+        return True
+
+
+_backend = None
+
+
+def get_process_backend():
+    """Return the ProcessBackend for the current platform."""
+    global _backend
+    if _backend is None:
+        _backend = WindowsProcessBackend() if sys.platform == "win32" else PosixProcessBackend()
+    return _backend
+
+
+def get_process_trees(processes, pids):
+    """Return the pids in each process tree rooted at pids, including the roots.
+
+    :param processes: Dict of {pid: parent pid}, as returned by ProcessBackend.snapshot.
+    :param pids: Pids of the processes at the root of each tree.
+    :return: List of pids, with parents before their children. Roots that aren't
+             in processes are not included.
+    """
+    children = {}
+    for pid, ppid in processes.items():
+        # Process 0 on Windows is its own parent
+        if pid != ppid:
+            children.setdefault(ppid, []).append(pid)
+
+    result = []
+    seen = set()
+    pending = [pid for pid in pids if pid in processes]
+    while pending:
+        pid = pending.pop(0)
+        if pid in seen:
+            continue
+        seen.add(pid)
+        result.append(pid)
+        pending.extend(children.get(pid, ()))
+    return result
+
+
+def kill_process_trees(pids, backend=None, max_workers=8):
+    """Terminate each process in pids and all of their descendants.
+
+    All descendants are found from a single snapshot taken before any are terminated,
+    so children of processes that are terminated are still found. The processes are
+    then terminated in parallel.
+
+    :param pids: Pids of the processes to terminate.
+    :param backend: ProcessBackend to use, or None for the current platform's backend.
+    :param max_workers: Maximum number of threads used to terminate processes.
+    :return: List of the pids that were terminated.
+    """
+    backend = backend or get_process_backend()
+    tree = get_process_trees(backend.snapshot(), pids)
+    if not tree:
+        return []
+
+    def terminate(pid):
+        try:
+            return backend.terminate(pid)
+        except Exception:
+            _log.warning(f"Failed to kill process {pid}", exc_info=True)
+            return False
+
+    if len(tree) == 1:
+        results = [terminate(tree[0])]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(min(len(tree), max_workers)) as executor:
+            results = list(executor.map(terminate, tree))
+
+    return [pid for pid, terminated in zip(tree, results) if terminated]
@@ -0,0 +1,217 @@
+"""
+Profiling of the phases of opening Jupyter from Excel.
+
+A StartupProfile records when each phase of starting the kernel and the
+Jupyter server starts and ends, using time.perf_counter. While a profile is
+active, code anywhere in the package can record a phase using the phase
+context manager, which does nothing if no profile is active::
+
+    profile = StartupProfile("launch_jupyter")
+    with profile.active():
+        with phase("start_kernel"):
+            ...
+    profile.finish()
+
+Phases that end on another thread or in a later callback, like waiting for
+the server or the browser loading the page, use StartupProfile.begin.
+
+Reports can be written as Chrome trace JSON, which can be opened in
+chrome://tracing or https://ui.perfetto.dev.
+"""
+from contextlib import contextmanager
+import threading
+import logging
+import json
+import time
+import os
+
+_log = logging.getLogger(__name__)
+
+# The profile phases are being recorded to, if any
+_active_profile = None
+
+
+class _Phase:
+    """A phase started by StartupProfile.begin that ends when end is called."""
+
+    def __init__(self, profile, name, depth, args):
+        self.__profile = profile
+        self.__name = name
+        self.__depth = depth
+        self.__args = args
+        self.__thread = threading.current_thread().name
+        self.__start = time.perf_counter()
+        self.__ended = False
+
+    def end(self, **args):
+        """End the phase. Any args are added to the phase's args."""
+        if self.__ended:
+            return
+        self.__ended = True
+        self.__args.update(args)
+        self.__profile._add(self.__name, self.__start, time.perf_counter(), self.__thread, self.__depth, self.__args)
+
+
+class StartupProfile:
+    """Records the start and end times of each phase of opening Jupyter.
+
+    Values added to the args dict are included in the report.
+
+    :param name: Name of what is being profiled, e.g. 'launch_jupyter'.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.args = {}
+        self.started = time.time()
+        self.finished = None
+        self.__start = time.perf_counter()
+        self.__end = None
+        self.__thread = threading.current_thread().name
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__phases = []
+
+    @contextmanager
+    def active(self):
+        """Context manager that makes this the profile phases are recorded to."""
+        global _active_profile
+        previous = _active_profile
+        _active_profile = self
+        try:
+            yield self
+        finally:
+            _active_profile = previous
+
+    @contextmanager
+    def phase(self, name, **args):
+        """Context manager that records a phase of startup."""
+        depth = getattr(self.__local, "depth", 0)
+        self.__local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.__local.depth = depth
+            self._add(name, start, time.perf_counter(), threading.current_thread().name, depth, args)
+
+    def begin(self, name, **args):
+        """Start a phase that is ended by calling end on the returned object."""
+        return _Phase(self, name, getattr(self.__local, "depth", 0), args)
+
+    def _add(self, name, start, end, thread, depth, args):
+        with self.__lock:
+            if self.__end is not None:
+                _log.debug(f"Startup phase '{name}' ended after the profile was finished.")
+                return
+            self.__phases.append((name, start, end, thread, depth, dict(args)))
+
+    def finish(self):
+        """Stop recording phases. Returns False if already finished."""
+        with self.__lock:
+            if self.__end is not None:
+                return False
+            self.__end = time.perf_counter()
+            self.finished = time.time()
+            return True
+
+    def report(self):
+        """Return a dict describing the profile and each of its phases.
+
+        Phase start times are in seconds from the start of the profile.
+        """
+        with self.__lock:
+            end = self.__end if self.__end is not None else time.perf_counter()
+            phases = sorted(self.__phases, key=lambda p: (p[1], p[4]))
+
+        return {
+            "name": self.name,
+            "started": self.started,
+            "total": end - self.__start,
+            "pid": os.getpid(),
+            "thread": self.__thread,
+            "args": dict(self.args),
+            "phases": [{
+                "name": name,
+                "start": start - self.__start,
+                "duration": end - start,
+                "thread": thread,
+                "depth": depth,
+                "args": args,
+            } for name, start, end, thread, depth, args in phases],
+            "origin": self.__start,
+        }
+
+
+def get_active_profile():
+    """Return the active StartupProfile, or None."""
+    return _active_profile
+
+
+@contextmanager
+def phase(name, **args):
+    """Context manager that records a phase to the active profile, if any."""
+    profile = _active_profile
+    if profile is None:
+        yield args
+        return
+
+    with profile.phase(name, **args) as args:
+        yield args
+
+
+def begin(name, **args):
+    """Start a phase in the active profile. Returns an object with an end method, or None."""
+    profile = _active_profile
+    if profile is None:
+        return None
+    return profile.begin(name, **args)
+
+
+def format_report(report):
+    """Format a report returned by StartupProfile.report as text."""
+    args = ", ".join(f"{k}={v}" for k, v in report["args"].items())
+    lines = [f"Jupyter startup profile for {report['name']} ({report['total']:.3f}s"
+             + (f", {args}" if args else "") + "):"]
+    for p in report["phases"]:
+        name = "  " * p["depth"] + p["name"]
+        args = ", ".join(f"{k}={v}" for k, v in p["args"].items())
+        thread = f" [{p['thread']}]" if p["thread"] != report["thread"] else ""
+        lines.append(f"  {name:<40} {p['start']:>8.3f}s {p['duration']:>8.3f}s{thread}"
+                     + (f" ({args})" if args else ""))
+    return "\n".join(lines)
+
+
+def to_chrome_trace(reports):
+    """Convert a list of reports to a Chrome trace dict.
+
+    Reports from the same process share a timeline, so several openings of Jupyter
+    in one Excel session can be compared.
+    """
+    events = []
+    threads = {}
+    for report in reports:
+        pid = report["pid"]
+        origin = report["origin"]
+        tid = threads.setdefault((pid, report["name"]), len(threads) + 1)
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                       "args": {"name": report["name"]}})
+        events.append({"name": report["name"], "cat": "startup", "ph": "X", "pid": pid, "tid": tid,
+                       "ts": origin * 1e6, "dur": report["total"] * 1e6,
+                       "args": dict({"started": report["started"]}, **{k: str(v) for k, v in report["args"].items()})})
+        for p in report["phases"]:
+            ptid = tid if p["thread"] == report["thread"] else threads.setdefault((pid, p["thread"]), len(threads) + 1)
+            if ptid != tid:
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": ptid,
+                               "args": {"name": p["thread"]}})
+            events.append({"name": p["name"], "cat": "startup", "ph": "X", "pid": pid, "tid": ptid,
+                           "ts": (origin + p["start"]) * 1e6, "dur": p["duration"] * 1e6,
+                           "args": {k: str(v) for k, v in p["args"].items()}})
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path, reports):
+    """Write a list of reports to a Chrome trace JSON file."""
+    with open(path, "wt", encoding="utf-8") as fh:
+        json.dump(to_chrome_trace(reports), fh)
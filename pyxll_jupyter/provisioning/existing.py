@@ -1,7 +1,6 @@
+from ..connection import get_connection_info
 from jupyter_client import KernelProvisionerBase
 import logging
-import json
-import os
 
 _log = logging.getLogger(__name__)
 
@@ -14,19 +13,8 @@ class ExistingProvisioner(KernelProvisionerBase):
     """
 
     async def launch_kernel(self, cmd, **kwargs):
-        # Connect to kernel started by PyXLL
-        connection_file = os.environ["PYXLL_IPYTHON_CONNECTION_FILE"]
-        if not os.path.abspath(connection_file):
-            connection_dir = os.path.join(os.environ["APPDATA"], "jupyter", "runtime")
-            connection_file = os.path.join(connection_dir, connection_file)
-
-        if not os.path.exists(connection_file):
-            _log.warning(f"Jupyter connection file '{connection_file}' does not exist.")
-
-        _log.info(f'PyXLL IPython kernel = {connection_file}')
-        with open(connection_file) as f:
-            file_info = json.load(f)
-
+        # Connect to kernel started by PyXLL, using whichever transport it was started with
+        file_info = get_connection_info()
         file_info["key"] = file_info["key"].encode()
         return file_info
 
@@ -13,24 +13,30 @@ To install this package use::
     pip install pyxll_jupyter
 
 """
-from pyxll import get_config, xl_macro
+from pyxll import get_config, xl_macro, xl_on_open, schedule_call
+import importlib
 import logging
 import sys
+import os
 
 _log = logging.getLogger(__name__)
 
 
-if sys.version_info[:2] >= (3, 7):
-    import importlib.resources
+def _resource_bytes(package, resource_name):
+    # Read the file directly if possible. importlib.resources imports pathlib, typing
+    # and more, which would slow down starting Excel as the ribbon is loaded then.
+    module = importlib.import_module(package)
+    path = os.path.join(os.path.dirname(module.__file__ or ""), resource_name)
+    if os.path.isfile(path):
+        with open(path, "rb") as fh:
+            return fh.read()
 
-    def _resource_bytes(package, resource_name):
-        return importlib.resources.read_binary(package, resource_name)
+    if sys.version_info[:2] >= (3, 7):
+        from importlib import resources
+        return resources.read_binary(package, resource_name)
 
-else:
     import pkg_resources
-
-    def _resource_bytes(package, resource_name):
-        return pkg_resources.resource_stream(package, resource_name).read()
+    return pkg_resources.resource_stream(package, resource_name).read()
 
 
 def open_jupyter_notebook(*args, initial_path=None, notebook_path=None):
@@ -75,6 +81,39 @@ def OpenJupyterNotebook(path=None, browser=False):
     OpenJupyterNotebook(path=path, browser=browser)
 
 
+def _prewarm_jupyter():
+    """Start the kernel and Jupyter server in the background, if the prewarm option is set."""
+    from .impl import prewarm_jupyter
+    prewarm_jupyter()
+
+
+def _get_prewarm():
+    """Return True if the Jupyter server should be started when Excel starts."""
+    cfg = get_config()
+
+    prewarm = False
+    if cfg.has_option("JUPYTER", "prewarm"):
+        try:
+            prewarm = bool(int(cfg.get("JUPYTER", "prewarm")))
+        except (ValueError, TypeError):
+            _log.error("Unexpected value for JUPYTER.prewarm.")
+
+    return prewarm
+
+
+@xl_on_open
+def _on_open(import_info):
+    """Start Jupyter once Excel has finished starting, so as not to slow down opening Excel.
+
+    PyXLL doesn't call this when reloading, but this module may also be imported again
+    and so the flag on sys is used to make sure it's only ever done once.
+    """
+    if getattr(sys, "_pyxll_jupyter_prewarm_scheduled", False) or not _get_prewarm():
+        return
+    sys._pyxll_jupyter_prewarm_scheduled = True
+    schedule_call(_prewarm_jupyter)
+
+
 def modules():
     """Entry point for getting the pyxll modules.
     Returns a list of module names."""
@@ -4,13 +4,14 @@ to Excel in the pyxll module.
 
 They are separated into this module to minimize the time taken to import the
 pyxll module, as that is done when starting Excel.
+
+The Qt widgets, the kernel (which imports IPython, ipykernel and zmq) and the
+OneDrive helpers are only imported by the functions that use them, so that
+for example opening Jupyter in a web browser doesn't import Qt. See
+benchmarks/bench_imports.py for the modules each entry point may import.
 """
-from ..widgets import JupyterQtWidget, QApplication, QMessageBox
-from ..kernel import launch_jupyter
-from ..onedrive import get_onedrive_path
 from pyxll import XLCell, xlcAlert, get_config, xl_app, create_ctp, schedule_call
 from functools import partial
-import ctypes.wintypes
 import logging
 import sys
 import os
@@ -20,6 +21,7 @@ _log = logging.getLogger(__name__)
 
 def _get_qt_app():
     """Get or create the Qt application"""
+    from ..widgets.qtimports import QApplication
     app = QApplication.instance()
     if app is None:
         app = QApplication([])
@@ -50,6 +52,7 @@ def _get_notebook_path(cfg):
             lpath = path.lower()
             if lpath.startswith("https://"):
                 try:
+                    from ..onedrive import get_onedrive_path
                     onedrive_path = get_onedrive_path(path)
                     if onedrive_path:
                         if os.path.exists(onedrive_path):
@@ -69,6 +72,7 @@ def _get_notebook_path(cfg):
         _log.warning(f"Notebook path '{path}' does not exist")
 
     # And if that's not set use My Documents
+    import ctypes.wintypes
     CSIDL_PERSONAL = 5  # My Documents
     SHGFP_TYPE_CURRENT = 0  # Get current, not default value
 
@@ -144,6 +148,8 @@ def open_jupyter_notebook(*args, initial_path=None, notebook_path=None):
     :param initial_path: Path to open Jupyter in.
     :param notebook_path: Path of Jupyter notebook to open.
     """
+    from ..widgets import JupyterQtWidget
+
     # Get the Qt Application
     app = _get_qt_app()
 
@@ -205,6 +211,7 @@ def open_jupyter_notebook_in_browser(*args, initial_path=None, notebook_path=Non
     :param initial_path: Path to open Jupyter in.
     :param notebook_path: Path of Jupyter notebook to open.
     """
+    from ..kernel import launch_jupyter
     kwargs = _get_notebook_kwargs(initial_path=initial_path, notebook_path=notebook_path)
 
     # We don't do anything with the token here as we don't know when the kernel and
@@ -212,6 +219,20 @@ def open_jupyter_notebook_in_browser(*args, initial_path=None, notebook_path=Non
     token, url = launch_jupyter(no_browser=False, **kwargs)
 
 
+def prewarm_jupyter():
+    """Start the kernel and a Jupyter server in the background so that opening
+    Jupyter for the first time doesn't have to wait for the server to start.
+    """
+    try:
+        from ..kernel import prewarm_jupyter as _prewarm_jupyter
+        kwargs = _get_notebook_kwargs()
+        _prewarm_jupyter(initial_path=kwargs["initial_path"],
+                         subcommand=kwargs["subcommand"],
+                         timeout=kwargs["timeout"])
+    except:
+        _log.error("Error starting Jupyter in the background", exc_info=True)
+
+
 def set_selection_in_ipython(*args):
     """Gets the value of the selected cell and copies it to
     the globals dict in the IPython kernel.
@@ -258,10 +279,12 @@ def set_selection_in_ipython(*args):
         if value is None:
             value = cell.value
 
-        # set the value in the shell's locals
-        sys._ipython_app.shell.user_ns["_"] = value
+        # set the value in the shell's locals, letting IPython release it once newer results replace it
+        from ..memory import set_underscore
+        set_underscore(sys._ipython_app.shell, value)
         print("\n\n>>> Selected value set as _")
     except:
+        from ..widgets.qtimports import QMessageBox
         app = _get_qt_app()
         QMessageBox.warning(None, "Error", "Error setting selection in Excel")
         _log.error("Error setting selection in Excel", exc_info=True)
@@ -0,0 +1,237 @@
+"""
+Capture of the output written by Jupyter server processes.
+
+The server's combined stdout and stderr is read in large chunks on a
+background thread. The most recent output is kept in a fixed size buffer
+for each server so it can be shown with the %xl_server_log magic, even if
+it wasn't logged.
+
+Lines are only decoded and turned into log records if their level is high
+enough to be logged, and the number of lines logged per second can be
+limited. Records are passed to a QueueHandler so that formatting them and
+writing them to the log file happens on a separate thread.
+
+Until the server prints the URL it's running at the output is also scanned
+for it, so it can be used if the server's info file can't be found::
+
+    [JUPYTER]
+    server_log_size = 256
+    server_log_level = INFO
+    server_log_rate = 0
+"""
+import logging.handlers
+import collections
+import threading
+import logging
+import atexit
+import queue
+import time
+import sys
+import re
+import os
+
+_log = logging.getLogger(__name__)
+
+# Logger used for output from the Jupyter server processes
+_server_log = logging.getLogger("pyxll_jupyter.server")
+
+# Jupyter prefixes log lines with '[<level letter> <timestamp> <app>]'
+_levels = {
+    ord("D"): logging.DEBUG,
+    ord("I"): logging.INFO,
+    ord("W"): logging.WARNING,
+    ord("E"): logging.ERROR,
+    ord("C"): logging.CRITICAL,
+}
+
+# Jupyter prints the URL it's running at on the line after one of these
+_running_at_re = re.compile(r"(^|\s)Jupyter (.+) is running at:|Or copy and paste one of these URLs:")
+_url_re = re.compile(r"(?:^|\s)(https?://\S*)$")
+
+_queue_listener = None
+_queue_listener_lock = threading.Lock()
+
+
+class _ParentHandler(logging.Handler):
+    """Passes records from the queue on to the handlers of the server logger's parents."""
+
+    def emit(self, record):
+        parent = _server_log.parent
+        if parent is not None:
+            parent.handle(record)
+
+
+def _install_queue_handler():
+    """Send records from the server logger through a queue to a background thread."""
+    global _queue_listener
+    with _queue_listener_lock:
+        if _queue_listener is not None:
+            return
+
+        records = queue.SimpleQueue()
+        _server_log.addHandler(logging.handlers.QueueHandler(records))
+        _server_log.propagate = False
+
+        _queue_listener = logging.handlers.QueueListener(records, _ParentHandler())
+        _queue_listener.start()
+        atexit.register(_queue_listener.stop)
+
+
+def _get_level(line, default):
+    """Return the log level of a line of Jupyter output, or default if it doesn't have one."""
+    if len(line) > 2 and line[0] == ord("[") and line[2] == ord(" "):
+        return _levels.get(line[1], default)
+    if line.startswith(b"DEBUG"):
+        return logging.DEBUG
+    return default
+
+
+class ServerOutput:
+    """Reads the output of a Jupyter server process on a background thread.
+
+    :param proc: Popen object with stdout set to a pipe.
+    :param buffer_size: Number of bytes of the most recent output to keep.
+    :param level: Minimum level of lines to log.
+    :param max_rate: Maximum number of lines logged per second, or 0 for no limit.
+    :param chunk_size: Maximum number of bytes read at once.
+    """
+
+    def __init__(self, proc, buffer_size=256 * 1024, level=logging.INFO, max_rate=0, chunk_size=65536):
+        self.pid = proc.pid
+        self.started = time.time()
+        self.__proc = proc
+        self.__buffer_size = buffer_size
+        self.__level = level
+        self.__max_rate = max_rate
+        self.__chunk_size = chunk_size
+        self.__lock = threading.Lock()
+        self.__chunks = collections.deque()
+        self.__size = 0
+        self.__total = 0
+        self.__partial = b""
+        self.__line_level = logging.INFO
+        self.__window_start = 0.0
+        self.__window_count = 0
+        self.__dropped = 0
+        self.__url = None
+        self.__url_partial = b""
+        self.__next_line_is_url = False
+        self.__thread = None
+
+    def start(self):
+        """Start reading the process output."""
+        _install_queue_handler()
+        self.__thread = threading.Thread(target=self.__run, name=f"pyxll-jupyter-server-output-{self.pid}")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    @property
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    @property
+    def total_bytes(self):
+        """Total number of bytes read from the process."""
+        return self.__total
+
+    @property
+    def url(self):
+        """URL the server printed that it's running at, or None if it hasn't been printed."""
+        return self.__url
+
+    def __run(self):
+        fd = self.__proc.stdout.fileno()
+        while True:
+            try:
+                chunk = os.read(fd, self.__chunk_size)
+            except OSError:
+                break
+            if not chunk:
+                break
+            self.__add(chunk)
+
+        if self.__partial:
+            self.__log_lines([self.__partial])
+            self.__partial = b""
+        self.__flush_dropped()
+
+    def __add(self, chunk):
+        with self.__lock:
+            self.__chunks.append(chunk)
+            self.__size += len(chunk)
+            self.__total += len(chunk)
+            while self.__size - len(self.__chunks[0]) >= self.__buffer_size and len(self.__chunks) > 1:
+                self.__size -= len(self.__chunks.popleft())
+
+        if self.__url is None:
+            self.__find_url(chunk)
+
+        # Only split into lines if something might be logged
+        if not _server_log.isEnabledFor(self.__level):
+            return
+
+        lines = (self.__partial + chunk).split(b"\n")
+        self.__partial = lines.pop()
+        self.__log_lines(lines)
+
+    def __find_url(self, chunk):
+        lines = (self.__url_partial + chunk).split(b"\n")
+        self.__url_partial = lines.pop()[-4096:]
+        for line in lines:
+            line = line.decode(sys.getfilesystemencoding(), "replace").strip()
+            if self.__next_line_is_url:
+                match = _url_re.search(line)
+                if match:
+                    self.__url = match.group(1)
+                    self.__url_partial = b""
+                    return
+            if _running_at_re.search(line):
+                self.__next_line_is_url = True
+
+    def __log_lines(self, lines):
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            # Lines without a level, such as tracebacks, continue the previous line
+            level = self.__line_level = _get_level(line, self.__line_level)
+            if level < self.__level or not _server_log.isEnabledFor(level):
+                continue
+
+            if self.__max_rate > 0:
+                now = time.monotonic()
+                if now - self.__window_start >= 1.0:
+                    self.__flush_dropped()
+                    self.__window_start = now
+                    self.__window_count = 0
+                if self.__window_count >= self.__max_rate:
+                    self.__dropped += 1
+                    continue
+                self.__window_count += 1
+
+            _server_log.log(level, line.decode(sys.getfilesystemencoding(), "replace"))
+
+    def __flush_dropped(self):
+        if self.__dropped:
+            _server_log.info(f"{self.__dropped} lines of output from Jupyter server {self.pid} were not "
+                             "logged (use %xl_server_log to see them).")
+            self.__dropped = 0
+
+    def text(self):
+        """Return the buffered output as a string."""
+        with self.__lock:
+            data = b"".join(self.__chunks)[-self.__buffer_size:]
+
+        # The oldest chunk may have been trimmed mid-line
+        if self.__total > len(data):
+            newline = data.find(b"\n")
+            if newline >= 0:
+                data = data[newline + 1:]
+
+        return data.decode(sys.getfilesystemencoding(), "replace").replace("\r\n", "\n")
+
+    def lines(self, count=None):
+        """Return the last count lines of buffered output, or all of them if count is None."""
+        lines = self.text().splitlines()
+        return lines[-count:] if count else lines
@@ -0,0 +1,413 @@
+"""
+Pool of Jupyter server processes shared between kernel sessions.
+
+All Jupyter task panes and browser sessions connect to the same kernel
+running in Excel, and so they can also share a Jupyter server as long as
+it was started with the same subcommand and root folder.
+
+Each server keeps a count of the sessions using it, and should only be
+stopped once the last of them has been released.
+
+A server is known to be ready when it has written its server info file
+(jpserver-<pid>.json, or nbserver-<pid>.json for the classic notebook) to
+the Jupyter runtime folder and responds to an HTTP request. The server's
+URL and token are read from that file. The runtime folder is passed to the
+server explicitly, as it may not be the same when resolved by Excel and by
+the server (e.g. if Excel is a Windows Store app), but if no server info file
+is found the URL the server prints to its output is used instead.
+
+Alternatively the port and token can be chosen before the server is started,
+so its URL is known straight away and the server is ready once it accepts
+connections on that port.
+
+Servers can be asked to shut down cleanly using their REST API, which
+removes their server info files, before their processes are killed.
+"""
+from .processes import get_process_backend, get_process_trees
+import concurrent.futures
+import urllib.request
+import urllib.parse
+import subprocess
+import threading
+import logging
+import socket
+import json
+import time
+import os
+
+_log = logging.getLogger(__name__)
+
+
+class JupyterServer:
+    """A running Jupyter server process.
+
+    :param key: (subcommand, root folder) the server was started with.
+    :param process: Popen object for the server process.
+    :param url: URL of the server, including the token query parameter.
+    :param ready: Future that completes when the server is ready, or None if it already is.
+    :param connection_file: Connection file of the kernel the server connects to.
+    :param host: Host the server was started on.
+    :param server_token: Token the server was started with, or "" if it doesn't use one.
+    """
+
+    def __init__(self, key, process, url, ready=None, connection_file=None, host=None, server_token=None):
+        if ready is None:
+            ready = concurrent.futures.Future()
+            ready.set_result(url)
+        self.key = key
+        self.process = process
+        self.url = url
+        self.ready = ready
+        self.connection_file = connection_file
+        self.host = host
+        self.server_token = server_token
+        self.tokens = set()
+        self.removed = False
+
+    @property
+    def running(self):
+        return self.process.poll() is None
+
+
+class ServerPool:
+    """Reference counted pool of JupyterServers keyed by subcommand and root folder."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__servers = {}
+        self.__token_servers = {}
+
+    def add(self, key, process, url, token, ready=None, connection_file=None, host=None, server_token=None):
+        """Add a newly started server, used by the session with the given token."""
+        server = JupyterServer(key, process, url, ready, connection_file, host, server_token)
+        with self.__lock:
+            existing = self.__servers.get(key)
+            if existing is not None and existing.running:
+                _log.warning(f"Replacing running Jupyter server {existing.process.pid} in the server pool.")
+            self.__servers[key] = server
+            server.tokens.add(token)
+            self.__token_servers[token] = server
+        return server
+
+    def acquire(self, key, token):
+        """Return the running server for key, adding token to the sessions using it.
+        Returns None if there is no running server for key.
+        """
+        with self.__lock:
+            server = self.__servers.get(key)
+            if server is None:
+                return None
+
+            failed = server.ready.done() and server.ready.exception() is not None
+            if failed or not server.running:
+                _log.debug(f"Jupyter server {server.process.pid} is no longer running.")
+                self.__remove(server)
+                return None
+
+            server.tokens.add(token)
+            self.__token_servers[token] = server
+            return server
+
+    def release(self, token):
+        """Stop a session using its server.
+
+        Returns the server if it was used by the session and is no longer used by
+        any other sessions, in which case it is removed from the pool and should be
+        stopped. Returns None otherwise.
+        """
+        with self.__lock:
+            server = self.__token_servers.pop(token, None)
+            if server is None:
+                return None
+
+            server.tokens.discard(token)
+            if server.tokens:
+                _log.debug(f"Jupyter server {server.process.pid} is still used by {len(server.tokens)} session(s).")
+                return None
+
+            self.__remove(server)
+            return server
+
+    def replace_process(self, server, process):
+        """Replace the process of a server that has been restarted.
+
+        Returns the tokens of the sessions using the server, or None if the
+        server has been removed from the pool and so shouldn't be restarted.
+        """
+        with self.__lock:
+            if server.removed:
+                return None
+            server.process = process
+            return set(server.tokens)
+
+    def __contains__(self, token):
+        return token in self.__token_servers
+
+    def __remove(self, server):
+        """Remove a server from the pool. Must be called with the lock held."""
+        server.removed = True
+        if self.__servers.get(server.key) is server:
+            del self.__servers[server.key]
+        for token in server.tokens:
+            self.__token_servers.pop(token, None)
+
+    def servers(self):
+        """Return a list of all servers in the pool."""
+        with self.__lock:
+            return list(self.__servers.values())
+
+
+_server_info_prefixes = ("jpserver-", "nbserver-")
+
+
+def list_server_info_files(runtime_dir):
+    """Return a dict of {filename: mtime_ns} of the server info files in runtime_dir."""
+    files = {}
+    try:
+        entries = os.scandir(runtime_dir)
+    except FileNotFoundError:
+        return files
+
+    with entries:
+        for entry in entries:
+            if entry.name.startswith(_server_info_prefixes) and entry.name.endswith(".json"):
+                try:
+                    files[entry.name] = entry.stat().st_mtime_ns
+                except OSError:
+                    pass
+    return files
+
+
+def _read_server_info(path):
+    """Read a server info file, or return None if it can't be read (yet)."""
+    try:
+        with open(path, "rt", encoding="utf-8") as fh:
+            info = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return info if isinstance(info, dict) and info.get("url") else None
+
+
+def get_server_root(info):
+    """Return the normalized root folder from a server info dict."""
+    root = info.get("root_dir") or info.get("notebook_dir")
+    return os.path.normcase(os.path.abspath(root)) if root else None
+
+
+def _get_server_info_from_url(url):
+    """Return a minimal server info dict from the URL a Jupyter server prints when it starts."""
+    parsed = urllib.parse.urlsplit(url)
+    token = urllib.parse.parse_qs(parsed.query).get("token", [None])[0]
+
+    # The printed URL may be for a page under the server's base URL, e.g. '/tree' or '/lab'
+    path = parsed.path
+    for page in ("/tree", "/lab"):
+        if path.rstrip("/").endswith(page):
+            path = path.rstrip("/")[:-len(page)]
+            break
+
+    info = {"url": urllib.parse.urlunsplit((parsed.scheme, parsed.netloc, path or "/", "", ""))}
+    if token:
+        info["token"] = token
+    return info
+
+
+def get_server_url(info):
+    """Return the URL, including the token, to open from a server info dict."""
+    url = info["url"]
+    if not url.endswith("/"):
+        url += "/"
+    token = info.get("token")
+    if token:
+        url += "?" + urllib.parse.urlencode({"token": token})
+    return url
+
+
+def probe_server(url, timeout=1.0):
+    """Return True if the Jupyter server at url responds to an HTTP request."""
+    root = url.split("?", 1)[0]
+    if not root.endswith("/"):
+        root += "/"
+
+    # Don't go through any HTTP proxy to reach the local server
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(root + "api", timeout=timeout) as response:
+            return response.status == 200
+    except (OSError, ValueError):
+        return False
+
+
+def request_shutdown(url, timeout=1.0):
+    """Ask the Jupyter server at url to shut down using its REST API.
+
+    Returns True if the server accepted the request. Older servers without the
+    shutdown endpoint return False and have to be killed instead.
+    """
+    root, _, query = url.partition("?")
+    if not root.endswith("/"):
+        root += "/"
+
+    headers = {}
+    token = urllib.parse.parse_qs(query).get("token")
+    if token:
+        headers["Authorization"] = f"token {token[0]}"
+
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    request = urllib.request.Request(root + "api/shutdown", data=b"", headers=headers, method="POST")
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (OSError, ValueError):
+        return False
+
+
+def shutdown_servers(servers, timeout=1.0):
+    """Ask Jupyter servers to shut down and wait for their processes to end.
+
+    The shutdown requests are all sent at once, and the total time spent is limited
+    to timeout so that any servers that don't shut down in time can then be killed.
+
+    :param servers: List of (process, url) for each server.
+    :param timeout: Maximum time in seconds to wait for.
+    :return: List of the processes that are still running.
+    """
+    deadline = time.perf_counter() + timeout
+    running = [(proc, url) for proc, url in servers if proc.poll() is None]
+    if not running:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(len(running)) as executor:
+        accepted = list(executor.map(lambda server: request_shutdown(server[1], timeout), running))
+
+    remaining = []
+    for (proc, url), shutting_down in zip(running, accepted):
+        if shutting_down:
+            try:
+                proc.wait(max(deadline - time.perf_counter(), 0))
+                continue
+            except subprocess.TimeoutExpired:
+                pass
+        if proc.poll() is None:
+            remaining.append(proc)
+
+    return remaining
+
+
+def wait_for_server_info(proc, runtime_dir, existing, root_dir=None, timeout=60, interval=0.025, get_url=None):
+    """Wait for a newly started Jupyter server to write its server info file and
+    respond to HTTP requests.
+
+    Only files not in existing (as returned by list_server_info_files before the
+    server was started), or that have been modified since, are considered. A file
+    written by proc, or by one of its child processes (e.g. if proc is a shell that
+    started the server), is used in preference to any other. Otherwise a file for a
+    server with the same root folder is used, if root_dir is set. Files written by
+    other servers, such as those started by another Excel process, are ignored.
+
+    If no server info file is found and get_url is set, the URL it returns is used
+    instead. This is for when the server info file is written somewhere that can't
+    be found, and get_url should return the URL the server printed or None.
+
+    :param proc: Popen object for the server process.
+    :param runtime_dir: Jupyter runtime folder.
+    :param existing: Server info files that existed before the server was started.
+    :param root_dir: Root folder the server was started in, or None.
+    :param timeout: Time in seconds to wait for.
+    :param interval: Time in seconds between checks of the runtime folder.
+    :param get_url: Optional function returning the URL printed by the server, or None.
+    :return: Server info dict, or None if the process ended or the timeout was reached.
+    """
+    if root_dir is not None:
+        root_dir = os.path.normcase(os.path.abspath(root_dir))
+
+    deadline = time.perf_counter() + timeout
+    candidate, candidate_path = None, None
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            return None
+
+        if candidate is None:
+            descendants = None
+            for name, mtime in list_server_info_files(runtime_dir).items():
+                if existing.get(name) == mtime:
+                    continue
+
+                path = os.path.join(runtime_dir, name)
+                info = _read_server_info(path)
+                if info is None:
+                    continue
+
+                if descendants is None and info.get("pid") != proc.pid:
+                    descendants = _get_descendants(proc.pid)
+
+                if info.get("pid") == proc.pid or info.get("pid") in descendants:
+                    candidate, candidate_path = info, path
+                    break
+
+                if root_dir is not None and get_server_root(info) == root_dir:
+                    candidate, candidate_path = info, path
+
+            if candidate is not None:
+                _log.debug(f"Found Jupyter server info for '{candidate['url']}' in '{candidate_path}'.")
+            elif get_url is not None:
+                url = get_url()
+                if url:
+                    candidate = _get_server_info_from_url(url)
+                    _log.debug(f"Using Jupyter server URL '{candidate['url']}' from the server's output.")
+
+        # The server writes its info file once it's listening, but check it's responding before using it
+        if candidate is not None:
+            if probe_server(candidate["url"], timeout=max(min(1.0, deadline - time.perf_counter()), 0.01)):
+                return candidate
+
+            # Look again if the server has since stopped and removed its file
+            if candidate_path is not None and not os.path.exists(candidate_path):
+                candidate, candidate_path = None, None
+
+        time.sleep(interval)
+
+    return None
+
+
+def _get_descendants(pid):
+    """Return the set of pids of all running descendants of a process."""
+    try:
+        return set(get_process_trees(get_process_backend().snapshot(), [pid])[1:])
+    except Exception:
+        _log.debug(f"Unable to list the child processes of {pid}.", exc_info=True)
+        return set()
+
+
+def get_free_port(host="127.0.0.1"):
+    """Return a TCP port on host that's not currently in use."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(proc, host, port, timeout=60, interval=0.025):
+    """Wait for a newly started server to accept connections on a port.
+
+    :param proc: Popen object for the server process.
+    :param host: Host the server is listening on.
+    :param port: Port the server is listening on.
+    :param timeout: Time in seconds to wait for.
+    :param interval: Time in seconds between connection attempts.
+    :return: True if the server is accepting connections, or False if the process
+             ended or the timeout was reached.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            return False
+
+        try:
+            with socket.create_connection((host, port), timeout=max(min(1.0, deadline - time.perf_counter()), 0.01)):
+                return True
+        except OSError:
+            pass
+
+        time.sleep(interval)
+
+    return False
@@ -0,0 +1,287 @@
+"""
+Registry of the sessions using the IPython kernel running in Excel.
+
+Each call to start_kernel creates a session, identified by the token it
+returns. A session is either running or paused, and the kernel is only
+polled while at least one session is running. Sessions started by
+launch_jupyter also record the Jupyter server process they use.
+
+Counts are kept up to date as sessions change state so that nothing needs
+to scan all sessions, and the time the kernel spends on Excel's main thread
+is attributed to every session that was running at the time without
+updating each session on every poll.
+"""
+import threading
+import logging
+import time
+
+_log = logging.getLogger(__name__)
+
+
+class Session:
+    """State kept for each session in a SessionRegistry.
+
+    :param token: Token identifying the session.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.process = None
+        self.url = None
+        self.started = time.time()
+        self.last_activity = self.started
+        self.paused = None
+        self.__kernel_time = 0.0
+        self.__messages = 0
+        self.__kernel_time_base = 0.0
+        self.__messages_base = 0
+
+    def _resume(self, kernel_time, messages):
+        """Start attributing kernel usage to this session."""
+        self.__kernel_time_base = kernel_time
+        self.__messages_base = messages
+
+    def _pause(self, kernel_time, messages):
+        """Stop attributing kernel usage to this session."""
+        self.__kernel_time += kernel_time - self.__kernel_time_base
+        self.__messages += messages - self.__messages_base
+
+    def _usage(self, kernel_time, messages):
+        """Return (kernel_time, messages) used while this session was running."""
+        if self.paused is False:
+            return (self.__kernel_time + kernel_time - self.__kernel_time_base,
+                    self.__messages + messages - self.__messages_base)
+        return self.__kernel_time, self.__messages
+
+
+class SessionRegistry:
+    """Keeps track of sessions and whether the kernel should be paused.
+
+    Hooks can be added for the 'added', 'paused', 'resumed' and 'released'
+    events. Each hook is called with the session's info dict (see
+    SessionRegistry.info) after the change has been made.
+    """
+
+    events = ("added", "paused", "resumed", "released")
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__sessions = {}
+        self.__running = 0
+        self.__paused = False
+        self.__kernel_time = 0.0
+        self.__messages = 0
+        self.__last_message = None
+        self.__hooks = {event: [] for event in self.events}
+
+    @property
+    def running_count(self):
+        """Number of sessions that are running."""
+        return self.__running
+
+    @property
+    def paused(self):
+        """True if the kernel has been paused by every running session."""
+        return self.__paused
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def __contains__(self, token):
+        return token in self.__sessions
+
+    def add_hook(self, event, func):
+        """Add a function to be called when a session is added, paused, resumed or released."""
+        if event not in self.__hooks:
+            raise ValueError(f"Unknown session event '{event}'.")
+        self.__hooks[event].append(func)
+
+    def remove_hook(self, event, func):
+        """Remove a function added using add_hook."""
+        self.__hooks[event].remove(func)
+
+    def __call_hooks(self, event, info):
+        for func in list(self.__hooks[event]):
+            try:
+                func(info)
+            except Exception:
+                _log.warning(f"Error in session '{event}' hook", exc_info=True)
+
+    def __get(self, token):
+        """Get or create a session. Must be called with the condition held."""
+        session = self.__sessions.get(token)
+        if session is None:
+            session = self.__sessions[token] = Session(token)
+            return session, True
+        return session, False
+
+    def __set_paused(self, session, paused):
+        """Update a session's state and the running count. Must be called with the condition held.
+        Returns True if the session's state changed.
+        """
+        if session.paused is paused:
+            return False
+
+        if session.paused is False:
+            self.__running -= 1
+            session._pause(self.__kernel_time, self.__messages)
+        if paused is False:
+            self.__running += 1
+            session._resume(self.__kernel_time, self.__messages)
+
+        session.paused = paused
+        session.last_activity = self.__last_activity(session)
+        return True
+
+    def __last_activity(self, session):
+        if session.paused is False and self.__last_message is not None:
+            return max(session.last_activity, self.__last_message)
+        return session.last_activity
+
+    def update(self, token, **kwargs):
+        """Set the 'process' and 'url' of a session, adding it if necessary."""
+        with self.__condition:
+            session, added = self.__get(token)
+            for name, value in kwargs.items():
+                if name not in ("process", "url"):
+                    raise TypeError(f"Unexpected session attribute '{name}'.")
+                setattr(session, name, value)
+            info = self.__info(session)
+
+        if added:
+            self.__call_hooks("added", info)
+
+    def pause(self, token):
+        """Mark a session as paused. Returns True if the kernel is now paused."""
+        with self.__condition:
+            session, added = self.__get(token)
+            changed = self.__set_paused(session, True)
+
+            if not self.__paused:
+                if self.__running > 0:
+                    _log.debug(f"Kernel cannot be paused for session {token} as other Jupyter sessions are active")
+                else:
+                    _log.debug(f"Kernel paused by session {token}")
+
+            self.__paused = self.__running == 0
+            self.__condition.notify_all()
+            paused = self.__paused
+            info = self.__info(session)
+
+        if added:
+            self.__call_hooks("added", info)
+        if changed:
+            self.__call_hooks("paused", info)
+        return paused
+
+    def resume(self, token):
+        """Mark a session as running, resuming the kernel if it was paused."""
+        with self.__condition:
+            session, added = self.__get(token)
+            changed = self.__set_paused(session, False)
+
+            if self.__paused:
+                _log.debug(f"Kernel resumed by session {token}")
+
+            self.__paused = False
+            self.__condition.notify_all()
+            info = self.__info(session)
+
+        if added:
+            self.__call_hooks("added", info)
+        if changed:
+            self.__call_hooks("resumed", info)
+
+    def release(self, token):
+        """Pause and remove a session. Returns the removed Session, or None."""
+        if token not in self.__sessions:
+            return None
+
+        self.pause(token)
+
+        with self.__condition:
+            session = self.__sessions.pop(token, None)
+            if session is None:
+                return None
+            info = self.__info(session)
+
+        self.__call_hooks("released", info)
+        return session
+
+    def wait_while_paused(self):
+        """Block until the kernel is not paused. Returns the paused state."""
+        with self.__condition:
+            if self.__paused:
+                self.__condition.wait()
+            return self.__paused
+
+    def record_poll(self, duration, messages):
+        """Record time spent polling the kernel and the number of messages handled."""
+        with self.__condition:
+            self.__kernel_time += duration
+            self.__messages += messages
+            if messages:
+                self.__last_message = time.time()
+
+    def processes(self):
+        """Return a dict of token to process for all sessions with a process."""
+        with self.__condition:
+            return {token: session.process
+                    for token, session in self.__sessions.items()
+                    if session.process is not None}
+
+    def __info(self, session):
+        """Return a dict describing a session. Must be called with the condition held."""
+        kernel_time, messages = session._usage(self.__kernel_time, self.__messages)
+        process = session.process
+        return {
+            "token": str(session.token),
+            "pid": getattr(process, "pid", None),
+            "process_running": process.poll() is None if process is not None else None,
+            "url": session.url,
+            "started": session.started,
+            "last_activity": self.__last_activity(session),
+            "paused": bool(session.paused),
+            "kernel_time": kernel_time,
+            "messages": messages,
+        }
+
+    def info(self, token):
+        """Return a dict describing a session, or None if there is no such session.
+
+        The dict contains the session's token, the pid of its Jupyter process
+        and whether it's still running, its URL, when it started and was last
+        active, whether it's paused, and the time spent polling the kernel and
+        number of messages handled while it was running.
+        """
+        with self.__condition:
+            session = self.__sessions.get(token)
+            return self.__info(session) if session is not None else None
+
+    def list(self):
+        """Return a list of dicts describing all sessions (see SessionRegistry.info)."""
+        with self.__condition:
+            return [self.__info(session) for session in self.__sessions.values()]
+
+
+def format_sessions(sessions):
+    """Format a list of session dicts returned by SessionRegistry.list as text."""
+    if not sessions:
+        return "No sessions."
+
+    now = time.time()
+    lines = [f"{'session':<38}{'state':>9}{'pid':>8}{'age (s)':>10}{'idle (s)':>10}{'kernel (s)':>12}{'messages':>10}"]
+    for info in sessions:
+        state = "paused" if info["paused"] else "running"
+        pid = info["pid"] if info["pid"] is not None else "-"
+        lines.append(f"{info['token']:<38}{state:>9}{pid:>8}"
+                     f"{now - info['started']:>10.0f}{now - info['last_activity']:>10.0f}"
+                     f"{info['kernel_time']:>12.3f}{info['messages']:>10}")
+
+    urls = [(info["token"], info["url"]) for info in sessions if info["url"]]
+    if urls:
+        lines.append("")
+        for token, url in urls:
+            lines.append(f"{token}: {url}")
+
+    return "\n".join(lines)
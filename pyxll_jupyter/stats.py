@@ -0,0 +1,176 @@
+"""
+Statistics recorded for each poll of the IPython kernel running in Excel.
+
+The history is kept in fixed-size ring buffers so memory use is bounded
+regardless of how long Excel is running. The number of polls and session
+transitions kept can be set in the pyxll.cfg file::
+
+    [JUPYTER]
+    stats_history = 1000
+
+Summaries can be shown in a notebook using the %xl_stats magic, or
+obtained as a dict using pyxll_jupyter.kernel.get_kernel_stats.
+"""
+import collections
+import threading
+import time
+
+# Upper bounds in milliseconds of the histogram buckets
+_histogram_buckets_ms = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+
+def _percentile(values, pct):
+    """Return the pct percentile of a sorted list of values."""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def _summarize(values, histogram=True):
+    """Return a dict of count, percentiles and optionally a histogram for a list of values."""
+    values = sorted(values)
+    summary = {
+        "count": len(values),
+        "mean": (sum(values) / len(values)) if values else None,
+        "p50": _percentile(values, 50),
+        "p90": _percentile(values, 90),
+        "p99": _percentile(values, 99),
+        "max": values[-1] if values else None,
+    }
+
+    if histogram:
+        counts = [0] * len(_histogram_buckets_ms)
+        bucket = 0
+        for value in values:
+            while value * 1000 > _histogram_buckets_ms[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        summary["histogram"] = list(zip(_histogram_buckets_ms, counts))
+
+    return summary
+
+
+class KernelStats:
+    """Records statistics about polling the kernel on Excel's main thread.
+
+    :param size: Maximum number of polls and session transitions to keep.
+    """
+
+    def __init__(self, size=1000):
+        self.__lock = threading.Lock()
+        self.__polls = collections.deque(maxlen=size)
+        self.__transitions = collections.deque(maxlen=size)
+        self.__sessions = {}
+        self.__total_polls = 0
+        self.__total_messages = 0
+        self.__started = time.time()
+
+    def record_poll(self, schedule_delay, poll_time, messages):
+        """Record a single poll of the kernel.
+
+        :param schedule_delay: Seconds between calling schedule_call and the poll starting.
+        :param poll_time: Seconds spent polling the kernel on the main thread.
+        :param messages: Number of ZMQ messages handled by the poll.
+        """
+        with self.__lock:
+            self.__polls.append((time.time(), schedule_delay, poll_time, messages))
+            self.__total_polls += 1
+            self.__total_messages += messages
+
+    def record_transition(self, token, paused):
+        """Record a session pausing or resuming the kernel."""
+        with self.__lock:
+            self.__transitions.append((time.time(), str(token), paused))
+            session = self.__sessions.setdefault(str(token), {"paused": paused, "pauses": 0, "resumes": 0})
+            session["paused"] = paused
+            session["pauses" if paused else "resumes"] += 1
+
+    def remove_session(self, token):
+        """Stop tracking the transition counts for a session that has been released."""
+        with self.__lock:
+            self.__sessions.pop(str(token), None)
+
+    def reset(self):
+        """Clear all recorded history."""
+        with self.__lock:
+            self.__polls.clear()
+            self.__transitions.clear()
+            for session in self.__sessions.values():
+                session["pauses"] = session["resumes"] = 0
+            self.__total_polls = 0
+            self.__total_messages = 0
+            self.__started = time.time()
+
+    def summary(self):
+        """Return a dict summarizing the recorded history."""
+        with self.__lock:
+            polls = list(self.__polls)
+            transitions = list(self.__transitions)
+            sessions = {token: dict(session) for token, session in self.__sessions.items()}
+            total_polls = self.__total_polls
+            total_messages = self.__total_messages
+            started = self.__started
+
+        return {
+            "since": started,
+            "total_polls": total_polls,
+            "total_messages": total_messages,
+            "history": len(polls),
+            "schedule_delay": _summarize([p[1] for p in polls]),
+            "poll_time": _summarize([p[2] for p in polls]),
+            "messages": _summarize([p[3] for p in polls], histogram=False),
+            "sessions": sessions,
+            "transitions": [
+                {"time": t, "token": token, "paused": paused}
+                for t, token, paused in transitions
+            ]
+        }
+
+
+def format_summary(summary):
+    """Format a summary returned by KernelStats.summary as text."""
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.2f}"
+
+    lines = [
+        f"Polls: {summary['total_polls']} (last {summary['history']} kept), "
+        f"messages: {summary['total_messages']}",
+    ]
+
+    if summary.get("poll_interval") is not None:
+        lines.append(f"Poll interval: {summary['poll_interval'] * 1000:.1f}ms")
+
+    idle = summary.get("idle")
+    if idle is not None:
+        connected = "unknown" if idle["connected"] is None else idle["connected"]
+        lines.append(f"Idle: {'yes (polling paused)' if idle['idle'] else 'no'}, "
+                     f"frontends connected: {connected}, "
+                     f"last message: {idle['seconds_since_activity']:.0f}s ago")
+
+    lines.append("")
+    lines.append(f"{'(ms)':<16}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for key, label in (("schedule_delay", "schedule delay"), ("poll_time", "poll time")):
+        s = summary[key]
+        lines.append(f"{label:<16}{ms(s['mean']):>10}{ms(s['p50']):>10}{ms(s['p90']):>10}"
+                     f"{ms(s['p99']):>10}{ms(s['max']):>10}")
+
+    s = summary["messages"]
+    if s["count"]:
+        lines.append(f"{'messages/poll':<16}{s['mean']:>10.2f}{s['p50']:>10}{s['p90']:>10}{s['p99']:>10}{s['max']:>10}")
+
+    lines.append("")
+    lines.append(f"{'<= (ms)':<16}{'schedule delay':>16}{'poll time':>12}")
+    for (bound, delay_count), (_, poll_count) in zip(summary["schedule_delay"]["histogram"],
+                                                     summary["poll_time"]["histogram"]):
+        label = "inf" if bound == float("inf") else f"{bound:g}"
+        lines.append(f"{label:<16}{delay_count:>16}{poll_count:>12}")
+
+    if summary["sessions"]:
+        lines.append("")
+        lines.append(f"{'session':<40}{'state':>10}{'pauses':>10}{'resumes':>10}")
+        for token, session in summary["sessions"].items():
+            state = "paused" if session["paused"] else "running"
+            lines.append(f"{token:<40}{state:>10}{session['pauses']:>10}{session['resumes']:>10}")
+
+    return "\n".join(lines)
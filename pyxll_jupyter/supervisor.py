@@ -0,0 +1,228 @@
+"""
+Supervision of the Jupyter server processes started from Excel.
+
+If a Jupyter server crashes or stops responding, the Jupyter task pane or
+browser tab using it just shows a blank page. The ServerSupervisor checks
+each server in the ServerPool on a background thread and restarts any that
+have stopped or stopped responding.
+
+Servers are restarted on the same port and with the same token so that the
+pages already open reconnect to the new server without having to be
+reopened. The number of restarts and the time taken to recover are recorded
+for each server and returned by ServerSupervisor.report.
+
+Whether a server has exited is checked frequently as it's cheap. Checking
+whether it responds to HTTP requests is done less often, and a server is
+only restarted after several checks in a row have failed.
+
+As this polls every server for as long as it's running, it's only enabled if
+supervise_server is set::
+
+    [JUPYTER]
+    supervise_server = 1
+    health_check_interval = 2
+    health_check_failures = 3
+    max_server_restarts = 5
+"""
+from .servers import probe_server
+import collections
+import threading
+import logging
+import time
+
+_log = logging.getLogger(__name__)
+
+# Maximum time between checks for servers that have exited
+_exit_check_interval = 0.25
+
+
+class _ServerHealth:
+    """Health check state and restart history of a JupyterServer."""
+
+    def __init__(self):
+        self.failures = 0
+        self.failed_at = None
+        self.last_checked = None
+        self.last_healthy = None
+        self.restarts = 0
+        self.failed_restarts = 0
+        self.last_restart = None
+        self.last_failure = None
+        self.recovery_times = collections.deque(maxlen=20)
+
+    def healthy(self, now):
+        self.failures = 0
+        self.failed_at = None
+        self.last_checked = now
+        self.last_healthy = now
+
+    def failed(self, now):
+        self.failures += 1
+        self.last_checked = now
+        if self.failed_at is None:
+            self.failed_at = now
+
+
+class ServerSupervisor:
+    """Checks the servers in a ServerPool and restarts any that have exited or stopped responding.
+
+    :param pool: ServerPool of servers to check.
+    :param restart: Function called with a JupyterServer to restart it. It should start a new
+                    server on the same port with the same token, wait for it to be ready and
+                    replace the server's process. It returns False if the server was removed
+                    from the pool while restarting, and raises an exception if it fails.
+    :param interval: Time in seconds between HTTP health checks.
+    :param max_failures: Number of HTTP health checks in a row that must fail before restarting.
+    :param max_restarts: Maximum number of times a server is restarted.
+    """
+
+    def __init__(self, pool, restart, interval=2.0, max_failures=3, max_restarts=5):
+        self.interval = interval
+        self.max_failures = max(max_failures, 1)
+        self.max_restarts = max_restarts
+        self.__pool = pool
+        self.__restart = restart
+        self.__lock = threading.Lock()
+        self.__health = {}
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        """Start checking the servers on a background thread."""
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__thread = threading.Thread(target=self.__run, name="pyxll-jupyter-supervisor")
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self, timeout=1.0):
+        """Stop checking the servers. Servers are not restarted after this is called."""
+        self.__stopped.set()
+        thread = self.__thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def stopped(self):
+        return self.__stopped.is_set()
+
+    def __run(self):
+        next_probe = time.perf_counter() + self.interval
+        while not self.__stopped.wait(min(_exit_check_interval, self.interval)):
+            probe = time.perf_counter() >= next_probe
+            if probe:
+                next_probe = time.perf_counter() + self.interval
+            try:
+                self.check(probe)
+            except Exception:
+                _log.error("Error checking the Jupyter servers", exc_info=True)
+
+    def check(self, probe=True):
+        """Check each server in the pool, restarting any that have failed.
+
+        :param probe: Check the servers respond to HTTP requests as well as checking they're running.
+        """
+        servers = self.__pool.servers()
+
+        # Forget about servers that are no longer in the pool
+        with self.__lock:
+            for server in [s for s in self.__health if s not in servers]:
+                del self.__health[server]
+
+        for server in servers:
+            # Servers that are still starting are waited for by whatever started them
+            if not server.ready.done() or server.ready.exception() is not None:
+                continue
+
+            with self.__lock:
+                health = self.__health.setdefault(server, _ServerHealth())
+
+            if health.restarts >= self.max_restarts and health.failed_at is not None:
+                continue
+
+            now = time.perf_counter()
+            if server.running:
+                if not probe:
+                    continue
+
+                if probe_server(server.url, timeout=max(self.interval, 1.0)):
+                    health.healthy(time.perf_counter())
+                    continue
+
+                health.failed(now)
+                if health.failures < self.max_failures:
+                    _log.debug(f"Jupyter server {server.process.pid} did not respond "
+                               f"({health.failures} of {self.max_failures}).")
+                    continue
+
+                reason = "is not responding"
+            else:
+                health.failed(now)
+                reason = f"exited with code {server.process.returncode}"
+
+            self.__restart_server(server, health, reason)
+
+    def __restart_server(self, server, health, reason):
+        if self.stopped or server.removed:
+            return
+
+        pid = server.process.pid
+        if health.restarts >= self.max_restarts:
+            _log.error(f"Jupyter server {pid} {reason} and has already been restarted "
+                       f"{health.restarts} times; not restarting it again.")
+            return
+
+        _log.warning(f"Jupyter server {pid} {reason}; restarting it.")
+        health.restarts += 1
+        health.last_restart = time.time()
+        try:
+            restarted = self.__restart(server)
+        except Exception as e:
+            health.failed_restarts += 1
+            health.last_failure = str(e)
+            _log.error(f"Failed to restart Jupyter server {pid}", exc_info=True)
+            return
+
+        if not restarted:
+            return
+
+        now = time.perf_counter()
+        recovery_time = now - health.failed_at
+        health.recovery_times.append(recovery_time)
+        health.healthy(now)
+        _log.info(f"Jupyter server {pid} restarted as {server.process.pid} "
+                  f"in {recovery_time:.2f}s (restart {health.restarts}).")
+
+    def report(self):
+        """Return a list of dicts describing the health and restart history of each server.
+
+        Times are in seconds, and recovery_times are the times taken from a failure
+        being detected to the restarted server being ready.
+        """
+        now = time.perf_counter()
+        servers = self.__pool.servers()
+        with self.__lock:
+            health = {server: self.__health.get(server) for server in servers}
+
+        report = []
+        for server, h in health.items():
+            h = h or _ServerHealth()
+            recovery_times = list(h.recovery_times)
+            report.append({
+                "pid": server.process.pid,
+                "url": server.url,
+                "subcommand": server.key[0],
+                "root": server.key[1],
+                "running": server.running,
+                "healthy": h.failed_at is None and server.running,
+                "consecutive_failures": h.failures,
+                "since_last_check": (now - h.last_checked) if h.last_checked is not None else None,
+                "restarts": h.restarts,
+                "failed_restarts": h.failed_restarts,
+                "last_restart": h.last_restart,
+                "last_failure": h.last_failure,
+                "last_recovery_time": recovery_times[-1] if recovery_times else None,
+                "mean_recovery_time": (sum(recovery_times) / len(recovery_times)) if recovery_times else None,
+            })
+        return report
@@ -2,15 +2,59 @@
 JupyterQtWidget is the widget that gets embedded in Excel and hosts
 a tabbed browser widget containing the Jupyter notebook.
 """
-from ..kernel import launch_jupyter, release_kernel, pause_kernel, resume_kernel
+from ..kernel import launch_jupyter, release_kernel, pause_kernel, resume_kernel, is_port_preassigned, \
+    finish_startup_profile
+from ..profiler import StartupProfile, phase
 from .browser import Browser
 from .qtimports import Qt, QApplication, QEvent, QWidget, QVBoxLayout, qVersion
 import logging
+import base64
 import ctypes
+import json
 
 _log = logging.getLogger(__name__)
 
 
+# Page shown while the Jupyter server starts, which opens Jupyter once the server responds
+_loading_page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Starting Jupyter...</title>
+<style>
+body { font-family: sans-serif; color: #666; display: flex; align-items: center; justify-content: center; height: 90vh; }
+</style>
+</head>
+<body>
+<p id="status">Starting Jupyter...</p>
+<script>
+var url = %(url)s, api = %(api)s, deadline = Date.now() + %(timeout)d * 1000;
+function check() {
+    fetch(api, {mode: "no-cors", cache: "no-store"}).then(function() {
+        window.location.replace(url);
+    }, function() {
+        if (Date.now() > deadline) {
+            document.getElementById("status").textContent = "Jupyter failed to start. See the PyXLL log file for details.";
+            return;
+        }
+        setTimeout(check, 50);
+    });
+}
+check();
+</script>
+</body>
+</html>
+"""
+
+
+def _get_loading_url(url, timeout=60):
+    """Return a data URL for a page that opens url once the Jupyter server is responding."""
+    api = url.split("?", 1)[0].split("://", 1)
+    api = api[0] + "://" + api[1].split("/", 1)[0] + "/api"
+    html = _loading_page % {"url": json.dumps(url), "api": json.dumps(api), "timeout": timeout}
+    return "data:text/html;charset=utf-8;base64," + base64.b64encode(html.encode("utf-8")).decode("ascii")
+
+
 class JupyterQtWidget(QWidget):
 
     def __init__(self,
@@ -24,6 +68,10 @@ class JupyterQtWidget(QWidget):
                  **kwargs):
         super().__init__(parent)
         self.__closed = False
+
+        # Record how long each phase of opening Jupyter takes, up until the page has loaded
+        self.__profile = StartupProfile("JupyterQtWidget")
+        self.__load_phase = None
         self.setFocusPolicy(Qt.FocusPolicy.ClickFocus)
 
         # proc gets set to the subprocess when the jupyter is started
@@ -51,12 +99,13 @@ class JupyterQtWidget(QWidget):
         app.installEventFilter(self)
 
         # Create the browser widget
-        self.browser = Browser(self,
-                               scale=scale,
-                               private_browser=private_browser,
-                               allow_cookies=allow_cookies,
-                               cache_path=cache_path,
-                               storage_path=storage_path)
+        with self.__profile.active(), phase("create browser"):
+            self.browser = Browser(self,
+                                   scale=scale,
+                                   private_browser=private_browser,
+                                   allow_cookies=allow_cookies,
+                                   cache_path=cache_path,
+                                   storage_path=storage_path)
 
         self.browser.closed.connect(self.close)
 
@@ -65,17 +114,36 @@ class JupyterQtWidget(QWidget):
         layout.addWidget(self.browser)
         self.setLayout(layout)
 
-        # Start the kernel and open Jupyter in a new tab
-        self.token, url = launch_jupyter(no_browser=True, **kwargs)
+        # Start the kernel and open Jupyter in a new tab. If the server's port is pre-assigned its
+        # URL is known before it has started, and a loading page is shown until it's ready instead
+        # of waiting here.
+        preassigned = is_port_preassigned()
+        with self.__profile.active(), phase("launch_jupyter"):
+            self.token, url = launch_jupyter(no_browser=True, wait=not preassigned, **kwargs)
 
         # Pause the kernel until we get the focus
         if pause_on_focus_lost and not self.hasFocus():
             self.pauseKernel()
 
-        self.browser.create_tab(url)
+        self.__load_phase = self.__profile.begin("browser load")
+        if preassigned:
+            url = _get_loading_url(url, kwargs.get("timeout", 60))
+        view = self.browser.create_tab(url)
+        view.loadFinished.connect(lambda ok: self.__load_finished(view, ok))
+
+    def __load_finished(self, view, ok):
+        # Ignore the loading page shown while the server starts
+        if view.url().scheme() not in ("http", "https"):
+            return
+
+        if self.__load_phase is not None:
+            self.__load_phase.end(ok=ok)
+            self.__load_phase = None
+            finish_startup_profile(self.__profile)
 
     def closeEvent(self, event):
         self.__closed = True
+        finish_startup_profile(self.__profile)
 
         # Pause the kernel and kill the Jupyter subprocess
         release_kernel(self.token)
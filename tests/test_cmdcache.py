@@ -0,0 +1,65 @@
+"""
+Tests for pyxll_jupyter.cmdcache.
+"""
+from pyxll_jupyter.cmdcache import CommandCache, get_cache_key
+import pyxll_jupyter.cmdcache as cmdcache
+import os
+
+
+def test_get_and_set(tmp_path):
+    cache = CommandCache(str(tmp_path / "cache" / "commands.json"))
+    assert cache.get("notebook") is None
+
+    command = {"cmd": ["jupyter-notebook.exe"], "args": ["--no-browser"], "pythonpath": []}
+    cache.set("notebook", command)
+    cache.set("lab", {"cmd": ["jupyter-lab.exe"]})
+    assert cache.get("notebook") == command
+
+    # Another instance reads the same file
+    assert CommandCache(cache.path).get("lab") == {"cmd": ["jupyter-lab.exe"]}
+
+    cache.remove("notebook")
+    cache.remove("missing")
+    assert cache.get("notebook") is None
+    assert cache.get("lab") == {"cmd": ["jupyter-lab.exe"]}
+    assert os.listdir(tmp_path / "cache") == ["commands.json"]
+
+
+def test_key_changes(tmp_path):
+    cache = CommandCache(str(tmp_path / "commands.json"))
+    cache.set("notebook", "old", key="a")
+    assert cache.get("notebook", key="a") == "old"
+    assert cache.get("notebook", key="b") is None
+
+    # Setting a value with a new key discards the values for the old key
+    cache.set("lab", "new", key="b")
+    assert cache.get("notebook", key="a") is None
+    assert cache.get("lab", key="b") == "new"
+
+
+def test_invalid_file(tmp_path):
+    path = tmp_path / "commands.json"
+    path.write_text("not json")
+    cache = CommandCache(str(path))
+    assert cache.get("notebook") is None
+
+    cache.set("notebook", "value")
+    assert cache.get("notebook") == "value"
+
+
+def test_cache_key(tmp_path, monkeypatch):
+    key = get_cache_key()
+    assert key == get_cache_key()
+
+    monkeypatch.setenv("PATH", os.environ.get("PATH", "") + os.pathsep + str(tmp_path))
+    assert get_cache_key() != key
+
+
+def test_cache_key_changes_when_packages_change(tmp_path, monkeypatch):
+    site_packages = tmp_path / "site-packages"
+    site_packages.mkdir()
+    monkeypatch.setattr(cmdcache, "_get_package_dirs", lambda: [str(site_packages)])
+
+    key = get_cache_key()
+    os.utime(site_packages, ns=(0, 0))
+    assert get_cache_key() != key
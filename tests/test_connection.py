@@ -0,0 +1,108 @@
+"""
+Tests for pyxll_jupyter.connection.
+"""
+from pyxll_jupyter.connection import get_ipc_paths, read_connection_info, encode_connection_info, \
+    get_connection_info
+import pyxll_jupyter.connection as connection
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def environ(monkeypatch):
+    """Clear the connection info cached from the environment and connection files."""
+    monkeypatch.setattr(connection, "_env_connection_info", None)
+    monkeypatch.setattr(connection, "_file_cache", {})
+    monkeypatch.delenv("PYXLL_IPYTHON_CONNECTION_INFO", raising=False)
+    monkeypatch.delenv("PYXLL_IPYTHON_CONNECTION_FILE", raising=False)
+    return monkeypatch
+
+
+def _write_connection_file(path, **info):
+    info.setdefault("key", "secret")
+    info.setdefault("ip", "127.0.0.1")
+    path.write_text(json.dumps(info))
+    return str(path)
+
+
+def test_get_ipc_paths():
+    assert get_ipc_paths({"transport": "tcp", "ip": "127.0.0.1", "shell_port": 1}) == []
+    assert get_ipc_paths({"ip": "127.0.0.1", "shell_port": 1}) == []
+
+    info = {"transport": "ipc", "ip": "/tmp/kernel", "shell_port": 1, "stdin_port": 2, "iopub_port": 3,
+            "hb_port": 4, "control_port": 5}
+    assert get_ipc_paths(info) == [f"/tmp/kernel-{port}" for port in range(1, 6)]
+
+
+def test_read_connection_info_tcp(tmp_path):
+    connection_file = _write_connection_file(tmp_path / "kernel.json", shell_port=1234)
+    info = read_connection_info(connection_file)
+    assert info["ip"] == "127.0.0.1"
+    assert info["shell_port"] == 1234
+
+
+def test_read_connection_info_ipc(tmp_path):
+    # Relative socket paths are relative to the connection file
+    connection_file = _write_connection_file(tmp_path / "kernel.json", transport="ipc", ip="kernel-ipc",
+                                             shell_port=1)
+    info = read_connection_info(connection_file)
+    assert info["ip"] == os.path.join(str(tmp_path), "kernel-ipc")
+
+    connection_file = _write_connection_file(tmp_path / "kernel.json", transport="ipc", ip="/abs/kernel-ipc")
+    assert read_connection_info(connection_file)["ip"] == "/abs/kernel-ipc"
+
+
+@pytest.mark.parametrize("info", [{"ip": "127.0.0.1"}, {"key": "secret"}, {"key": "secret", "ip": ""}])
+def test_read_connection_info_invalid(tmp_path, info):
+    path = tmp_path / "kernel.json"
+    path.write_text(json.dumps(info))
+    with pytest.raises(ValueError):
+        read_connection_info(str(path))
+
+
+def test_encode_connection_info():
+    env = encode_connection_info({"key": b"secret", "ip": "127.0.0.1", "shell_port": 1, "kernel_name": None,
+                                  "signature_scheme": "hmac-sha256"})
+    assert list(env) == ["PYXLL_IPYTHON_CONNECTION_INFO"]
+    assert json.loads(env["PYXLL_IPYTHON_CONNECTION_INFO"]) == {
+        "key": "secret",
+        "ip": "127.0.0.1",
+        "shell_port": 1,
+        "signature_scheme": "hmac-sha256",
+    }
+
+
+def test_get_connection_info_from_env(tmp_path, environ):
+    connection_file = _write_connection_file(tmp_path / "kernel.json", key="from file")
+    environ.setenv("PYXLL_IPYTHON_CONNECTION_FILE", connection_file)
+    for name, value in encode_connection_info({"key": b"from env", "ip": "127.0.0.1"}).items():
+        environ.setenv(name, value)
+
+    info = get_connection_info()
+    assert info["key"] == "from env"
+
+    # A copy is returned each time
+    info["key"] = "changed"
+    assert get_connection_info()["key"] == "from env"
+
+
+def test_get_connection_info_invalid_env(tmp_path, environ):
+    connection_file = _write_connection_file(tmp_path / "kernel.json", key="from file")
+    environ.setenv("PYXLL_IPYTHON_CONNECTION_FILE", connection_file)
+    environ.setenv("PYXLL_IPYTHON_CONNECTION_INFO", "{}")
+
+    assert get_connection_info()["key"] == "from file"
+    assert "PYXLL_IPYTHON_CONNECTION_INFO" not in os.environ
+
+
+def test_get_connection_info_from_file(tmp_path, environ):
+    path = tmp_path / "kernel.json"
+    connection_file = _write_connection_file(path, key="first")
+    environ.setenv("PYXLL_IPYTHON_CONNECTION_FILE", connection_file)
+    assert get_connection_info()["key"] == "first"
+
+    # The file is read again once it's changed
+    _write_connection_file(path, key="second")
+    os.utime(connection_file, ns=(0, 0))
+    assert get_connection_info()["key"] == "second"
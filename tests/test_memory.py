@@ -0,0 +1,180 @@
+"""
+Tests for pyxll_jupyter.memory.
+"""
+from pyxll_jupyter.memory import MemoryManager, estimate_size, format_usage, set_underscore
+import pyxll_jupyter.memory as memory
+import numpy as np
+import pytest
+import types
+import sys
+
+
+class FakeShell:
+    """Just enough of an InteractiveShell to record results like IPython's display hook."""
+
+    def __init__(self):
+        self.output_hist = {}
+        self.user_ns = {"_oh": self.output_hist, "Out": self.output_hist}
+        self.user_ns_hidden = {"_oh": self.output_hist, "Out": self.output_hist}
+        self.displayhook = types.SimpleNamespace(_="", __="", ___="")
+        self.last_execution_result = types.SimpleNamespace(result=None)
+        self.events = types.SimpleNamespace(registered=[])
+        self.events.register = lambda event, func: self.events.registered.append((event, func))
+        self.events.unregister = lambda event, func: self.events.registered.remove((event, func))
+        self.execution_count = 0
+
+    def run(self, result):
+        """Record result as the output of a new cell."""
+        self.execution_count += 1
+        self.output_hist[self.execution_count] = result
+        self.user_ns[f"_{self.execution_count}"] = result
+        hook = self.displayhook
+        hook.___, hook.__, hook._ = hook.__, hook._, result
+        self.user_ns.update({"_": hook._, "__": hook.__, "___": hook.___})
+        self.last_execution_result.result = result
+        return self.execution_count
+
+
+def _array(mb):
+    return np.zeros(int(mb * 1024 * 1024), dtype=np.uint8)
+
+
+def test_estimate_size():
+    assert estimate_size(_array(1)) == 1024 * 1024
+    assert estimate_size(memoryview(b"x" * 1000)) == 1000
+    assert estimate_size("x" * 1000) == sys.getsizeof("x" * 1000)
+
+    # Containers include an estimate of their items
+    items = ["x" * 1000 for _ in range(1000)]
+    assert estimate_size(items) >= 1000 * 1000
+    assert estimate_size({i: item for i, item in enumerate(items)}) >= 1000 * 1000
+
+
+def test_estimate_size_pandas():
+    pd = pytest.importorskip("pandas")
+    df = pd.DataFrame({"a": np.zeros(1000), "b": np.zeros(1000)})
+    assert estimate_size(df) >= 16000
+    assert estimate_size(df["a"]) >= 8000
+
+
+def test_install():
+    shell = FakeShell()
+    manager = MemoryManager(shell, max_outputs=1)
+    manager.install()
+    assert shell.events.registered == [("post_run_cell", manager.post_run_cell)]
+    manager.uninstall()
+    assert shell.events.registered == []
+
+
+def test_trim_max_outputs():
+    shell = FakeShell()
+    manager = MemoryManager(shell, max_outputs=2)
+    results = [[i] for i in range(4)]
+    for result in results:
+        shell.run(result)
+
+    assert manager.trim() == [1, 2]
+    assert list(shell.output_hist) == [3, 4]
+    assert "_1" not in shell.user_ns and "_2" not in shell.user_ns
+    assert shell.user_ns["_4"] is results[3]
+
+    # _, __ and ___ no longer refer to the results removed
+    assert shell.user_ns["___"] == "" and shell.displayhook.___ == ""
+    assert shell.user_ns["__"] is results[2]
+    assert manager.trim() == []
+
+
+def test_trim_max_output_bytes():
+    shell = FakeShell()
+    manager = MemoryManager(shell, max_output_bytes=3 * 1024 * 1024)
+    for mb in (1, 1, 2):
+        shell.run(_array(mb))
+
+    assert manager.trim() == [1]
+    assert list(shell.output_hist) == [2, 3]
+
+    # The newest result is always kept, even if it's over the limit
+    shell.run(_array(4))
+    assert manager.trim() == [2, 3]
+    assert list(shell.output_hist) == [4]
+
+
+def test_evict_keeps_reassigned_names():
+    shell = FakeShell()
+    manager = MemoryManager(shell)
+    result = shell.run([1])
+    shell.user_ns["_"] = "set by the user"
+    shell.user_ns[f"_{result}"] = "also set by the user"
+
+    manager.evict([result, 99])
+    assert shell.output_hist == {}
+    assert shell.user_ns["_"] == "set by the user"
+    assert shell.user_ns[f"_{result}"] == "also set by the user"
+    assert shell.displayhook._ == ""
+    assert shell.last_execution_result.result is None
+
+
+def test_check_memory(monkeypatch):
+    shell = FakeShell()
+    manager = MemoryManager(shell, memory_limit=100 * 1024 * 1024, evict_min_size=1024 * 1024)
+    small, large = [1], _array(2)
+    shell.run(small)
+    shell.run(large)
+
+    monkeypatch.setattr(memory, "get_rss", lambda: 50 * 1024 * 1024)
+    assert manager.check_memory() == []
+
+    monkeypatch.setattr(memory, "get_rss", lambda: 200 * 1024 * 1024)
+    assert manager.check_memory() == [2]
+    assert list(shell.output_hist) == [1]
+
+    # No limit set
+    manager.memory_limit = 0
+    shell.run(_array(2))
+    assert manager.check_memory() == []
+
+
+def test_post_run_cell_logs_errors(monkeypatch):
+    manager = MemoryManager(FakeShell(), max_outputs=1)
+
+    def trim():
+        raise RuntimeError("Errors limiting the output history are logged")
+    monkeypatch.setattr(manager, "trim", trim)
+    manager.post_run_cell()
+
+
+def test_usage():
+    shell = FakeShell()
+    manager = MemoryManager(shell, max_outputs=10)
+    shell.user_ns.update({"big": _array(2), "small": [1], "func": len, "__name__": "__main__", "sys": sys})
+    shell.run(_array(1))
+
+    usage = manager.usage()
+    assert usage["outputs"] == 1
+    assert usage["output_bytes"] == 1024 * 1024
+    assert usage["max_outputs"] == 10
+    assert usage["memory_limit"] is None
+    assert [obj["name"] for obj in usage["objects"]] == ["big", "small"]
+    assert usage["objects"][0]["type"] == "numpy.ndarray"
+    assert usage["objects"][1]["type"] == "list"
+    assert len(manager.usage(count=1)["objects"]) == 1
+
+    text = format_usage(usage)
+    assert "Output history: 1 results, 1.0MB" in text
+    assert "big" in text and "2.0MB" in text
+    assert "No variables." in format_usage(dict(usage, objects=[]))
+
+
+def test_set_underscore():
+    shell = FakeShell()
+    shell.run([1])
+    value = [2]
+    set_underscore(shell, value)
+    assert shell.user_ns["_"] is value and shell.displayhook._ is value
+    assert shell.user_ns["__"] == [1]
+
+    # Once the user has assigned _ the display hook is left alone
+    shell.user_ns["_"] = "set by the user"
+    set_underscore(shell, [3])
+    assert shell.user_ns["_"] == [3]
+    assert shell.displayhook._ is value
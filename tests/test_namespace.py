@@ -0,0 +1,208 @@
+"""
+Tests for pyxll_jupyter.namespace.
+"""
+from pyxll_jupyter.namespace import NamespaceStore, LazyNamespace, get_namespace_store, save_namespace, \
+    load_namespace
+import pyxll_jupyter.namespace as namespace
+import json
+import ast
+import os
+import pytest
+
+
+class FakeShell:
+    """Just enough of an InteractiveShell for saving and loading namespaces."""
+
+    def __init__(self, **user_ns):
+        self.user_ns = dict(user_ns)
+        self.user_ns_hidden = {}
+        self.ast_transformers = []
+
+    def run(self, code):
+        """Apply the AST transformers to code, as IPython does before running a cell."""
+        node = ast.parse(code)
+        for transformer in self.ast_transformers:
+            node = transformer.visit(node)
+        return node
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    """Save snapshots in tmp_path instead of the folder set in the pyxll config."""
+    monkeypatch.setattr(namespace, "get_namespace_store",
+                        lambda name=None: NamespaceStore(str(tmp_path / (name or namespace.DEFAULT_SNAPSHOT))))
+    monkeypatch.setattr(namespace, "_lazy_namespace", None)
+    return tmp_path
+
+
+def test_store_pickle(tmp_path):
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+    assert store.manifest() is None
+    assert store.variables() == {}
+
+    saved, errors = store.save({"d": {"x": [1, 2]}, "s": "text", "f": lambda: None})
+    assert saved == ["d", "s"]
+    assert list(errors) == ["f"]
+
+    variables = store.variables()
+    assert sorted(variables) == ["d", "s"]
+    assert variables["d"]["format"] == "pickle"
+    assert store.load(variables["d"]) == {"x": [1, 2]}
+    assert store.load(variables["s"]) == "text"
+
+
+def test_store_numpy(tmp_path):
+    np = pytest.importorskip("numpy")
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+
+    array = np.arange(1000, dtype="f8")
+    objects = np.array([1, "a"], dtype=object)
+    store.save({"array": array, "objects": objects, "empty": np.zeros(0)})
+
+    variables = store.variables()
+    assert variables["array"]["format"] == "npy"
+    assert variables["objects"]["format"] == "pickle"
+
+    # Arrays are memory mapped copy-on-write
+    loaded = store.load(variables["array"])
+    assert isinstance(loaded, np.memmap)
+    np.testing.assert_array_equal(loaded, array)
+    loaded[0] = 100
+    assert store.load(variables["array"])[0] == 0
+
+    assert store.load(variables["objects"]).tolist() == [1, "a"]
+    assert store.load(variables["empty"]).shape == (0,)
+
+
+def test_store_dataframe(tmp_path):
+    pd = pytest.importorskip("pandas")
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"], "c": pd.date_range("2020-01-01", periods=3)},
+                      index=[10, 20, 30])
+    df.columns = ["a", "a", 0]
+    store.save({"df": df})
+
+    entry = store.variables()["df"]
+    assert entry["format"] == "frame"
+    loaded = store.load(entry)
+    assert loaded.columns.tolist() == ["a", "a", 0]
+    assert loaded.dtypes.tolist() == df.dtypes.tolist()
+    assert loaded.equals(df)
+
+
+def test_store_replaces_files(tmp_path):
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+    store.save({"a": 1, "b": 2})
+    entries = store.variables()
+
+    # Variables in keep are included without being written again
+    saved, errors = store.save({"c": 3}, keep={"a": entries["a"]})
+    assert saved == ["c"]
+
+    variables = store.variables()
+    assert sorted(variables) == ["a", "c"]
+    assert variables["a"] == entries["a"]
+    assert store.load(variables["a"]) == 1
+
+    # The files for b have been removed
+    files = {filename for entry in variables.values() for filename in entry["files"]}
+    assert set(os.listdir(store.path)) == files | {"manifest.json"}
+
+
+def test_store_incompatible_version(tmp_path):
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+    store.save({"a": 1})
+
+    path = os.path.join(store.path, "manifest.json")
+    with open(path) as fh:
+        manifest = json.load(fh)
+    manifest["version"] = -1
+    with open(path, "w") as fh:
+        json.dump(manifest, fh)
+
+    with pytest.raises(ValueError):
+        store.manifest()
+
+
+@pytest.mark.parametrize("name", ["..", "a/b", "a\\b", " a", "a."])
+def test_invalid_snapshot_name(name):
+    with pytest.raises(ValueError):
+        get_namespace_store(name)
+
+
+def test_lazy_namespace(tmp_path):
+    store = NamespaceStore(str(tmp_path / "snapshot"))
+    store.save({"a": 1, "b": 2, "c": 3, "d": 4})
+
+    shell = FakeShell(d="already set")
+    lazy = LazyNamespace(shell)
+    lazy.install()
+    lazy.install()
+    assert shell.ast_transformers == [lazy]
+
+    lazy.add(store, store.variables())
+    assert sorted(lazy.pending()) == ["a", "b", "c", "d"]
+
+    # Only names used by the cell are loaded
+    shell.run("x = a + 1")
+    assert shell.user_ns == {"a": 1, "d": "already set"}
+
+    # Names passed to magics are loaded
+    shell.run("get_ipython().run_line_magic('xl_set', 'b')")
+    assert shell.user_ns["b"] == 2
+
+    # Variables set since the snapshot was restored aren't replaced
+    shell.run("print(d)")
+    assert shell.user_ns["d"] == "already set"
+    assert sorted(lazy.pending()) == ["c"]
+
+    lazy.discard(["c"])
+    shell.run("c")
+    assert "c" not in shell.user_ns
+
+
+def test_save_and_load_namespace(stores):
+    shell = FakeShell(a=1, b=[2], _private=3, module=os, func=test_store_pickle, cls=FakeShell)
+    saved, errors = save_namespace(shell)
+    assert saved == ["a", "b"]
+    assert errors == {}
+
+    saved, errors = save_namespace(shell, "other", names=["a", "missing"])
+    assert saved == ["a"]
+    assert errors == {"missing": "Not defined"}
+
+    # Loaded straight away by default
+    shell = FakeShell(b="already set")
+    restored, errors = load_namespace(shell)
+    assert restored == ["a"]
+    assert shell.user_ns == {"a": 1, "b": "already set"}
+
+    restored, errors = load_namespace(shell, replace=True)
+    assert restored == ["a", "b"]
+    assert shell.user_ns == {"a": 1, "b": [2]}
+
+    restored, errors = load_namespace(FakeShell(), names=["a", "missing"])
+    assert restored == ["a"]
+    assert errors == {"missing": "Not in snapshot"}
+
+
+def test_load_namespace_lazily(stores):
+    save_namespace(FakeShell(a=1, b=2))
+
+    shell = FakeShell()
+    restored, errors = load_namespace(shell, lazy=True)
+    assert restored == ["a", "b"]
+    assert shell.user_ns == {}
+
+    shell.run("a")
+    assert shell.user_ns == {"a": 1}
+
+    # Variables not used yet are kept when saving to the same snapshot
+    shell.user_ns["c"] = 3
+    saved, errors = save_namespace(shell)
+    assert saved == ["a", "b", "c"]
+    assert "b" not in shell.user_ns
+
+    restored, errors = load_namespace(FakeShell())
+    assert restored == ["a", "b", "c"]
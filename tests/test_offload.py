@@ -0,0 +1,117 @@
+"""
+Tests for pyxll_jupyter.offload.
+"""
+from pyxll_jupyter.offload import OffloadPool, _dumps, _loads, _release, _find_inputs
+from multiprocessing import shared_memory
+import concurrent.futures
+import asyncio
+import pytest
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = OffloadPool(processes=1, shm_threshold=1024)
+    yield pool
+    pool.shutdown()
+
+
+def test_dumps_small_values_are_pickled():
+    payload, blocks = _dumps({"a": [1, 2, 3], "b": b"x" * 100}, threshold=1024)
+    assert blocks == []
+
+    value, blocks = _loads(payload, copy=True)
+    assert value == {"a": [1, 2, 3], "b": b"x" * 100}
+    assert blocks == []
+
+
+def test_dumps_large_buffers_use_shared_memory():
+    np = pytest.importorskip("numpy")
+    array = np.arange(10000, dtype="f8")
+
+    payload, blocks = _dumps(array, threshold=1024)
+    try:
+        assert len(blocks) == 1
+        value, loaded = _loads(payload, copy=True)
+        assert _release(loaded) == []
+        np.testing.assert_array_equal(value, array)
+    finally:
+        _release(blocks, unlink=True)
+
+    # Once released and unlinked the block can't be opened again
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=blocks[0].name)
+
+
+def test_release_keeps_blocks_in_use():
+    np = pytest.importorskip("numpy")
+    payload, blocks = _dumps(np.zeros(1000), threshold=1024)
+    try:
+        value, loaded = _loads(payload, copy=False)
+        assert _release(loaded) == loaded
+
+        del value
+        assert _release(loaded) == []
+    finally:
+        _release(blocks, unlink=True)
+
+
+def test_find_inputs():
+    namespace = {"x": 1, "y": 2, "_hidden": 3, "unused": 4, "np": None}
+    code = "z = x + y + _hidden\nprint(np, undefined)"
+    assert _find_inputs(code, namespace) == ["np", "x", "y"]
+    assert _find_inputs(code, namespace, exclude=("np",)) == ["x", "y"]
+
+
+def test_run(pool):
+    namespace = {"x": 2, "y": [1, 2, 3], "unused": object()}
+    values, errors, output = pool.run("import math\nz = x * sum(y)\nprint('z is', z)", namespace)
+    assert values == {"z": 12}
+    assert errors == {}
+    assert output == "z is 12\n"
+
+
+def test_run_inputs_and_outputs(pool):
+    namespace = {"x": 2, "os": __import__("os")}
+    values, errors, output = pool.run("a = os.sep\nb = x + 1", namespace, inputs=["x", "os"], outputs=["b", "c"])
+    assert values == {"b": 3}
+    assert errors == {"c": "not defined"}
+
+
+def test_run_large_values(pool):
+    np = pytest.importorskip("numpy")
+    namespace = {"array": np.arange(100000, dtype="f8")}
+    values, errors, output = pool.run("total = array * 2", namespace)
+    assert errors == {}
+    np.testing.assert_array_equal(values["total"], namespace["array"] * 2)
+
+
+def test_run_errors(pool):
+    with pytest.raises(NameError):
+        pool.run("y = x", {}, inputs=["x"])
+
+    with pytest.raises(TypeError):
+        pool.run("y = x", {"x": lambda: None})
+
+    with pytest.raises(ZeroDivisionError):
+        pool.run("y = 1 / 0", {})
+
+    # The pool can still be used after a cell fails
+    assert pool.run("y = 1", {})[0] == {"y": 1}
+
+
+def test_run_timeout(pool):
+    with pytest.raises(concurrent.futures.TimeoutError):
+        pool.run("import time\ntime.sleep(60)", {}, timeout=1)
+
+    # The worker processes are restarted
+    assert pool.run("y = 1", {}, timeout=60)[0] == {"y": 1}
+
+
+def test_run_async(pool):
+    values, errors, output = asyncio.run(pool.run_async("y = x + 1", {"x": 1}))
+    assert values == {"y": 2}
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(pool.run_async("import time\ntime.sleep(60)", {}, timeout=1))
+
+    assert asyncio.run(pool.run_async("y = 1", {}, timeout=60))[0] == {"y": 1}
@@ -0,0 +1,194 @@
+"""
+Tests for pyxll_jupyter.output.
+"""
+import importlib.util
+import contextvars
+import threading
+import asyncio
+import sys
+import os
+import pytest
+
+# Use the stand-in for pyxll from the benchmarks when running without Excel
+if importlib.util.find_spec("pyxll") is None:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks"))
+
+from pyxll_jupyter.output import CoalescingStream, OutputCoalescer
+import pyxll_jupyter.mainthread as mainthread
+
+# IPython's OutStream gets the parent header from a context variable
+_parent = contextvars.ContextVar("parent", default=None)
+
+
+class FakeStream:
+    """Records what's written, and the parent header each write was made with."""
+
+    def __init__(self):
+        self.writes = []
+        self.flushes = 0
+
+    @property
+    def parent_header(self):
+        return _parent.get()
+
+    def set_parent(self, parent):
+        _parent.set(parent)
+
+    def write(self, data):
+        self.writes.append((_parent.get(), data))
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_writes_are_buffered():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream)
+
+    assert coalescing.write("a") == 1
+    coalescing.writelines(["b", "c\n"])
+    coalescing.flush()
+    assert stream.writes == []
+
+    coalescing.send()
+    assert stream.writes == [(None, "abc\n")]
+    assert stream.flushes == 0
+
+    coalescing.send(force=True)
+    assert stream.writes == [(None, "abc\n")]
+    assert stream.flushes == 1
+
+
+def test_write_bytes():
+    with pytest.raises(TypeError):
+        CoalescingStream(FakeStream()).write(b"data")
+
+
+def test_flush_size():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream, flush_size=10)
+    coalescing.write("x" * 9)
+    assert stream.writes == []
+    coalescing.write("x")
+    assert stream.writes == [(None, "x" * 10)]
+
+
+def test_output_keeps_its_parent():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream)
+
+    def cell(parent, data):
+        _parent.set(parent)
+        coalescing.write(data)
+
+    contextvars.copy_context().run(cell, "cell 1", "a")
+    contextvars.copy_context().run(cell, "cell 1", "b")
+    contextvars.copy_context().run(cell, "cell 2", "c")
+    coalescing.send()
+
+    assert stream.writes == [("cell 1", "ab"), ("cell 2", "c")]
+
+
+def test_set_parent_sends_buffered_output():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream)
+
+    def run():
+        coalescing.set_parent("cell 1")
+        coalescing.write("a")
+        coalescing.set_parent("cell 2")
+        coalescing.write("b")
+        coalescing.send()
+
+    contextvars.copy_context().run(run)
+    assert stream.writes == [("cell 1", "a"), ("cell 2", "b")]
+
+
+def test_max_size():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream, max_size=5)
+    coalescing.write("abc")
+    coalescing.send()
+    coalescing.write("defgh")
+    coalescing.send(force=True)
+
+    assert "".join(data for _, data in stream.writes[:2]) == "abcde"
+    assert "3 characters of output were not shown" in stream.writes[2][1]
+
+    # The limit is per cell
+    coalescing.reset()
+    coalescing.write("ijk")
+    coalescing.send()
+    assert stream.writes[-1] == (None, "ijk")
+
+
+def test_max_rate():
+    stream = FakeStream()
+    coalescing = CoalescingStream(stream, max_rate=0.001)
+    coalescing.write("a")
+    coalescing.send()
+    coalescing.write("b")
+    coalescing.send()
+    assert stream.writes == [(None, "a")]
+
+    coalescing.send(force=True)
+    assert stream.writes == [(None, "a"), (None, "b")]
+
+
+def test_flush_from_another_thread(monkeypatch):
+    monkeypatch.setattr(mainthread, "_main_thread_id", threading.get_ident())
+    notified = []
+    coalescing = CoalescingStream(FakeStream(), notify=lambda: notified.append(True))
+
+    # Nothing to send
+    thread = threading.Thread(target=coalescing.flush)
+    thread.start()
+    thread.join()
+    assert notified == []
+
+    def write():
+        coalescing.write("a")
+        coalescing.flush()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    thread.join()
+    assert notified == [True]
+
+    # The kernel isn't woken from the main thread as output is sent after each poll
+    coalescing.flush()
+    assert notified == [True]
+
+
+@pytest.mark.parametrize("kwargs", [{"flush_size": 0}, {"max_rate": -1}, {"max_size": -1}])
+def test_invalid_options(kwargs):
+    with pytest.raises(ValueError):
+        OutputCoalescer(FakeStream(), FakeStream(), **kwargs)
+
+
+@pytest.mark.parametrize("is_async", [False, True])
+def test_install(is_async):
+    stdout, stderr = FakeStream(), FakeStream()
+    coalescer = OutputCoalescer(stdout, stderr, max_size=3)
+
+    def do_execute(code):
+        coalescer.stdout.write(code)
+        coalescer.stderr.write("error")
+        return "reply"
+
+    async def do_execute_async(code):
+        return do_execute(code)
+
+    class Kernel:
+        pass
+
+    kernel = Kernel()
+    kernel.do_execute = do_execute_async if is_async else do_execute
+    coalescer.install(kernel)
+
+    # All output is sent before the reply, and the size limit is reset for each cell
+    for _ in range(2):
+        assert asyncio.run(kernel.do_execute("abcd")) == "reply"
+        assert stdout.writes[-2][1] == "abc"
+        assert "1 characters" in stdout.writes[-1][1]
+        assert stderr.writes[-2][1] == "err"
@@ -0,0 +1,268 @@
+"""
+Tests for pyxll_jupyter.polling.
+"""
+from pyxll_jupyter.polling import TimerWakeup, ZMQWakeup, get_pending_work, AdaptiveInterval, MessageCounter, \
+    DutyCycleGovernor, IdleMonitor
+import threading
+import asyncio
+import types
+import time
+import zmq
+import pytest
+
+
+@pytest.fixture
+def sockets():
+    """A connected pair of ZMQ sockets, (receiver, sender)."""
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    port = receiver.bind_to_random_port("tcp://127.0.0.1")
+    sender = context.socket(zmq.PUSH)
+    sender.connect(f"tcp://127.0.0.1:{port}")
+    yield receiver, sender
+    sender.close(linger=0)
+    receiver.close(linger=0)
+    context.term()
+
+
+def _settle(wakeup):
+    """Wait until the sockets' file descriptors are only readable for new messages.
+
+    They may also become readable for other events, such as the connection being made,
+    until the sockets' state is read by drain.
+    """
+    interval, wakeup.interval = wakeup.interval, 0.05
+    deadline = time.perf_counter() + 10
+    while wakeup.wait() and time.perf_counter() < deadline:
+        assert wakeup.drain() is False
+    wakeup.interval = interval
+
+
+def test_timer_wakeup():
+    wakeup = TimerWakeup(interval=0.05)
+    start = time.perf_counter()
+    assert wakeup.wait() is False
+    assert time.perf_counter() - start >= 0.04
+    assert wakeup.drain() is False
+
+    # notify wakes the waiting thread straight away
+    wakeup.interval = 60
+    threading.Timer(0.05, wakeup.notify).start()
+    start = time.perf_counter()
+    wakeup.wait()
+    assert time.perf_counter() - start < 30
+
+
+def test_zmq_wakeup_waits_for_messages(sockets):
+    receiver, sender = sockets
+    wakeup = ZMQWakeup([receiver], interval=0.05)
+    assert wakeup.drain() is False
+    _settle(wakeup)
+
+    # Nothing to read
+    start = time.perf_counter()
+    assert wakeup.wait() is False
+    assert time.perf_counter() - start >= 0.04
+
+    # Returns as soon as a message arrives
+    wakeup.interval = 60
+    threading.Timer(0.05, sender.send, (b"message",)).start()
+    start = time.perf_counter()
+    assert wakeup.wait() is True
+    assert time.perf_counter() - start < 30
+
+    # Messages are waiting until they've been read
+    assert wakeup.drain() is True
+    assert receiver.recv() == b"message"
+    assert wakeup.drain() is False
+
+
+def test_zmq_wakeup_pending_and_timers(sockets):
+    receiver, _ = sockets
+    wakeup = ZMQWakeup([receiver], interval=60)
+    _settle(wakeup)
+
+    # Callbacks ready to run in the event loop don't wait at all
+    start = time.perf_counter()
+    assert wakeup.wait(pending=True) is False
+    assert wakeup.wait(next_timer=0.05) is False
+    assert time.perf_counter() - start < 30
+
+
+def test_zmq_wakeup_notify(sockets):
+    receiver, _ = sockets
+    wakeup = ZMQWakeup([receiver], interval=60)
+    _settle(wakeup)
+
+    threading.Timer(0.05, wakeup.notify).start()
+    start = time.perf_counter()
+    assert wakeup.wait() is True
+    assert time.perf_counter() - start < 30
+
+    # Notifying is cleared once woken
+    wakeup.interval = 0.05
+    assert wakeup.wait() is False
+
+
+def test_get_pending_work():
+    assert get_pending_work(object()) == (False, None)
+
+    loop = asyncio.new_event_loop()
+    try:
+        ioloop = types.SimpleNamespace(asyncio_loop=loop)
+        assert get_pending_work(ioloop) == (False, None)
+
+        handle = loop.call_later(10, lambda: None)
+        pending, next_timer = get_pending_work(ioloop)
+        assert not pending
+        assert 9 < next_timer <= 10
+        handle.cancel()
+
+        loop.call_soon(lambda: None)
+        assert get_pending_work(ioloop)[0] is True
+    finally:
+        loop.close()
+
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(min_interval=0.01, max_interval=0.1, decay=2)
+    assert interval.current == 0.01
+
+    # Backs off while idle, up to the maximum
+    assert [interval.update(False) for _ in range(5)] == pytest.approx([0.02, 0.04, 0.08, 0.1, 0.1])
+
+    # And snaps back after any activity
+    assert interval.update(True) == 0.01
+    assert interval.update(False) == pytest.approx(0.02)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"min_interval": 0},
+    {"min_interval": 1, "max_interval": 0.5},
+    {"decay": 0.5},
+])
+def test_adaptive_interval_invalid(kwargs):
+    with pytest.raises(ValueError):
+        AdaptiveInterval(**kwargs)
+
+
+def test_message_counter():
+    dispatched = []
+
+    class Kernel:
+        def dispatch_shell(self, msg):
+            dispatched.append(msg)
+            return "result"
+
+    kernel = Kernel()
+    counter = MessageCounter()
+    counter.install(kernel)
+    assert counter.take() == 0
+
+    assert kernel.dispatch_shell(1) == "result"
+    kernel.dispatch_shell(2)
+    assert dispatched == [1, 2]
+    assert counter.take() == 2
+    assert counter.take() == 0
+
+
+def test_duty_cycle_governor():
+    governor = DutyCycleGovernor(max_duty_cycle=0.5, window=1.0)
+    assert governor.delay(0.0) == 0.0
+
+    governor.record(0.2, 0.2)
+    governor.record(0.5, 0.3)
+    assert governor.duty_cycle(0.5) == pytest.approx(0.5)
+    assert governor.delay(0.5) == 0.0
+
+    # Over the limit, so wait until the first poll drops out of the window
+    governor.record(0.7, 0.2)
+    assert governor.duty_cycle(0.7) == pytest.approx(0.7)
+    assert governor.delay(0.7) == pytest.approx(0.5)
+
+    # Polls older than the window are forgotten
+    assert governor.delay(1.25) == 0.0
+    assert governor.duty_cycle(1.25) == pytest.approx(0.5)
+    assert governor.duty_cycle(10.0) == 0.0
+
+
+def test_duty_cycle_governor_single_long_poll():
+    governor = DutyCycleGovernor(max_duty_cycle=0.1, window=1.0)
+    governor.record(2.0, 1.5)
+    assert governor.delay(2.0) == pytest.approx(1.0)
+    assert governor.delay(3.0) == 0.0
+
+
+@pytest.mark.parametrize("kwargs", [{"max_duty_cycle": 0}, {"max_duty_cycle": 1.5}, {"window": 0}])
+def test_duty_cycle_governor_invalid(kwargs):
+    with pytest.raises(ValueError):
+        DutyCycleGovernor(**kwargs)
+
+
+@pytest.fixture
+def kernel_app():
+    """Just enough of an IPKernelApp for an IdleMonitor, with a bound shell socket."""
+    context = zmq.Context()
+    shell_socket = context.socket(zmq.ROUTER)
+    shell_socket.bind("tcp://127.0.0.1:*")
+
+    async def dispatch_control(*args, **kwargs):
+        pass
+
+    yield types.SimpleNamespace(shell_socket=shell_socket,
+                                kernel=types.SimpleNamespace(dispatch_control=dispatch_control))
+    shell_socket.close(linger=0)
+    context.term()
+
+
+def _wait_for(func, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not func() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return func()
+
+
+def test_idle_monitor_counts_connections(kernel_app):
+    monitor = IdleMonitor(idle_timeout=60, disconnected_timeout=0.05)
+    monitor.install(kernel_app)
+    try:
+        assert monitor.connected == 0
+        endpoint = kernel_app.shell_socket.getsockopt_string(zmq.LAST_ENDPOINT)
+        frontend = kernel_app.shell_socket.context.socket(zmq.DEALER)
+        frontend.connect(endpoint)
+        assert _wait_for(lambda: monitor.update() is False and monitor.connected == 1)
+
+        # Idle soon after the last frontend disconnects
+        frontend.close(linger=0)
+        assert _wait_for(lambda: monitor.update())
+        assert monitor.connected == 0
+        assert monitor.update(active=True) is False
+    finally:
+        monitor.close()
+
+
+def test_idle_monitor_close_while_updating(kernel_app):
+    monitor = IdleMonitor(idle_timeout=60)
+    monitor.install(kernel_app)
+
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            monitor.update()
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    try:
+        time.sleep(0.05)
+        monitor.close()
+        monitor.close()
+    finally:
+        stop.set()
+        thread.join()
+    assert monitor.update() is False
+
+
+def test_idle_monitor_invalid():
+    with pytest.raises(ValueError):
+        IdleMonitor(idle_timeout=0)
@@ -0,0 +1,136 @@
+"""
+Tests for pyxll_jupyter.processes.
+"""
+from pyxll_jupyter.processes import ProcessBackend, PosixProcessBackend, get_process_trees, kill_process_trees
+import subprocess
+import pytest
+import time
+import sys
+import os
+
+
+class FakeProcessBackend(ProcessBackend):
+    """ProcessBackend with a fixed table of processes."""
+
+    def __init__(self, processes):
+        self.processes = dict(processes)
+        self.terminated = []
+
+    def snapshot(self):
+        return dict(self.processes)
+
+    def terminate(self, pid):
+        if self.processes.pop(pid, None) is None:
+            return False
+        self.terminated.append(pid)
+        return True
+
+
+# {pid: parent pid}, with two trees under 1 and an unrelated tree under 50
+_processes = {
+    0: 0,
+    1: 0,
+    10: 1,
+    11: 1,
+    100: 10,
+    101: 10,
+    110: 11,
+    20: 0,
+    50: 0,
+    51: 50,
+}
+
+
+def test_process_backend_is_abstract():
+    with pytest.raises(TypeError):
+        ProcessBackend()
+
+
+def test_get_process_trees():
+    tree = get_process_trees(_processes, [10, 11])
+    assert sorted(tree) == [10, 11, 100, 101, 110]
+
+    # Parents come before their children
+    for pid in tree:
+        if _processes[pid] in tree:
+            assert tree.index(_processes[pid]) < tree.index(pid)
+
+
+def test_get_process_trees_missing_root():
+    assert get_process_trees(_processes, [999]) == []
+    assert get_process_trees(_processes, [999, 20]) == [20]
+
+
+def test_get_process_trees_self_parent():
+    # Process 0 on Windows is its own parent, which must not loop forever
+    assert sorted(get_process_trees({0: 0, 4: 0}, [0])) == [0, 4]
+
+
+def test_kill_process_trees_fake():
+    backend = FakeProcessBackend(_processes)
+    killed = kill_process_trees([1], backend=backend)
+    assert sorted(killed) == [1, 10, 11, 100, 101, 110]
+    assert sorted(backend.terminated) == sorted(killed)
+    assert sorted(backend.processes) == [0, 20, 50, 51]
+
+
+def test_kill_process_trees_already_exited():
+    class ExitedBackend(FakeProcessBackend):
+        def terminate(self, pid):
+            # 101 exits after the snapshot is taken, and 110 can't be killed
+            if pid == 101:
+                self.processes.pop(pid)
+            elif pid == 110:
+                raise OSError("Access denied")
+            return super().terminate(pid)
+
+    backend = ExitedBackend(_processes)
+    killed = kill_process_trees([1], backend=backend)
+    assert sorted(killed) == [1, 10, 11, 100]
+
+
+def _is_running(pid):
+    """Return True if pid is running and isn't a zombie waiting to be reaped."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fh:
+            stat = fh.read()
+    except FileNotFoundError:
+        return False
+    except OSError:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+    return stat.rsplit(b")", 1)[-1].split()[0] != b"Z"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="requires a posix shell")
+def test_kill_process_trees_posix():
+    backend = PosixProcessBackend()
+
+    # A shell with two children, one of which has a child of its own
+    proc = subprocess.Popen(["sh", "-c", "sleep 60 & sh -c 'sleep 60 & wait' & wait"])
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            tree = get_process_trees(backend.snapshot(), [proc.pid])
+            if len(tree) >= 4 or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        assert tree[0] == proc.pid
+        assert len(tree) == 4
+
+        killed = kill_process_trees([proc.pid], backend=backend)
+        assert sorted(killed) == sorted(tree)
+
+        proc.wait(10)
+        deadline = time.monotonic() + 10
+        while any(_is_running(pid) for pid in tree) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not [pid for pid in tree if _is_running(pid)]
+        assert not get_process_trees(backend.snapshot(), [proc.pid])
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
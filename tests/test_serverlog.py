@@ -0,0 +1,55 @@
+"""
+Tests for pyxll_jupyter.serverlog.
+"""
+from pyxll_jupyter.serverlog import ServerOutput
+import subprocess
+import textwrap
+import time
+import sys
+import pytest
+
+
+def _run(script, **kwargs):
+    """Run a Python script and read its output with a ServerOutput, returning once it has ended."""
+    proc = subprocess.Popen([sys.executable, "-c", textwrap.dedent(script)],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = ServerOutput(proc, **kwargs)
+    output.start()
+    proc.wait(30)
+
+    deadline = time.monotonic() + 10
+    while output.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    proc.stdout.close()
+    return output
+
+
+@pytest.mark.parametrize("script", [
+    # jupyter_server
+    """
+    print("[I 2026-01-01 00:00:00.000 ServerApp] Jupyter Server 2.0.0 is running at:")
+    print("[I 2026-01-01 00:00:00.000 ServerApp] http://localhost:8888/tree?token=abc")
+    print("[I 2026-01-01 00:00:00.000 ServerApp]     http://127.0.0.1:8888/tree?token=abc")
+    """,
+    # Printed in pieces, after the URLs to copy and paste
+    """
+    import sys, time
+    for text in ["    Or copy and paste ", "one of these URLs:\\n", "        http://localhost:8888/tree?to", "ken=abc\\n"]:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        time.sleep(0.05)
+    """,
+])
+def test_url(script):
+    output = _run(script, chunk_size=16)
+    assert output.url == "http://localhost:8888/tree?token=abc"
+
+
+def test_no_url():
+    output = _run("""
+    print("http://localhost:8888/?token=abc")
+    print("Jupyter Server 2.0.0 is running at:")
+    print("not a url")
+    """)
+    assert output.url is None
@@ -0,0 +1,186 @@
+"""
+Tests for pyxll_jupyter.servers.
+"""
+from pyxll_jupyter.servers import ServerPool, list_server_info_files, get_server_root, get_server_url, \
+    wait_for_server_info, _get_server_info_from_url
+import concurrent.futures
+import http.server
+import subprocess
+import threading
+import json
+import sys
+import os
+import pytest
+
+
+class FakeProcess:
+    """Popen-like object for a server process."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+
+def test_pool_shares_servers():
+    pool = ServerPool()
+    key = ("notebook", "/root")
+    proc = FakeProcess(1)
+
+    assert pool.acquire(key, "a") is None
+    server = pool.add(key, proc, "http://localhost:8888/?token=x", "a")
+    assert server.ready.result() == server.url
+    assert pool.servers() == [server]
+
+    assert pool.acquire(("lab", "/root"), "b") is None
+    assert pool.acquire(key, "b") is server
+    assert server.tokens == {"a", "b"}
+    assert "a" in pool and "b" in pool
+
+    # The server is only returned to be stopped once the last session is released
+    assert pool.release("a") is None
+    assert pool.release("a") is None
+    assert pool.release("b") is server
+    assert server.removed
+    assert pool.servers() == []
+    assert "b" not in pool
+
+
+def test_pool_removes_stopped_servers():
+    pool = ServerPool()
+    key = ("notebook", "/root")
+    proc = FakeProcess(1)
+    server = pool.add(key, proc, "http://localhost:8888/", "a")
+
+    proc.returncode = 1
+    assert not server.running
+    assert pool.acquire(key, "b") is None
+    assert server.removed
+    assert "a" not in pool
+
+
+def test_pool_removes_failed_servers():
+    pool = ServerPool()
+    key = ("notebook", "/root")
+    ready = concurrent.futures.Future()
+    server = pool.add(key, FakeProcess(1), "http://localhost:8888/", "a", ready)
+
+    # Still starting
+    assert pool.acquire(key, "b") is server
+
+    ready.set_exception(RuntimeError("Failed to start"))
+    assert pool.acquire(key, "c") is None
+    assert server.removed
+
+
+def test_pool_replace_process():
+    pool = ServerPool()
+    server = pool.add(("notebook", "/root"), FakeProcess(1), "http://localhost:8888/", "a")
+
+    proc = FakeProcess(2)
+    assert pool.replace_process(server, proc) == {"a"}
+    assert server.process is proc
+
+    # A server that's been released shouldn't be restarted
+    pool.release("a")
+    assert pool.replace_process(server, FakeProcess(3)) is None
+    assert server.process is proc
+
+
+
+@pytest.fixture(scope="module")
+def http_server():
+    """URL of an HTTP server that responds to requests to /api like a Jupyter server."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == "/api" else 404)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proc():
+    """A running process standing in for a server process."""
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def _write_server_info(path, pid, url, root_dir):
+    with open(path, "w") as fh:
+        json.dump({"pid": pid, "url": url, "token": "abc", "root_dir": root_dir}, fh)
+
+
+def test_get_server_url():
+    assert get_server_url({"url": "http://localhost:8888", "token": "abc"}) == "http://localhost:8888/?token=abc"
+    assert get_server_url({"url": "http://localhost:8888/", "token": ""}) == "http://localhost:8888/"
+
+
+def test_get_server_info_from_url():
+    assert _get_server_info_from_url("http://localhost:8888/tree?token=abc") == \
+        {"url": "http://localhost:8888/", "token": "abc"}
+    assert _get_server_info_from_url("http://localhost:8888/base/lab?token=abc") == \
+        {"url": "http://localhost:8888/base", "token": "abc"}
+    assert _get_server_info_from_url("http://localhost:8888/") == {"url": "http://localhost:8888/"}
+
+
+def test_get_server_root(tmp_path):
+    assert get_server_root({"root_dir": str(tmp_path)}) == os.path.normcase(str(tmp_path))
+    assert get_server_root({"notebook_dir": str(tmp_path)}) == os.path.normcase(str(tmp_path))
+    assert get_server_root({}) is None
+
+
+def test_list_server_info_files(tmp_path):
+    assert list_server_info_files(str(tmp_path / "missing")) == {}
+
+    for name in ("jpserver-1.json", "nbserver-2.json", "jpserver-1-open.html", "kernel-1.json"):
+        (tmp_path / name).write_text("{}")
+    assert sorted(list_server_info_files(str(tmp_path))) == ["jpserver-1.json", "nbserver-2.json"]
+
+
+def test_wait_for_server_info(tmp_path, http_server, proc):
+    # Files written by other servers, or before the server was started, are ignored
+    _write_server_info(tmp_path / "jpserver-1.json", proc.pid, http_server, "/")
+    existing = list_server_info_files(str(tmp_path))
+    _write_server_info(tmp_path / "jpserver-2.json", 2, http_server, "/other")
+    assert wait_for_server_info(proc, str(tmp_path), existing, "/root", timeout=0.2) is None
+
+    # A file written by the process, or by a server in the same folder
+    _write_server_info(tmp_path / "jpserver-3.json", 3, http_server, str(tmp_path))
+    info = wait_for_server_info(proc, str(tmp_path), existing, str(tmp_path), timeout=10)
+    assert info["pid"] == 3
+
+    _write_server_info(tmp_path / "jpserver-4.json", proc.pid, http_server, "/other")
+    info = wait_for_server_info(proc, str(tmp_path), existing, str(tmp_path), timeout=10)
+    assert info["pid"] == proc.pid
+
+
+def test_wait_for_server_info_not_responding(tmp_path, proc):
+    # Port 1 isn't a Jupyter server
+    _write_server_info(tmp_path / "jpserver-1.json", proc.pid, "http://127.0.0.1:1/", "/")
+    assert wait_for_server_info(proc, str(tmp_path), {}, timeout=0.2) is None
+
+
+def test_wait_for_server_info_from_url(tmp_path, http_server, proc):
+    # The server's output is used if no server info file is found
+    urls = [None, None, http_server + "tree?token=abc"]
+    info = wait_for_server_info(proc, str(tmp_path), {}, timeout=10, get_url=lambda: urls.pop(0) if urls else None)
+    assert info == {"url": http_server, "token": "abc"}
+
+
+def test_wait_for_server_info_process_ended(tmp_path, proc):
+    proc.kill()
+    proc.wait()
+    assert wait_for_server_info(proc, str(tmp_path), {}, timeout=60) is None
@@ -0,0 +1,130 @@
+"""
+Tests for pyxll_jupyter.sessions.
+"""
+from pyxll_jupyter.sessions import SessionRegistry, format_sessions
+import threading
+import pytest
+
+
+class FakeProcess:
+    pid = 123
+
+    def poll(self):
+        return None
+
+
+def test_pause_and_resume():
+    sessions = SessionRegistry()
+    assert len(sessions) == 0
+    assert not sessions.paused
+
+    sessions.resume("a")
+    sessions.resume("b")
+    assert len(sessions) == 2
+    assert "a" in sessions
+    assert sessions.running_count == 2
+
+    # The kernel is only paused once every session is paused
+    assert sessions.pause("a") is False
+    assert sessions.running_count == 1
+    assert sessions.pause("b") is True
+    assert sessions.paused
+    assert sessions.running_count == 0
+
+    # Pausing twice doesn't change the count
+    assert sessions.pause("b") is True
+    assert sessions.running_count == 0
+
+    sessions.resume("a")
+    assert not sessions.paused
+    assert sessions.running_count == 1
+
+
+def test_release():
+    sessions = SessionRegistry()
+    sessions.resume("a")
+    sessions.update("a", process=FakeProcess(), url="http://localhost:8888/")
+
+    session = sessions.release("a")
+    assert session.token == "a"
+    assert session.url == "http://localhost:8888/"
+    assert "a" not in sessions
+    assert sessions.paused
+    assert sessions.release("a") is None
+
+
+def test_update():
+    sessions = SessionRegistry()
+    process = FakeProcess()
+    sessions.update("a", process=process)
+    sessions.update("b")
+    assert sessions.processes() == {"a": process}
+
+    info = sessions.info("a")
+    assert info["pid"] == 123
+    assert info["process_running"] is True
+    assert sessions.info("b")["pid"] is None
+    assert sessions.info("missing") is None
+
+    with pytest.raises(TypeError):
+        sessions.update("a", paused=True)
+
+
+def test_usage_is_attributed_to_running_sessions():
+    sessions = SessionRegistry()
+    sessions.resume("a")
+    sessions.record_poll(1.0, 2)
+
+    sessions.resume("b")
+    sessions.record_poll(0.5, 1)
+
+    sessions.pause("a")
+    sessions.record_poll(0.25, 4)
+
+    a, b = sessions.info("a"), sessions.info("b")
+    assert (a["kernel_time"], a["messages"]) == (1.5, 3)
+    assert (b["kernel_time"], b["messages"]) == (0.75, 5)
+    assert a["paused"] and not b["paused"]
+    assert b["last_activity"] >= b["started"]
+
+
+def test_hooks():
+    sessions = SessionRegistry()
+    events = []
+    for event in SessionRegistry.events:
+        sessions.add_hook(event, lambda info, event=event: events.append((event, info["token"])))
+
+    def broken(info):
+        raise RuntimeError("Errors in hooks are logged")
+    sessions.add_hook("added", broken)
+
+    sessions.resume("a")
+    sessions.resume("a")
+    sessions.pause("a")
+    sessions.release("a")
+    assert events == [("added", "a"), ("resumed", "a"), ("paused", "a"), ("released", "a")]
+
+    sessions.remove_hook("added", broken)
+    with pytest.raises(ValueError):
+        sessions.add_hook("unknown", broken)
+
+
+def test_wait_while_paused():
+    sessions = SessionRegistry()
+    assert sessions.wait_while_paused() is False
+
+    sessions.pause("a")
+    threading.Timer(0.05, sessions.resume, ("a",)).start()
+    assert sessions.wait_while_paused() is False
+
+
+def test_format_sessions():
+    assert format_sessions([]) == "No sessions."
+
+    sessions = SessionRegistry()
+    sessions.update("a", process=FakeProcess(), url="http://localhost:8888/")
+    sessions.resume("a")
+    text = format_sessions(sessions.list())
+    assert "running" in text
+    assert "123" in text
+    assert "a: http://localhost:8888/" in text